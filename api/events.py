@@ -0,0 +1,151 @@
+import asyncio
+import time
+from typing import NamedTuple, Optional
+import aiohttp
+from config import Config
+from api.transport import CircuitOpenError, backoff
+from services.records import Listing
+from utils.json_codec import loads
+from utils.metrics import metrics
+
+# Виды событий: новая версия лота, снятие лота и потеря позиции в потоке
+UPDATE, REMOVE, RESET = 'update', 'remove', 'reset'
+STREAM_MODES = ('sse', 'poll')
+
+
+class StreamEvent(NamedTuple):
+    """Событие каталога площадки
+
+    id - позиция в потоке для возобновления, item - лот (для remove -
+    последняя известная версия), received - время получения
+    (time.monotonic) для замера задержки реакции.
+    """
+
+    id: Optional[str]
+    kind: str
+    item: Optional[Listing]
+    received: float
+
+
+class EventStream:
+    """Поток событий каталога площадки: SSE или long-poll
+
+    Работает поверх клиента площадки (AsyncMarketplaceClient): тот же
+    токен, транспорт и формат элементов. После обрыва поток переподключается
+    с экспоненциальной задержкой и продолжает с последнего полученного id
+    (Last-Event-ID / after). Если продолжить нельзя - первое подключение,
+    сервер не хранит столько событий или перезапустился - выдается событие
+    reset: пропущенное восстанавливает только полное сканирование.
+    """
+
+    def __init__(self, client, mode: str = None):
+        self.client = client
+        self.mode = mode or Config.STREAM_MODE
+        if self.mode not in STREAM_MODES:
+            raise ValueError(f"Unknown stream mode: {self.mode}")
+        self.url = f"{client.base_url}{client.events_endpoint}"
+        self.last_event_id = None
+        self.reconnects = metrics.counter(
+            'stream_reconnects_total', 'Event stream reconnects', ('market',)
+        ).labels(market=client.service)
+
+    async def events(self):
+        """Бесконечный поток StreamEvent с переподключением"""
+        attempt = 0
+        while True:
+            source = self._sse() if self.mode == 'sse' else self._poll()
+            try:
+                async for event in source:
+                    attempt = 0
+                    yield event
+            except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError,
+                    ValueError, KeyError, TypeError) as e:
+                self.client.logger.warning(f"{self.client.title} event stream error: {str(e)}")
+            finally:
+                await source.aclose()
+            self.reconnects.inc()
+            await asyncio.sleep(backoff(attempt))
+            attempt = min(attempt + 1, 10)
+
+    def _event(self, event_id, kind, item) -> Optional[StreamEvent]:
+        """StreamEvent из полей события; позиция запоминается для возобновления
+
+        Событие неизвестного вида пропускается (None): переподключение
+        из-за него повторялось бы на каждом таком событии.
+        """
+        if event_id:
+            self.last_event_id = event_id
+        if kind not in (UPDATE, REMOVE, RESET):
+            self.client.logger.warning(f"{self.client.title} event stream: unknown event type {kind!r} skipped")
+            return None
+        record = self.client.record(item) if kind != RESET else None
+        return StreamEvent(event_id, kind, record, time.monotonic())
+
+    async def _sse(self):
+        """Один сеанс Server-Sent Events до обрыва соединения"""
+        headers = {**self.client.headers, 'Accept': 'text/event-stream'}
+        resumed = self.last_event_id is not None
+        if resumed:
+            headers['Last-Event-ID'] = self.last_event_id
+        # Соединение живет долго: общий таймаут заменен таймаутом тишины
+        # (сервер шлет комментарии-пинги), дублирующие запросы не нужны
+        timeout = aiohttp.ClientTimeout(
+            total=None, connect=Config.HTTP_TIMEOUT, sock_read=Config.STREAM_IDLE_TIMEOUT
+        )
+        async with await self.client._request(
+            self.url, headers=headers, timeout=timeout, hedge=False
+        ) as response:
+            response.raise_for_status()
+            if not resumed:
+                # Без позиции в потоке все, что было до подключения, неизвестно
+                yield self._event(None, RESET, None)
+            # Сообщение без поля event: - обычное обновление (тип по умолчанию в SSE)
+            event_id, kind, data = None, UPDATE, []
+            # Пока очередь приема заполнена, строки не читаются и сервер
+            # упирается в окно TCP - так работает обратное давление
+            async for raw in response.content:
+                line = raw.decode('utf-8').rstrip('\r\n')
+                if not line:
+                    if kind == RESET:
+                        yield self._event(event_id, kind, None)
+                    elif data:
+                        event = self._event(event_id, kind, loads('\n'.join(data))['item'])
+                        if event is not None:
+                            yield event
+                    event_id, kind, data = None, UPDATE, []
+                    continue
+                if line.startswith(':'):
+                    continue
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'id':
+                    event_id = value
+                elif field == 'event':
+                    kind = value
+                elif field == 'data':
+                    data.append(value)
+
+    async def _poll(self):
+        """Long-poll: запросы с ожиданием новых событий на сервере"""
+        resumed = self.last_event_id is not None
+        timeout = aiohttp.ClientTimeout(total=Config.STREAM_POLL_TIMEOUT + Config.HTTP_TIMEOUT)
+        while True:
+            params = {'timeout': Config.STREAM_POLL_TIMEOUT}
+            if self.last_event_id is not None:
+                params['after'] = self.last_event_id
+            async with await self.client._request(
+                f"{self.url}/poll", params=params, timeout=timeout, hedge=False
+            ) as response:
+                response.raise_for_status()
+                payload = loads(await response.read())
+            if payload.get('reset') or not resumed:
+                # Первый запрос или потерянная позиция: продолжаем с конца потока
+                resumed = True
+                yield self._event(payload.get('last_id'), RESET, None)
+                continue
+            for event in payload.get('events', ()):
+                event = self._event(event['id'], event['type'], event['item'])
+                if event is not None:
+                    yield event
+            if payload.get('last_id'):
+                self.last_event_id = payload['last_id']
@@ -0,0 +1,296 @@
+import asyncio
+import sys
+import aiohttp
+from config import Config
+from api.events import EventStream
+from api.pagination import Page, iter_pages_async
+from api.transport import AsyncTransport, CircuitOpenError
+from services.records import Listing
+from services.token_provider import get_token_provider
+from utils.json_codec import decode_page
+from utils.logger import setup_logger
+
+DEFAULT_HEADERS = {
+    'Accept': 'application/json',
+    'User-Agent': 'NFTArbitrageBot/1.0'
+}
+
+_new_record = tuple.__new__
+_intern = sys.intern
+
+# Названия площадок для сообщений: name -> title (заполняется подклассами Marketplace)
+_titles = {}
+
+
+def market_title(name: str) -> str:
+    """Название площадки для пользователя"""
+    return _titles.get(name, name)
+
+
+class FeeModel:
+    """Комиссии площадки
+
+    buy - доля сверх цены при покупке, sell - доля, удерживаемая при
+    продаже, withdraw - фиксированная плата за вывод купленного NFT (TON).
+    Методы работают и с числами, и с массивами numpy.
+    """
+
+    def __init__(self, buy: float = 0.0, sell: float = 0.0, withdraw: float = 0.0):
+        self.buy = buy
+        self.sell = sell
+        self.withdraw = withdraw
+
+    @classmethod
+    def from_config(cls, market: str):
+        return cls(**Config.MARKET_FEES.get(market, {}))
+
+    def buy_price(self, price):
+        """Цена покупки с комиссией площадки"""
+        return price * (1 + self.buy)
+
+    def cost(self, price):
+        """Полные затраты на покупку с выводом NFT"""
+        return price * (1 + self.buy) + self.withdraw
+
+    def proceeds(self, price):
+        """Выручка от продажи после комиссии"""
+        return price * (1 - self.sell)
+
+
+class Marketplace:
+    """Адаптер площадки для калькулятора арбитража
+
+    Описывает комиссии площадки и можно ли на ней продать купленный NFT.
+    Новая площадка - подкласс с этими атрибутами и iter_pages(), выдающим
+    страницы каталога в виде записей Listing (см. CatalogFormat).
+    """
+
+    name = None
+    title = None
+    # Можно ли продать NFT по floor-цене этой площадки
+    sellable = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.name:
+            _titles[cls.name] = cls.title or cls.name
+
+    def __init__(self, client=None, fees: FeeModel = None):
+        self.client = client
+        self.fees = fees or FeeModel.from_config(self.name)
+
+    def iter_pages(self, stripe: int = 0, stripes: int = 1):
+        """Асинхронный поток страниц каталога (только полоса stripe из stripes)"""
+        raise NotImplementedError
+
+    @property
+    def last_scan_complete(self) -> bool:
+        return self.client.last_scan_complete
+
+    def event_stream(self):
+        """Поток событий каталога (api.events.EventStream) или None, если площадка его не дает"""
+        if self.client is None or not getattr(self.client, 'events_endpoint', None):
+            return None
+        return EventStream(self.client)
+
+
+class CatalogFormat:
+    """Формат элементов каталога в ответах API площадки
+
+    items_field - поле со списком элементов, id_field и price_field - поля
+    идентификатора NFT и цены, ref_field - идентификатор предложения на
+    площадке, если он нужен для точечных запросов.
+    """
+
+    items_field = 'items'
+    id_field = 'id'
+    price_field = 'price'
+    ref_field = None
+
+    def record(self, item: dict) -> Listing:
+        """Элемент ответа API -> Listing
+
+        Названия коллекций и моделей повторяются у тысяч лотов, поэтому
+        строки интернируются: в снимках хранится одна копия на модель.
+        """
+        get = item.get
+        name, model = get('name'), get('model')
+        # tuple.__new__ минует Python-конструктор NamedTuple: запись создается на каждый лот
+        return _new_record(Listing, (
+            item[self.id_field],
+            _intern(name) if name is not None else None,
+            _intern(model) if model is not None else None,
+            get(self.price_field) or 0.0,
+            get('end_time') or 0,
+            get(self.ref_field) if self.ref_field else None,
+        ))
+
+
+class AsyncMarketplaceClient(CatalogFormat):
+    """Асинхронный клиент каталога площадки (aiohttp)
+
+    Подкласс задает service (имя токена), title, endpoint каталога,
+    формат элементов (CatalogFormat) и _auth_headers().
+    events_endpoint - путь потока событий каталога (SSE, long-poll по
+    <путь>/poll), если площадка его дает.
+    """
+
+    service = None
+    title = None
+    endpoint = None
+    events_endpoint = None
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.tokens = get_token_provider()
+        self.logger = setup_logger(f'{self.service}_api')
+        self.headers = dict(DEFAULT_HEADERS)
+        self._session = None
+        # Кэш страниц для условных запросов: ключ -> (ETag, Last-Modified, страница, мета-поля).
+        # Записи неизменяемы, поэтому страница из кэша общая со снимками калькулятора
+        self._page_cache = {}
+        self._page_errors = 0
+        self.last_scan_complete = True
+        # Лимит на хост, повторы, размыкатель цепи и хеджирование медленных ответов
+        self.transport = AsyncTransport(self._get_session)
+
+    @property
+    def request_count(self) -> int:
+        """Всего отправленных запросов, включая повторы и дублирующие"""
+        return self.transport.request_count
+
+    @staticmethod
+    def _auth_headers(token: str) -> dict:
+        """Заголовок авторизации для токена"""
+        raise NotImplementedError
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Ленивое создание сессии внутри работающего event loop"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=Config.HTTP_TIMEOUT)
+            )
+        return self._session
+
+    async def _request(self, url: str, headers: dict = None, **kwargs):
+        """GET с токеном; при 401 токен обновляется и запрос повторяется один раз"""
+        headers = dict(headers or self.headers)
+        token = await self.tokens.get_async(self.service)
+        response = await self.transport.get(
+            url, headers={**headers, **self._auth_headers(token)}, **kwargs
+        )
+        if response.status == 401:
+            response.release()
+            self.logger.info(f"Refreshing {self.title} token")
+            token = await self.tokens.refresh_async(self.service, stale=token)
+            if token:
+                response = await self.transport.get(
+                    url, headers={**headers, **self._auth_headers(token)}, **kwargs
+                )
+        return response
+
+    @staticmethod
+    def _page_params(offset: int, cursor: str = None) -> dict:
+        """Параметры запроса страницы (курсор приоритетнее offset)"""
+        params = {'status': 'active', 'limit': Config.API_PAGE_SIZE}
+        if cursor:
+            params['cursor'] = cursor
+        else:
+            params['offset'] = offset
+        return params
+
+    async def _fetch_page(self, offset: int = 0, cursor: str = None):
+        """Загрузка одной страницы: (записи, мета-поля) или None при ошибке
+
+        Повторные запросы страницы идут с If-None-Match / If-Modified-Since:
+        на ответ 304 возвращается закэшированная страница с not_modified=True
+        без передачи и разбора тела.
+        """
+        cache_key = (offset, cursor)
+        cached = self._page_cache.get(cache_key)
+        headers = dict(self.headers)
+        if cached:
+            etag, last_modified, _, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        try:
+            async with await self._request(
+                f"{self.base_url}{self.endpoint}",
+                headers=headers,
+                params=self._page_params(offset, cursor)
+            ) as response:
+                if response.status == 304 and cached:
+                    page = Page(cached[2])
+                    page.not_modified = True
+                    return page, cached[3]
+
+                response.raise_for_status()
+                body = await response.read()
+                records, meta = decode_page(body, self.items_field, self.record, self._skip_item)
+                del body
+                page = Page(records)
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                if etag or last_modified:
+                    self._page_cache[cache_key] = (etag, last_modified, page, meta)
+                return page, meta
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError, ValueError) as e:
+            self.logger.error(f"{self.title} API error: {str(e)}")
+            return None
+
+    def _count_page_error(self):
+        """Страница не получена после всех повторов - обход неполный"""
+        self._page_errors += 1
+
+    def _skip_item(self, item, error):
+        """Поврежденный элемент пропускается; без него обход тоже неполный"""
+        self.logger.warning(f"{self.title} API: malformed catalog item skipped ({error!r})")
+        self._page_errors += 1
+
+    async def iter_catalog(self, stripe: int = 0, stripes: int = 1):
+        """Поток страниц каталога: страницы грузятся параллельно"""
+        self._page_errors = 0
+        async for page in iter_pages_async(
+            self._fetch_page, stripe=stripe, stripes=stripes, on_failed_page=self._count_page_error
+        ):
+            yield page
+        # Неполный обход нельзя использовать для определения удаленных лотов
+        self.last_scan_complete = self._page_errors == 0
+
+    async def close(self):
+        """Закрытие HTTP-сессии"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class MarketplaceClient:
+    """Синхронный клиент площадки для кода вне event loop
+
+    Тонкая обертка над асинхронным клиентом (async_client - его класс):
+    каждый вызов выполняется через asyncio.run. Сессия aiohttp привязана
+    к event loop, поэтому закрывается в конце вызова; кэш страниц (ETag)
+    и состояние токена сохраняются между вызовами. Внутри работающего
+    event loop нужен асинхронный клиент.
+    """
+
+    async_client = None
+
+    def __init__(self):
+        self.client = self.async_client()
+
+    @property
+    def last_scan_complete(self) -> bool:
+        return self.client.last_scan_complete
+
+    def _run(self, method, *args):
+        """Вызов метода асинхронного клиента до завершения"""
+        async def call():
+            try:
+                return await method(*args)
+            finally:
+                await self.client.close()
+
+        return asyncio.run(call())
@@ -0,0 +1,132 @@
+import asyncio
+from config import Config
+from api.transport import backoff
+
+
+class Page(list):
+    """Страница каталога; not_modified=True, если сервер ответил 304"""
+    not_modified = False
+
+
+def _has_more(items, meta, offset, page_size):
+    """Проверка, есть ли страницы после текущей"""
+    total = meta.get('total')
+    if total is not None:
+        return offset + page_size < total
+    return len(items) >= page_size
+
+
+async def _fetch_retrying(fetch_page, offset, cursor):
+    """Страница с повторами; None - все API_PAGE_RETRIES попыток неудачны"""
+    for attempt in range(Config.API_PAGE_RETRIES + 1):
+        result = await fetch_page(offset, cursor)
+        if result is not None or attempt == Config.API_PAGE_RETRIES:
+            return result
+        await asyncio.sleep(backoff(attempt))
+
+
+async def iter_pages_async(fetch_page, page_size=None, concurrency=None, max_pages=None,
+                           stripe=0, stripes=1, on_failed_page=None):
+    """Параллельная загрузка страниц с ограничением одновременных запросов
+
+    Страницы отдаются по мере готовности, а не по порядку, поэтому
+    потребитель может начинать обработку до прихода последней страницы.
+    Окно запросов скользящее: на место завершенной страницы сразу
+    запускается следующая, пока API не вернет неполную страницу.
+    Страница, не полученная и после повторов, пропускается (ошибку видит
+    клиент через on_failed_page() и не считает обход полным); обход
+    прерывается только после API_MAX_FAILED_PAGES таких страниц подряд.
+
+    stripe/stripes - обход только страниц с номером stripe по модулю
+    stripes: так несколько процессов делят каталог без пересечений.
+    """
+    page_size = page_size or Config.API_PAGE_SIZE
+    concurrency = concurrency or Config.API_MAX_CONCURRENT_PAGES
+    max_pages = max_pages or Config.API_MAX_PAGES
+
+    first_offset = stripe * page_size
+    first = await _fetch_retrying(fetch_page, first_offset, None)
+    if first is None:
+        if on_failed_page:
+            on_failed_page()
+        return
+    items, meta = first
+
+    # Курсорная пагинация не распараллеливается: следующий курсор известен
+    # только после получения страницы. Между полосами она не делится -
+    # весь каталог обходит нулевая полоса
+    cursor = meta.get('next_cursor')
+    if cursor and stripe:
+        return
+    if items:
+        yield items
+
+    if cursor:
+        for _ in range(max_pages - 1):
+            result = await _fetch_retrying(fetch_page, 0, cursor)
+            if result is None:
+                if on_failed_page:
+                    on_failed_page()
+                return
+            items, meta = result
+            if items:
+                yield items
+            cursor = meta.get('next_cursor')
+            if not cursor:
+                return
+        return
+
+    if not _has_more(items, meta, first_offset, page_size):
+        return
+
+    total = meta.get('total')
+    if total is not None:
+        end_offset = min(total, max_pages * page_size)
+    else:
+        end_offset = max_pages * page_size
+
+    pending = {}
+    step = page_size * stripes
+    next_offset = first_offset + step
+    failures = 0
+
+    def launch():
+        nonlocal next_offset
+        while len(pending) < concurrency and next_offset < end_offset:
+            task = asyncio.ensure_future(_fetch_retrying(fetch_page, next_offset, None))
+            pending[task] = next_offset
+            next_offset += step
+
+    launch()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                offset = pending.pop(task)
+                result = task.result()
+                if result is None:
+                    # Ошибка - не конец каталога: следующие страницы грузятся дальше
+                    failures += 1
+                    if on_failed_page:
+                        on_failed_page()
+                    if failures >= Config.API_MAX_FAILED_PAGES:
+                        return
+                    continue
+                failures = 0
+                items, meta = result
+                if not _has_more(items, meta, offset, page_size):
+                    # Конец каталога: дальше этой страницы не идем
+                    end_offset = min(end_offset, offset + page_size)
+                    next_offset = min(next_offset, end_offset)
+                if items:
+                    yield items
+
+            # Отменяем запросы, которые оказались за концом каталога
+            for task, offset in list(pending.items()):
+                if offset >= end_offset:
+                    task.cancel()
+                    pending.pop(task)
+            launch()
+    finally:
+        for task in pending:
+            task.cancel()
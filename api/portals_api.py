@@ -1,47 +1,48 @@
-import requests
-import logging
-from datetime import datetime
 from config import Config
-from database import DatabaseManager
-from utils.logger import setup_logger
+from api.marketplace import AsyncMarketplaceClient, Marketplace, MarketplaceClient
 
-logger = setup_logger('portals_api')
 
-class PortalsAPI:
-    """API клиент для Portals Market"""
-    
+class AsyncPortalsAPI(AsyncMarketplaceClient):
+    """Асинхронный API клиент для Portals Market (aiohttp)"""
+
+    service = 'portals'
+    title = 'Portals'
+    endpoint = '/gifts'
+    events_endpoint = '/events'
+    items_field = 'data'
+
     def __init__(self):
-        self.base_url = Config.PORTALS_API_URL
-        self.db = DatabaseManager()
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Accept': 'application/json',
-            'User-Agent': 'NFTArbitrageBot/1.0'
-        })
-        self._refresh_token()
-
-    def _refresh_token(self):
-        """Обновление токена авторизации"""
-        token = self.db.get_auth_token('portals')
-        if token:
-            self.session.headers.update({'Authorization': f'Bearer {token}'})
-        else:
-            logger.warning("Portals API token not found in database")
+        super().__init__(Config.PORTALS_API_URL)
+
+    @staticmethod
+    def _auth_headers(token: str) -> dict:
+        return {'Authorization': f'Bearer {token}'} if token else {}
+
+    def iter_active_gifts(self):
+        """Поток страниц активных NFT-подарков"""
+        return self.iter_catalog()
+
+    async def get_active_gifts(self):
+        """Получение активных NFT-подарков (весь каталог)"""
+        return [item async for page in self.iter_active_gifts() for item in page]
+
+
+class PortalsMarket(Marketplace):
+    """Portals: лоты с фиксированной ценой; floor модели - цена продажи"""
+
+    name = 'portals'
+    title = 'Portals'
+    sellable = True
+
+    def iter_pages(self, stripe: int = 0, stripes: int = 1):
+        return self.client.iter_catalog(stripe, stripes)
+
+
+class PortalsAPI(MarketplaceClient):
+    """Синхронный API клиент для Portals Market (обертка над AsyncPortalsAPI)"""
+
+    async_client = AsyncPortalsAPI
 
     def get_active_gifts(self):
-        """Получение активных NFT-подарков"""
-        try:
-            response = self.session.get(
-                f"{self.base_url}/gifts",
-                params={'status': 'active', 'limit': 100},
-                timeout=15
-            )
-            response.raise_for_status()
-            return response.json().get('data', [])
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Portals API error: {str(e)}")
-            if e.response.status_code == 401:
-                logger.info("Refreshing Portals token")
-                # Здесь должна быть логика обновления токена через OAuth
-                self._refresh_token()
-            return []
+        """Получение активных NFT-подарков (весь каталог)"""
+        return self._run(self.client.get_active_gifts)
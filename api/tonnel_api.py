@@ -1,46 +1,82 @@
-import requests
-import logging
+import asyncio
+import aiohttp
 from config import Config
-from database import DatabaseManager
-from utils.logger import setup_logger
+from api.marketplace import AsyncMarketplaceClient, Marketplace, MarketplaceClient
+from api.transport import CircuitOpenError
+from utils.json_codec import loads
 
-logger = setup_logger('tonnel_api')
 
-class TonnelAPI:
-    """API клиент для Tonnel Relayer Bot"""
-    
+class AsyncTonnelAPI(AsyncMarketplaceClient):
+    """Асинхронный API клиент для Tonnel Relayer Bot (aiohttp)"""
+
+    service = 'tonnel'
+    title = 'Tonnel'
+    endpoint = '/auctions'
+    events_endpoint = '/events'
+    items_field = 'items'
+    id_field = 'gift_id'
+    price_field = 'current_bid'
+    ref_field = 'id'
+
     def __init__(self):
-        self.base_url = Config.TONNEL_API_URL
-        self.db = DatabaseManager()
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Accept': 'application/json',
-            'User-Agent': 'NFTArbitrageBot/1.0'
-        })
-        self._refresh_token()
-
-    def _refresh_token(self):
-        """Обновление токена авторизации"""
-        token = self.db.get_auth_token('tonnel')
-        if token:
-            self.session.headers.update({'X-Auth-Token': token})
-        else:
-            logger.warning("Tonnel API token not found in database")
+        super().__init__(Config.TONNEL_API_URL)
 
-    def get_auction_gifts(self):
-        """Получение NFT на аукционах"""
+    @staticmethod
+    def _auth_headers(token: str) -> dict:
+        return {'X-Auth-Token': token} if token else {}
+
+    def iter_auction_gifts(self):
+        """Поток страниц NFT на аукционах"""
+        return self.iter_catalog()
+
+    async def get_auction_gifts(self):
+        """Получение NFT на аукционах (весь каталог)"""
+        return [item async for page in self.iter_auction_gifts() for item in page]
+
+    async def get_auction(self, auction_id, gift_id=None):
+        """Точечная загрузка одного аукциона
+
+        Возвращает (ok, auction): ok=False при ошибке запроса,
+        auction=None, если аукцион завершен или снят, иначе Listing.
+        Если в ответе нет id NFT, берется gift_id (или auction_id).
+        """
         try:
-            response = self.session.get(
-                f"{self.base_url}/auctions",
-                params={'status': 'active', 'limit': 100},
-                timeout=15
-            )
-            response.raise_for_status()
-            return response.json().get('items', [])
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Tonnel API error: {str(e)}")
-            if e.response.status_code == 401:
-                logger.info("Refreshing Tonnel token")
-                # Логика обновления токена
-                self._refresh_token()
-            return []
+            async with await self._request(f"{self.base_url}/auctions/{auction_id}") as response:
+                if response.status == 404:
+                    return True, None
+                response.raise_for_status()
+                payload = loads(await response.read())
+                auction = payload.get('item', payload)
+                if auction.get('status', 'active') != 'active':
+                    return True, None
+                if auction.get(self.id_field) is None:
+                    auction[self.id_field] = gift_id if gift_id is not None else auction_id
+                return True, self.record(auction)
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError,
+                KeyError, TypeError, ValueError) as e:
+            self.logger.error(f"Tonnel API error: {str(e)}")
+            return False, None
+
+
+class TonnelMarket(Marketplace):
+    """Tonnel: аукционы; покупка по текущей ставке до окончания"""
+
+    name = 'tonnel'
+    title = 'Tonnel'
+
+    def iter_pages(self, stripe: int = 0, stripes: int = 1):
+        return self.client.iter_catalog(stripe, stripes)
+
+
+class TonnelAPI(MarketplaceClient):
+    """Синхронный API клиент для Tonnel Relayer Bot (обертка над AsyncTonnelAPI)"""
+
+    async_client = AsyncTonnelAPI
+
+    def get_auction_gifts(self):
+        """Получение NFT на аукционах (весь каталог)"""
+        return self._run(self.client.get_auction_gifts)
+
+    def get_auction(self, auction_id, gift_id=None):
+        """Точечная загрузка одного аукциона: (ok, Listing или None)"""
+        return self._run(self.client.get_auction, auction_id, gift_id)
@@ -0,0 +1,272 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import aiohttp
+from config import Config
+from utils.logger import setup_logger
+from utils.metrics import metrics
+from utils.rate_limit import TokenBucket
+
+logger = setup_logger('transport')
+
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """Хост временно исключен из опроса после серии ошибок"""
+
+
+class CircuitBreaker:
+    """Размыкатель цепи для одного хоста
+
+    После CIRCUIT_FAILURE_THRESHOLD ошибок подряд запросы к хосту не
+    отправляются CIRCUIT_RESET_TIMEOUT секунд. Затем пропускается один
+    пробный запрос: успех замыкает цепь, ошибка размыкает ее снова.
+    Пробный запрос, прерванный без результата (отмена, непредвиденное
+    исключение), размыкает цепь еще на CIRCUIT_RESET_TIMEOUT.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Пробный запрос; остальные ждут его результата
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def abort_probe(self):
+        """Пробный запрос завершился без ответа хоста"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit opened after {self._failures} failures")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class HostState:
+    """Общие для всех клиентов лимит, размыкатель и статистика задержек хоста"""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.bucket = TokenBucket(rate=Config.HTTP_RATE_LIMIT, capacity=Config.HTTP_RATE_BURST)
+        self.breaker = CircuitBreaker(Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_TIMEOUT)
+        self._latencies = deque(maxlen=Config.HEDGE_WINDOW)
+        self.latency = metrics.histogram(
+            'http_request_duration_seconds', 'Marketplace API request latency', ('host',)
+        ).labels(host=host)
+        self._requests = metrics.counter(
+            'http_requests_total', 'Marketplace API requests by response status', ('host', 'status')
+        )
+        self.retries = metrics.counter(
+            'http_retries_total', 'Marketplace API request retries', ('host',)
+        ).labels(host=host)
+        self.hedges = metrics.counter(
+            'http_hedged_requests_total', 'Duplicate requests sent after the p95 delay', ('host',)
+        ).labels(host=host)
+
+    def observe(self, seconds: float, status):
+        """Учет завершенного запроса (status - код ответа или 'error')"""
+        self._requests.labels(host=self.host, status=status).inc()
+        if status != 'error':
+            self._latencies.append(seconds)
+            self.latency.observe(seconds)
+
+    def hedge_delay(self):
+        """p95 последних ответов или None, пока статистики недостаточно"""
+        if len(self._latencies) < Config.HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+
+    def pause(self, seconds: float):
+        """Остановка запросов к хосту: запас ведра сгорает, и оно уходит в долг на указанное время"""
+        self.bucket.consume(max(self.bucket.tokens, 0) + seconds * self.bucket.rate)
+
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+
+def host_state(url: str) -> HostState:
+    """Состояние хоста, общее для всех клиентов и потоков событий"""
+    host = urlsplit(url).netloc
+    with _hosts_lock:
+        state = _hosts.get(host)
+        if state is None:
+            state = _hosts[host] = HostState(host)
+        return state
+
+
+def retry_after(headers) -> float:
+    """Значение Retry-After в секундах (число или HTTP-дата), 0 при отсутствии"""
+    value = headers.get('Retry-After')
+    if not value:
+        return 0.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def backoff(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером"""
+    return random.uniform(0, min(Config.HTTP_BACKOFF_MAX, Config.HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_delay(host: HostState, status: int, headers, attempt: int):
+    """Задержка перед повтором или None, если ответ нужно вернуть клиенту"""
+    if status not in RETRY_STATUSES:
+        host.breaker.record_success()
+        return None
+    wait = retry_after(headers)
+    if status == 429:
+        # Троттлинг - не отказ хоста, но притормаживает всех его клиентов
+        host.pause(wait or backoff(attempt))
+    else:
+        host.breaker.record_failure()
+    if attempt == Config.HTTP_MAX_RETRIES or wait > Config.HTTP_MAX_RETRY_AFTER:
+        return None
+    logger.warning(f"{host.host}: HTTP {status}, retry {attempt + 1}")
+    return max(wait, backoff(attempt))
+
+
+class AsyncTransport:
+    """Асинхронный транспорт поверх aiohttp
+
+    Лимит запросов на хост, повторы при 429/5xx и сетевых ошибках с
+    экспоненциальной задержкой (не меньше Retry-After) и размыкатель цепи.
+    Возвращает последний ответ - проверку статуса выполняет клиент.
+    Дополнительно поддерживает хеджирование идемпотентных GET: если ответ
+    не пришел за p95 недавних задержек хоста, отправляется дублирующий
+    запрос и используется первый ответ.
+    """
+
+    def __init__(self, get_session):
+        self._get_session = get_session
+        self.request_count = 0
+
+    async def get(self, url: str, hedge: bool = None, **kwargs) -> aiohttp.ClientResponse:
+        """Ответ для использования в async with (освобождение - на вызывающем)
+
+        hedge=None - по Config.HTTP_HEDGE на момент вызова.
+        """
+        if hedge is None:
+            hedge = Config.HTTP_HEDGE
+        host = host_state(url)
+        for attempt in range(Config.HTTP_MAX_RETRIES + 1):
+            if not host.breaker.allow():
+                raise CircuitOpenError(host.host)
+            # В полуоткрытом состоянии пропускается только этот запрос
+            probe = host.breaker.state == CircuitBreaker.HALF_OPEN
+            try:
+                if hedge:
+                    response = await self._hedged(host, url, **kwargs)
+                else:
+                    response = await self._attempt(host, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                host.breaker.record_failure()
+                if attempt == Config.HTTP_MAX_RETRIES:
+                    raise
+                logger.warning(f"{host.host}: {type(e).__name__}, retry {attempt + 1}")
+                host.retries.inc()
+                await asyncio.sleep(backoff(attempt))
+                continue
+            except BaseException:
+                # Отмена (например, страница за концом каталога) или ошибка
+                # запроса без ответа хоста: иначе цепь осталась бы полуоткрытой
+                if probe:
+                    host.breaker.abort_probe()
+                raise
+
+            delay = retry_delay(host, response.status, response.headers, attempt)
+            if delay is None:
+                return response
+            response.release()
+            host.retries.inc()
+            await asyncio.sleep(delay)
+        return response
+
+    async def _attempt(self, host: HostState, url: str, **kwargs):
+        await host.bucket.acquire_async()
+        self.request_count += 1
+        started = time.monotonic()
+        try:
+            response = await self._get_session().get(url, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            host.observe(time.monotonic() - started, 'error')
+            raise
+        host.observe(time.monotonic() - started, response.status)
+        return response
+
+    async def _hedged(self, host: HostState, url: str, **kwargs):
+        """Запрос с дублированием после задержки p95"""
+        delay = host.hedge_delay()
+        primary = asyncio.ensure_future(self._attempt(host, url, **kwargs))
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        host.hedges.inc()
+        pending = {primary, asyncio.ensure_future(self._attempt(host, url, **kwargs))}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif winner is None:
+                    winner = task.result()
+                else:
+                    task.result().release()
+            if winner is not None:
+                for task in pending:
+                    self._discard(task)
+                return winner
+        raise error
+
+    @staticmethod
+    def _discard(task):
+        """Отмена проигравшего запроса с освобождением соединения"""
+        def release(finished):
+            if not finished.cancelled() and finished.exception() is None:
+                finished.result().release()
+
+        task.add_done_callback(release)
+        task.cancel()
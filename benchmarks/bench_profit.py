@@ -0,0 +1,69 @@
+"""Сравнение скалярного и векторного расчета прибыли
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_profit
+"""
+import random
+import time
+import numpy as np
+from services.arbitrage import ArbitrageCalculator
+
+SIZES = (10_000, 100_000)
+REPEATS = 5
+
+
+def _generate(count: int, seed: int = 42):
+    """Случайные колонки ставок и цен продажи"""
+    rnd = random.Random(seed)
+    bids = [round(rnd.uniform(0.5, 60), 2) for _ in range(count)]
+    asks = [round(bid * rnd.uniform(0.8, 1.6), 2) for bid in bids]
+    return bids, asks
+
+
+def _best_of(func, repeats=REPEATS):
+    """Минимальное время из нескольких прогонов"""
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run():
+    calc = ArbitrageCalculator()
+
+    for count in SIZES:
+        bids, asks = _generate(count)
+        bids_arr = np.array(bids)
+        asks_arr = np.array(asks)
+
+        def scalar():
+            return [
+                (calc.calculate_profit(bid, ask), calc._determine_price_range(bid))
+                for bid, ask in zip(bids, asks)
+            ]
+
+        def batch():
+            return calc.calculate_profit_batch(bids_arr, asks_arr)
+
+        # Проверка совпадения результатов
+        expected = scalar()
+        profits, ranges = batch()
+        labels = calc.price_range_labels
+        assert all(
+            p == e[0] and labels[r] == e[1]
+            for p, r, e in zip(profits.tolist(), ranges.tolist(), expected)
+        ), "batch results differ from calculate_profit"
+
+        scalar_time = _best_of(scalar)
+        batch_time = _best_of(batch)
+        print(
+            f"{count:>7} items: scalar {scalar_time * 1000:8.2f} ms, "
+            f"batch {batch_time * 1000:8.2f} ms, "
+            f"speedup x{scalar_time / batch_time:.1f}"
+        )
+
+
+if __name__ == '__main__':
+    run()
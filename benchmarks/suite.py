@@ -0,0 +1,299 @@
+"""Сквозной бенчмарк: цикл сканирования, запись в SQLite и обработчики бота
+
+Запуск из корня проекта:
+    python -m benchmarks.suite --sizes 1000 10000 100000 --output bench.json
+    python -m benchmarks.suite --output new.json --baseline bench.json
+    python -m benchmarks.suite --sizes 100000 --shards 1 2 4 8
+
+Маркетплейсы заменяются заглушками dev.stub_server, запущенными в
+отдельном процессе, чтобы сервер не делил GIL с измеряемым кодом.
+Результаты сохраняются плоским JSON-словарем; с --baseline времена
+сравниваются с прошлым прогоном, и при замедлении больше --tolerance
+процесс завершается с кодом 1.
+"""
+import os
+import tempfile
+
+# Config читает окружение при импорте, поэтому настройки прогона задаются
+# до импорта модулей бота: отдельная БД, без истории цен, без лимита
+# запросов к заглушкам и крупные страницы для больших каталогов
+_WORKDIR = tempfile.mkdtemp(prefix='arbitrage-bench-')
+os.environ.setdefault('DB_PATH', os.path.join(_WORKDIR, 'bench.db'))
+os.environ.setdefault('HISTORY_ENABLED', '0')
+os.environ.setdefault('HTTP_RATE_LIMIT', '100000')
+os.environ.setdefault('HTTP_HEDGE', '0')
+os.environ.setdefault('API_PAGE_SIZE', '500')
+os.environ.setdefault('API_MAX_PAGES', '1000')
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime
+from types import SimpleNamespace
+from bot.handlers import BotHandlers
+from database import DatabaseManager, get_database
+from services.records import Opportunity
+from services.scheduler import DataScheduler
+from services.sharding import ShardedScanner
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+class StubProcess:
+    """dev.stub_server в дочернем процессе; адреса читаются из его вывода"""
+
+    def __init__(self, listings: int, seed: int = 1):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'dev.stub_server', '--port', '0',
+             '--listings', str(listings), '--seed', str(seed),
+             # Постоянная плотность лотов на модель при любом размере каталога
+             '--models', str(max(listings // 50, 20))],
+            cwd=ROOT, stdout=subprocess.PIPE, text=True
+        )
+        urls = dict(self.process.stdout.readline().strip().split('=', 1) for _ in range(2))
+        self.portals_url = urls['PORTALS_API_URL']
+        self.tonnel_url = urls['TONNEL_API_URL']
+        self.base_url = self.portals_url.rsplit('/portals/', 1)[0]
+
+    def tick(self):
+        request = urllib.request.Request(f"{self.base_url}/control/tick", data=b'', method='POST')
+        # urlopen сам поднимает HTTPError на ответ с ошибкой
+        with urllib.request.urlopen(request, timeout=30):
+            pass
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+async def _median_time_async(func, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await func()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def _fake_update(chat_id: int = 1):
+    """Минимальный апдейт callback-кнопки: ответ боту ничего не отправляет"""
+    async def edit_message_text(*args, **kwargs):
+        return None
+
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=chat_id),
+        callback_query=SimpleNamespace(edit_message_text=edit_message_text),
+    )
+
+
+def bench_scan(size: int, repeats: int) -> dict:
+    """Полный и инкрементальный цикл сканирования и отклик обработчика"""
+    stub = StubProcess(size)
+    scheduler = DataScheduler(None)
+    scheduler.async_portals_api.base_url = stub.portals_url
+    scheduler.async_tonnel_api.base_url = stub.tonnel_url
+    handlers = BotHandlers(scheduler, None)
+    scheduler.db = handlers.db = get_database(os.path.join(_WORKDIR, f'scan_{size}.db'))
+
+    async def run():
+        try:
+            started = time.perf_counter()
+            count = await scheduler.update_async()
+            cold = time.perf_counter() - started
+            calc = scheduler.arbitrage_calc
+            items = sum(len(calc.snapshot(name)) for name in calc.markets)
+
+            delta_times = []
+            for _ in range(repeats):
+                await asyncio.to_thread(stub.tick)
+                started = time.perf_counter()
+                await scheduler.update_async()
+                delta_times.append(time.perf_counter() - started)
+
+            update = _fake_update()
+
+            async def handler_cold():
+                scheduler.cache.bump()
+                await handlers.show_arbitrage(update, None)
+
+            async def handler_warm():
+                await handlers.show_arbitrage(update, None)
+
+            return {
+                'items': items,
+                'opportunities': count,
+                'cold_scan_seconds': cold,
+                'delta_scan_seconds': statistics.median(delta_times),
+                'items_per_second': items / cold if cold else 0.0,
+                'handler_cold_seconds': await _median_time_async(handler_cold, repeats),
+                'handler_warm_seconds': await _median_time_async(handler_warm, repeats),
+                # Пик процесса с начала прогона: размеры идут по возрастанию, так что это пик текущего
+                'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            }
+        finally:
+            await scheduler.async_portals_api.close()
+            await scheduler.async_tonnel_api.close()
+
+    try:
+        return asyncio.run(run())
+    finally:
+        stub.stop()
+
+
+def bench_sharded(size: int, repeats: int, shard_counts) -> dict:
+    """Полный цикл в шардированном режиме для разного числа процессов
+
+    Процессы шардов создают клиентов сами, поэтому адреса заглушек
+    передаются им через окружение. Первое сканирование каждого пула
+    холодное, повторные идут по кэшу ETag неизменного каталога.
+    """
+    stub = StubProcess(size)
+    os.environ['PORTALS_API_URL'] = stub.portals_url
+    os.environ['TONNEL_API_URL'] = stub.tonnel_url
+    results = {}
+
+    async def run(scanner):
+        started = time.perf_counter()
+        count, _ = await scanner.scan()
+        cold = time.perf_counter() - started
+        warm = await _median_time_async(scanner.scan, repeats)
+        return count, cold, warm
+
+    try:
+        for shards in shard_counts:
+            scanner = ShardedScanner(shards, db_path=os.path.join(_WORKDIR, f'sharded_{size}_{shards}.db'))
+            try:
+                # Процессы импортируют модули бота в фоне: холодный замер включает их запуск
+                scanner.start()
+                count, cold, warm = asyncio.run(run(scanner))
+            finally:
+                scanner.close()
+            results[f'shards_{shards}_opportunities'] = count
+            results[f'shards_{shards}_cold_seconds'] = cold
+            results[f'shards_{shards}_warm_seconds'] = warm
+        return results
+    finally:
+        stub.stop()
+
+
+def _opportunity(rnd: random.Random, nft_id: int):
+    bid = round(rnd.uniform(1, 50), 2)
+    ask = round(bid * rnd.uniform(1.1, 1.5), 2)
+    return Opportunity(
+        nft_id, f"Collection {nft_id % 20}", f"Model {nft_id % 200}",
+        int(time.time()) + rnd.randrange(300, 86400), bid, ask, bid * 1.06,
+        ask * 0.95 - bid * 1.06 - 0.22, '5-10', 'tonnel', 'portals'
+    )
+
+
+def bench_sqlite(size: int, repeats: int) -> dict:
+    """Стоимость записи возможностей: вставка, обновление 10% и удаление 10%"""
+    rnd = random.Random(size)
+    count = max(size // 5, 1)
+    changed_count = max(count // 10, 1)
+    opportunities = [_opportunity(rnd, nft_id) for nft_id in range(count)]
+    inserts, updates, deletes = [], [], []
+    for attempt in range(repeats):
+        db = DatabaseManager(os.path.join(_WORKDIR, f'sqlite_{size}_{attempt}.db'))
+        started = time.perf_counter()
+        db.save_arbitrage_opportunities(opportunities)
+        inserts.append(time.perf_counter() - started)
+
+        changed = [_opportunity(rnd, nft_id) for nft_id in rnd.sample(range(count), changed_count)]
+        started = time.perf_counter()
+        db.save_arbitrage_opportunities(changed)
+        updates.append(time.perf_counter() - started)
+
+        removed = rnd.sample(range(count), changed_count)
+        started = time.perf_counter()
+        db.save_arbitrage_opportunities([], removed=removed)
+        deletes.append(time.perf_counter() - started)
+        db.close()
+    return {
+        'rows': count,
+        'insert_seconds': statistics.median(inserts),
+        'update_seconds': statistics.median(updates),
+        'delete_seconds': statistics.median(deletes),
+        'rows_per_second': count / statistics.median(inserts),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Метрики времени, выросшие больше чем на tolerance относительно базы"""
+    regressions = []
+    for name, value in results.items():
+        previous = baseline.get(name)
+        if name.endswith('_seconds') and previous and value > previous * (1 + tolerance):
+            regressions.append((name, previous, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks against local market stubs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='Portals listings')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', default='bench-results.json')
+    parser.add_argument('--baseline', help='Previous results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown, share')
+    parser.add_argument('--shards', type=int, nargs='*', default=[],
+                        help='Also run the sharded scan with these process counts')
+    args = parser.parse_args(argv)
+
+    # Токены без обновления: заглушки авторизацию не проверяют
+    db = get_database()
+    for service in ('portals', 'tonnel'):
+        db.save_auth_token(service, 'bench', None)
+
+    results = {}
+    for size in sorted(args.sizes):
+        benches = [('scan', bench_scan), ('sqlite', bench_sqlite)]
+        if args.shards:
+            benches.append(('sharded', lambda size, repeats: bench_sharded(size, repeats, args.shards)))
+        for prefix, bench in benches:
+            for name, value in bench(size, args.repeats).items():
+                results[f'{prefix}.{size}.{name}'] = value
+                print(f"{prefix}.{size}.{name}: {value:.4f}" if isinstance(value, float)
+                      else f"{prefix}.{size}.{name}: {value}")
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, previous, value in regressions:
+            print(f"REGRESSION {name}: {previous:.4f}s -> {value:.4f}s")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,51 @@
+import asyncio
+import functools
+import html
 import logging
-import threading
+import time
 from datetime import datetime
-from telegram import Update, ParseMode
-from telegram.ext import CallbackContext, CommandHandler, CallbackQueryHandler
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+from api.marketplace import market_title
 from config import Config
-from database import DatabaseManager
+from database import get_database
 from utils.logger import setup_logger
-from .keyboards import get_main_keyboard, get_settings_keyboard, get_price_range_keyboard
+from utils.metrics import metrics
+from .keyboards import (
+    get_main_keyboard, get_settings_keyboard, get_filters_keyboard,
+    get_price_range_keyboard, get_time_to_end_keyboard
+)
 
 logger = setup_logger('bot_handlers')
 
+handler_latency = metrics.histogram(
+    'bot_handler_seconds', 'Bot update handler latency', ('handler',)
+)
+
+
+def _timed(handler):
+    """Учет времени обработки апдейта в bot_handler_seconds"""
+    @functools.wraps(handler)
+    async def wrapper(self, update, context, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return await handler(self, update, context, *args, **kwargs)
+        finally:
+            handler_latency.labels(handler=handler.__name__).observe(time.monotonic() - started)
+    return wrapper
+
 class BotHandlers:
     """Обработчики команд и callback'ов бота"""
     
     def __init__(self, scheduler, auth_manager):
-        self.db = DatabaseManager()
+        self.db = get_database()
         self.scheduler = scheduler
         self.auth_manager = auth_manager
         self.user_states = {}
     
-    def start(self, update: Update, context: CallbackContext):
+    @_timed
+    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка команды /start"""
         user = update.effective_user
         welcome_message = (
@@ -35,71 +61,148 @@ class BotHandlers:
             "💾 Локальное хранение данных\n\n"
             "Используйте кнопки ниже для управления:"
         )
-        update.message.reply_text(
+        await update.message.reply_text(
             welcome_message,
             reply_markup=get_main_keyboard()
         )
     
-    def show_arbitrage(self, update: Update, context: CallbackContext, sort_by='profit'):
-        """Отображение арбитражных возможностей"""
-        opportunities = self.db.get_arbitrage_opportunities(sort_by)
+    @_timed
+    async def subscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка команды /subscribe [мин. прибыль]"""
+        min_profit = Config.MIN_PROFIT
+        if context.args:
+            try:
+                min_profit = max(float(context.args[0].replace(',', '.')), Config.MIN_PROFIT)
+            except ValueError:
+                await update.message.reply_text("Использование: /subscribe 1.5 (минимальная прибыль в TON)")
+                return
         
-        if not opportunities:
-            update.callback_query.edit_message_text(
+        await asyncio.to_thread(self.scheduler.notifier.subscribe, update.effective_chat.id, min_profit)
+        await update.message.reply_text(
+            f"🔔 Уведомления включены: новые возможности с прибылью от {min_profit:.2f} TON"
+        )
+    
+    @_timed
+    async def unsubscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка команды /unsubscribe"""
+        await asyncio.to_thread(self.scheduler.notifier.unsubscribe, update.effective_chat.id)
+        await update.message.reply_text("🔕 Уведомления отключены")
+    
+    @_timed
+    async def show_metrics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка команды /metrics (только для администратора)"""
+        if update.effective_chat.id != Config.ADMIN_CHAT_ID:
+            return
+        summary = metrics.summary() or "Метрик пока нет"
+        # Лимит Telegram - 4096 символов на сообщение
+        await update.message.reply_text(
+            f"<pre>{html.escape(summary[:3900])}</pre>",
+            parse_mode=ParseMode.HTML
+        )
+    
+    async def show_arbitrage(self, update: Update, context: ContextTypes.DEFAULT_TYPE, sort_by='profit', page=0):
+        """Отображение арбитражных возможностей с учетом фильтров пользователя"""
+        subscription = self.scheduler.notifier.get_settings(update.effective_chat.id)
+        # Готовый текст страницы живет до следующего сохранения данных и
+        # общий для всех пользователей с одинаковыми фильтрами; чтение БД
+        # при промахе кэша идет в пуле потоков, не блокируя event loop
+        message = await asyncio.to_thread(
+            self.scheduler.cache.get_or_compute,
+            ('message', sort_by, subscription.filter_key(), page),
+            lambda: self._render_arbitrage(sort_by, subscription, page)
+        )
+        
+        if not message:
+            await update.callback_query.edit_message_text(
                 "Нет доступных арбитражных возможностей в данный момент",
                 reply_markup=get_main_keyboard()
             )
             return
         
+        await update.callback_query.edit_message_text(
+            message,
+            parse_mode=ParseMode.HTML,
+            reply_markup=get_main_keyboard()
+        )
+    
+    def _get_opportunities(self, sort_by='profit', subscription=None):
+        """Отсортированные и отфильтрованные возможности текущего поколения"""
+        cache = self.scheduler.cache
+        # Один запрос к БД на поколение и порядок сортировки: первые
+        # CACHE_MAX_ROWS по времени - не то же самое, что первые по прибыли.
+        # Фильтры подписки считаются в памяти
+        rows = cache.get_or_compute(
+            ('rows', sort_by),
+            lambda: self.db.get_arbitrage_opportunities(sort_by, limit=Config.CACHE_MAX_ROWS)
+        )
+        
+        def build():
+            if not subscription:
+                return rows
+            now = time.time()
+            return [row for row in rows if subscription.matches(row, now)]
+        
+        filter_key = subscription.filter_key() if subscription else None
+        return cache.get_or_compute(('view', sort_by, filter_key), build)
+    
+    def _render_arbitrage(self, sort_by='profit', subscription=None, page=0):
+        """HTML-текст страницы возможностей или None, если их нет"""
+        opportunities = self._get_opportunities(sort_by, subscription)
+        start = page * Config.PAGE_SIZE
+        page_items = opportunities[start:start + Config.PAGE_SIZE]
+        if not page_items:
+            return None
+        
         message = "<b>🔥 Актуальные арбитражные возможности:</b>\n\n"
-        for idx, opp in enumerate(opportunities[:10], 1):
-            nft_id, name, model, end_time, bid, portals_price, _, profit, price_range = opp
-            end_time_str = datetime.fromtimestamp(end_time).strftime('%d.%m.%Y %H:%M')
+        for idx, opp in enumerate(page_items, start + 1):
+            end_time_str = (
+                datetime.fromtimestamp(opp.end_time).strftime('%d.%m.%Y %H:%M') if opp.end_time else "—"
+            )
             
             message += (
-                f"<b>{idx}. {name} ({model})</b>\n"
+                f"<b>{idx}. {html.escape(opp.name)} ({html.escape(opp.model)})</b>\n"
+                f"🔀 {market_title(opp.buy_market)} → {market_title(opp.sell_market)}\n"
                 f"⏱ Окончание: {end_time_str}\n"
-                f"💰 Текущая ставка: {bid:.2f} TON\n"
-                f"🏷 Portals цена: {portals_price:.2f} TON\n"
-                f"💵 Прибыль: <b>{profit:.2f} TON</b>\n"
-                f"📊 Диапазон: {price_range} TON\n\n"
+                f"💰 Цена покупки: {opp.buy_price:.2f} TON\n"
+                f"🏷 Цена продажи: {opp.sell_price:.2f} TON\n"
+                f"💵 Прибыль: <b>{opp.profit:.2f} TON</b>\n"
+                f"📊 Диапазон: {opp.price_range} TON\n\n"
             )
         
-        message += f"<i>Обновлено: {datetime.now().strftime('%H:%M:%S')}</i>"
-        
-        update.callback_query.edit_message_text(
-            message,
-            parse_mode=ParseMode.HTML,
-            reply_markup=get_main_keyboard()
-        )
+        if self.scheduler.stale_since is not None:
+            # Данные прошлого запуска, пока не прошло первое сканирование
+            stale_since = datetime.fromtimestamp(self.scheduler.stale_since)
+            message += f"<i>⚠️ Данные на {stale_since.strftime('%d.%m %H:%M:%S')}, идет обновление</i>"
+            return message
+        updated_at = datetime.fromtimestamp(self.scheduler.cache.updated_at)
+        message += f"<i>Обновлено: {updated_at.strftime('%H:%M:%S')}</i>"
+        return message
     
-    def button_handler(self, update: Update, context: CallbackContext):
+    @_timed
+    async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка inline-кнопок"""
         query = update.callback_query
-        query.answer()
+        await query.answer()
         
         data = query.data
         
         if data == 'refresh_data':
-            # Обновление данных в отдельном потоке
-            def refresh_task():
-                count = self.scheduler.force_update()
-                query.edit_message_text(
-                    f"✅ Данные успешно обновлены!\nНайдено {count} возможностей",
-                    reply_markup=get_main_keyboard()
-                )
-            
-            threading.Thread(target=refresh_task).start()
-            query.edit_message_text("🔄 Обновление данных...")
+            await query.edit_message_text("🔄 Обновление данных...")
+            # Сканирование идет в том же event loop, другие апдейты не ждут
+            count = await self.scheduler.force_update()
+            await query.edit_message_text(
+                f"✅ Данные успешно обновлены!\nНайдено {count} возможностей",
+                reply_markup=get_main_keyboard()
+            )
         
         elif data == 'sort_profit':
-            self.show_arbitrage(update, context, sort_by='profit')
+            await self.show_arbitrage(update, context, sort_by='profit')
         
         elif data == 'sort_time':
-            self.show_arbitrage(update, context, sort_by='time')
+            await self.show_arbitrage(update, context, sort_by='time')
         
         elif data == 'settings':
-            query.edit_message_text(
+            await query.edit_message_text(
                 "⚙️ <b>Настройки бота</b>\n\n"
                 "Здесь вы можете управлять параметрами бота",
                 parse_mode=ParseMode.HTML,
@@ -107,27 +210,124 @@ class BotHandlers:
             )
         
         elif data == 'refresh_tokens':
-            def refresh_tokens_task():
-                portals_success = self.auth_manager.refresh_portals_token()
-                tonnel_success = self.auth_manager.refresh_tonnel_token()
-                status = "✅ Токены успешно обновлены!" if portals_success and tonnel_success else "⚠️ Ошибка обновления токенов"
-                query.edit_message_text(status, reply_markup=get_settings_keyboard())
-            
-            threading.Thread(target=refresh_tokens_task).start()
-            query.edit_message_text("🔄 Обновление токенов...")
+            await query.edit_message_text("🔄 Обновление токенов...")
+            portals_success, tonnel_success = await asyncio.to_thread(self.auth_manager.refresh_all_tokens)
+            status = "✅ Токены успешно обновлены!" if portals_success and tonnel_success else "⚠️ Ошибка обновления токенов"
+            await query.edit_message_text(status, reply_markup=get_settings_keyboard())
+        
+        elif data == 'filters':
+            await self.show_filters(query, update.effective_chat.id)
+        
+        elif data == 'set_ranges':
+            subscription = self.scheduler.notifier.get_settings(update.effective_chat.id)
+            await query.edit_message_text(
+                "📊 Выберите диапазоны цен (повторное нажатие снимает выбор):",
+                reply_markup=get_price_range_keyboard(subscription.price_ranges)
+            )
+        
+        elif data.startswith('filter_'):
+            subscription = self.scheduler.notifier.get_settings(update.effective_chat.id)
+            if data == 'filter_all':
+                subscription.price_ranges = None
+            else:
+                _, min_val, max_val = data.split('_')
+                selected = set(subscription.price_ranges or ())
+                selected ^= {f"{min_val}-{max_val}"}
+                subscription.price_ranges = frozenset(selected) or None
+            await asyncio.to_thread(self.scheduler.notifier.update_settings, subscription)
+            await query.edit_message_text(
+                "📊 Выберите диапазоны цен (повторное нажатие снимает выбор):",
+                reply_markup=get_price_range_keyboard(subscription.price_ranges)
+            )
+        
+        elif data == 'set_tte':
+            await query.edit_message_text(
+                "⏱ Показывать аукционы, которые закончатся:",
+                reply_markup=get_time_to_end_keyboard()
+            )
+        
+        elif data.startswith('tte_'):
+            subscription = self.scheduler.notifier.get_settings(update.effective_chat.id)
+            value = data[len('tte_'):]
+            subscription.max_time_to_end = None if value == 'any' else int(value)
+            await asyncio.to_thread(self.scheduler.notifier.update_settings, subscription)
+            await self.show_filters(query, update.effective_chat.id)
+        
+        elif data == 'toggle_notify':
+            subscription = self.scheduler.notifier.get_settings(update.effective_chat.id)
+            subscription.notify = not subscription.notify
+            await asyncio.to_thread(self.scheduler.notifier.update_settings, subscription)
+            await self.show_filters(query, update.effective_chat.id)
+        
+        elif data in ('set_min_profit', 'set_models'):
+            # Значение придет следующим текстовым сообщением
+            self.user_states[update.effective_chat.id] = data
+            prompt = (
+                "💰 Введите минимальную прибыль в TON (например, 1.5):"
+                if data == 'set_min_profit' else
+                "🏷 Введите модели через запятую или '-' для сброса фильтра:"
+            )
+            await query.edit_message_text(prompt)
         
         elif data == 'main_menu':
-            query.edit_message_text(
+            await query.edit_message_text(
                 "Главное меню:",
                 reply_markup=get_main_keyboard()
             )
     
-    def error_handler(self, update: Update, context: CallbackContext):
+    async def show_filters(self, query, chat_id: int):
+        """Экран фильтров пользователя"""
+        subscription = self.scheduler.notifier.get_settings(chat_id)
+        ranges = ", ".join(sorted(subscription.price_ranges)) if subscription.price_ranges else "все"
+        models = html.escape(", ".join(sorted(subscription.models))) if subscription.models else "все"
+        tte = (
+            f"до {subscription.max_time_to_end // 3600} ч"
+            if subscription.max_time_to_end else "без ограничения"
+        )
+        await query.edit_message_text(
+            "🎯 <b>Фильтры</b>\n\n"
+            f"💰 Мин. прибыль: {subscription.min_profit:.2f} TON\n"
+            f"📊 Диапазоны: {ranges} TON\n"
+            f"🏷 Модели: {models}\n"
+            f"⏱ До окончания: {tte}\n\n"
+            "Фильтры применяются к списку возможностей и к уведомлениям",
+            parse_mode=ParseMode.HTML,
+            reply_markup=get_filters_keyboard(subscription)
+        )
+    
+    @_timed
+    async def text_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ввод значений фильтров текстом"""
+        chat_id = update.effective_chat.id
+        state = self.user_states.pop(chat_id, None)
+        if state is None:
+            return
+        
+        subscription = self.scheduler.notifier.get_settings(chat_id)
+        text = update.message.text.strip()
+        if state == 'set_min_profit':
+            try:
+                subscription.min_profit = max(float(text.replace(',', '.')), Config.MIN_PROFIT)
+            except ValueError:
+                self.user_states[chat_id] = state
+                await update.message.reply_text("Введите число, например 1.5")
+                return
+        elif state == 'set_models':
+            models = [model.strip() for model in text.split(',') if model.strip()]
+            subscription.models = None if text == '-' or not models else frozenset(models)
+        
+        await asyncio.to_thread(self.scheduler.notifier.update_settings, subscription)
+        await update.message.reply_text(
+            "✅ Фильтры сохранены",
+            reply_markup=get_filters_keyboard(subscription)
+        )
+    
+    async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка ошибок"""
         logger.error(f"Update {update} caused error: {context.error}")
         
-        if update and update.effective_chat:
-            context.bot.send_message(
+        if isinstance(update, Update) and update.effective_chat:
+            await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text="⚠️ Произошла ошибка при обработке запроса. Пожалуйста, попробуйте позже."
             )
@@ -1,4 +1,5 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from config import Config
 
 def get_main_keyboard():
     """Клавиатура главного меню"""
@@ -15,21 +16,48 @@ def get_main_keyboard():
 def get_settings_keyboard():
     """Клавиатура настроек"""
     keyboard = [
+        [InlineKeyboardButton("🎯 Фильтры и уведомления", callback_data='filters')],
         [InlineKeyboardButton("🔑 Обновить токены API", callback_data='refresh_tokens')],
         [InlineKeyboardButton("◀️ Назад", callback_data='main_menu')]
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def get_price_range_keyboard():
+def get_filters_keyboard(subscription):
+    """Клавиатура фильтров пользователя"""
+    notify = "вкл" if subscription.notify else "выкл"
+    keyboard = [
+        [InlineKeyboardButton(f"💰 Мин. прибыль: {subscription.min_profit:.2f} TON", callback_data='set_min_profit')],
+        [InlineKeyboardButton("📊 Диапазоны цен", callback_data='set_ranges')],
+        [InlineKeyboardButton("🏷 Модели", callback_data='set_models')],
+        [InlineKeyboardButton("⏱ Время до окончания", callback_data='set_tte')],
+        [InlineKeyboardButton(f"🔔 Уведомления: {notify}", callback_data='toggle_notify')],
+        [InlineKeyboardButton("◀️ Назад", callback_data='settings')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def get_price_range_keyboard(selected=None):
     """Клавиатура фильтра по цене"""
     ranges = Config.PRICE_RANGES
     keyboard = []
     for min_val, max_val in ranges:
+        mark = "✅ " if selected and f"{min_val}-{max_val}" in selected else ""
         btn = InlineKeyboardButton(
-            f"{min_val}-{max_val} TON", 
+            f"{mark}{min_val}-{max_val} TON", 
             callback_data=f'filter_{min_val}_{max_val}'
         )
         keyboard.append([btn])
-    keyboard.append([InlineKeyboardButton("Все диапазоны", callback_data='filter_all')])
-    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data='main_menu')])
+    mark = "✅ " if not selected else ""
+    keyboard.append([InlineKeyboardButton(f"{mark}Все диапазоны", callback_data='filter_all')])
+    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data='filters')])
+    return InlineKeyboardMarkup(keyboard)
+
+def get_time_to_end_keyboard():
+    """Клавиатура ограничения по времени до окончания аукциона"""
+    options = [("1 час", 3600), ("6 часов", 6 * 3600), ("24 часа", 24 * 3600)]
+    keyboard = [
+        [InlineKeyboardButton(f"До {label}", callback_data=f'tte_{seconds}')]
+        for label, seconds in options
+    ]
+    keyboard.append([InlineKeyboardButton("Без ограничения", callback_data='tte_any')])
+    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data='filters')])
     return InlineKeyboardMarkup(keyboard)
@@ -9,22 +9,66 @@ class Config:
     BOT_TOKEN = os.getenv("BOT_TOKEN", "7807324480:AAEjLhfW0h6kkc7clCyWpkkBbU0uGdgaCiY")
     ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "6284877635"))
     
-    # Настройки API
-    PORTALS_API_URL = "https://api.portals-market.com/v1"
-    TONNEL_API_URL = "https://api.market.tonnel.network/v1"
+    # Настройки API (для разработки - адреса заглушек из dev.stub_server)
+    PORTALS_API_URL = os.getenv("PORTALS_API_URL", "https://api.portals-market.com/v1")
+    TONNEL_API_URL = os.getenv("TONNEL_API_URL", "https://api.market.tonnel.network/v1")
+    
+    # Пагинация каталогов
+    API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "100"))
+    API_MAX_CONCURRENT_PAGES = int(os.getenv("API_MAX_CONCURRENT_PAGES", "4"))
+    API_MAX_PAGES = int(os.getenv("API_MAX_PAGES", "200"))
+    API_PAGE_RETRIES = 2          # Повторных загрузок страницы после ошибки
+    API_MAX_FAILED_PAGES = 4      # Неполученных страниц подряд до прерывания обхода
+    
+    # HTTP-транспорт: лимит на хост, повторы, размыкатель цепи, хеджирование
+    HTTP_TIMEOUT = 15                 # Таймаут одной попытки, сек
+    HTTP_RATE_LIMIT = float(os.getenv("HTTP_RATE_LIMIT", "10"))  # Запросов в секунду на хост
+    HTTP_RATE_BURST = 20              # Допустимый всплеск запросов
+    HTTP_MAX_RETRIES = 3              # Повторов при 429/5xx и сетевых ошибках
+    HTTP_BACKOFF_BASE = 0.5           # Базовая задержка повтора, сек
+    HTTP_BACKOFF_MAX = 8              # Максимальная задержка повтора, сек
+    HTTP_MAX_RETRY_AFTER = 60         # Retry-After больше этого - без повтора
+    CIRCUIT_FAILURE_THRESHOLD = 5     # Ошибок подряд до размыкания цепи
+    CIRCUIT_RESET_TIMEOUT = 30        # Секунд до пробного запроса
+    HTTP_HEDGE = os.getenv("HTTP_HEDGE", "1") == "1"
+    HEDGE_WINDOW = 200                # Последних ответов для оценки p95
+    HEDGE_MIN_SAMPLES = 20            # Ответов до включения хеджирования
+    
+    # Инкрементальное сканирование (пересчет только изменений между циклами)
+    INCREMENTAL_SCAN = os.getenv("INCREMENTAL_SCAN", "1") == "1"
+    # Шардированное полное сканирование в нескольких процессах (0/1 - выключено).
+    # Заменяет инкрементальный режим; история цен и точечные проверки в нем не работают
+    SCAN_SHARDS = int(os.getenv("SCAN_SHARDS", "0"))
+    SCAN_SHARD_BY = os.getenv("SCAN_SHARD_BY", "collection")   # collection | price
+    SCAN_SHARD_TIMEOUT = float(os.getenv("SCAN_SHARD_TIMEOUT", "120"))
     
     # Настройки базы данных
     DB_PATH = os.getenv("DB_PATH", "/storage/emulated/0/Bot/arbitrage.db")
+    DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+    DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+    DB_VACUUM_INTERVAL = 3600  # Секунды между incremental_vacuum
+    DB_VACUUM_PAGES = 1000     # Страниц за один проход
+    
+    # Быстрый старт: снимок рынков и возможностей рядом с БД, сохраняется
+    # периодически и при остановке (в шардированном режиме не используется)
+    WARM_START = os.getenv("WARM_START", "1") == "1"
+    WARM_START_PATH = os.getenv("WARM_START_PATH", f"{DB_PATH}.warm")
+    WARM_START_INTERVAL = 300  # Секунды между сохранениями снимка
     
     # Авторизационные данные (шифруются при сохранении)
     TONNEL_AUTH = os.getenv("TONNEL_AUTH", "")
     PORTALS_AUTH = os.getenv("PORTALS_AUTH", "")
+    # Ключ Fernet для токенов; без него ключ хранится в файле <DB_PATH>.key
+    TOKEN_ENCRYPTION_KEY = os.getenv("TOKEN_ENCRYPTION_KEY", "")
+    TOKEN_TTL = 3600             # Срок действия нового токена, секунды
+    TOKEN_REFRESH_MARGIN = 300   # Обновление токена за столько секунд до истечения
     
     # Параметры арбитража
-    COMMISSIONS = {
-        'portals': 0.05,    # 5%
-        'tonnel': 0.06,     # 6%
-        'transfer': 0.22    # TON
+    # Комиссии площадок: buy - доля при покупке, sell - доля при продаже,
+    # withdraw - плата за вывод купленного NFT (TON)
+    MARKET_FEES = {
+        'portals': {'buy': 0.0, 'sell': 0.05, 'withdraw': 0.0},
+        'tonnel': {'buy': 0.06, 'sell': 0.0, 'withdraw': 0.22},
     }
     MIN_PROFIT = 0.1        # Минимальная прибыль в TON
     PRICE_RANGES = [
@@ -34,6 +78,55 @@ class Config:
         (25, 50)
     ]
     
+    # Кэш чтения бота
+    CACHE_MAX_ROWS = 1000   # Строк, загружаемых из БД за одно поколение
+    PAGE_SIZE = 10          # Возможностей на одной странице сообщения
+    
+    # Push-уведомления (лимиты Telegram: ~1 сообщение/сек в чат, ~30/сек всего)
+    ALERT_GLOBAL_RATE = 25          # Сообщений в секунду на бота
+    ALERT_CHAT_RATE = 1             # Сообщений в секунду на чат
+    ALERT_BATCH_SIZE = 5            # Возможностей в одном сообщении
+    ALERT_QUEUE_SIZE = 1000         # Пачек во входящей очереди
+    ALERT_MAX_PENDING_PER_CHAT = 50 # Ожидающих возможностей на чат
+    ALERT_DEDUP_TTL = 3600          # Секунд без повторного уведомления о той же возможности
+    
     # Настройки обновления
     API_UPDATE_INTERVAL = 45  # Секунды
     UI_UPDATE_INTERVAL = 10   # Секунды
+    # Адаптивный опрос (только в инкрементальном режиме)
+    ADAPTIVE_POLLING = os.getenv("ADAPTIVE_POLLING", "1") == "1"
+    POLL_MIN_INTERVAL = 20        # Минимальный интервал полного сканирования, сек
+    POLL_MAX_INTERVAL = 180       # Максимальный интервал на спокойном рынке, сек
+    POLL_BACKOFF_FACTOR = 1.5     # Множитель роста/сокращения интервала
+    POLL_MIN_RECHECK = 3          # Минимальный интервал проверки аукциона, сек
+    POLL_VOLATILITY_WEIGHT = 10   # Влияние волатильности ставки на частоту проверок
+    # Потоковый прием событий (только в инкрементальном режиме, вместо адаптивного
+    # опроса): площадки через запятую, например "tonnel"; пусто - выключен
+    STREAM_MARKETS = [name.strip() for name in os.getenv("STREAM_MARKETS", "").split(",") if name.strip()]
+    STREAM_MODE = os.getenv("STREAM_MODE", "sse")   # sse | poll (long-poll)
+    STREAM_QUEUE_SIZE = 10000     # Событий в очереди до остановки чтения потоков
+    STREAM_BATCH_SIZE = 500       # Событий, применяемых за один пересчет
+    STREAM_IDLE_TIMEOUT = 60      # Секунд без данных и пингов до переподключения
+    STREAM_POLL_TIMEOUT = 25      # Ожидание событий одним long-poll запросом, сек
+    # Сверочное полное сканирование, когда все площадки приходят потоком
+    STREAM_RECONCILE_INTERVAL = int(os.getenv("STREAM_RECONCILE_INTERVAL", "300"))
+    FORCE_UPDATE_MIN_INTERVAL = 15  # Секунды после сканирования без повторного запроса
+    TOKEN_REFRESH_MIN_INTERVAL = 60  # Секунды между ручными обновлениями токенов
+    HANDLER_WORKERS = 4       # Потоков для блокирующих операций (БД, синхронный код)
+    
+    # Логирование: запись в отдельном потоке, ротация, выборка повторов
+    LOG_ROTATION = os.getenv("LOG_ROTATION", "size")  # size или time (ежесуточно)
+    LOG_MAX_BYTES = 5 * 1024 * 1024   # Размер файла до ротации
+    LOG_BACKUP_COUNT = 5              # Хранимых архивных файлов
+    LOG_JSON = os.getenv("LOG_JSON", "0") == "1"
+    LOG_QUEUE_SIZE = 10000            # Записей в очереди до отбрасывания
+    LOG_SAMPLE_BURST = 20             # Записей одного места вызова за окно
+    LOG_SAMPLE_WINDOW = 60            # Окно выборки, сек
+    
+    # История цен: суточные разделы колоночных файлов рядом с БД
+    HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1") == "1"
+    HISTORY_DIR = os.getenv("HISTORY_DIR", os.path.join(os.path.dirname(DB_PATH), "history"))
+    HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "180"))  # 0 - хранить все
+    
+    # Метрики: Prometheus-эндпоинт на 127.0.0.1 (0 - отключен)
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
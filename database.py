@@ -1,21 +1,78 @@
+import os
 import sqlite3
 import logging
+import threading
+import time
 from config import Config
-from cryptography.fernet import Fernet
+from services.records import Opportunity
+from utils.metrics import metrics
 
 class DatabaseManager:
     """Управление базой данных SQLite для хранения данных арбитража и токенов"""
     
     def __init__(self, db_path=Config.DB_PATH):
         self.db_path = db_path
+        # Одно постоянное соединение на поток вместо connect() на каждый вызов
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._last_vacuum = time.monotonic()
+        self.write_time = metrics.histogram(
+            'db_write_seconds', 'Time to persist a batch of arbitrage opportunities'
+        )
+        self.rows_written = metrics.counter(
+            'db_rows_written_total', 'Opportunity rows changed by writes', ('op',)
+        )
         self._initialize_db()
-        self.cipher = Fernet(Fernet.generate_key())  # В продакшене использовать постоянный ключ из .env
+        self._cipher = None
+        self._cipher_lock = threading.Lock()
+
+    @property
+    def cipher(self):
+        """Шифр токенов; cryptography импортируется при первом обращении к токенам
+
+        Процессам, которые токены не читают (запись результатов шардов,
+        бэктест), и старту бота до первого запроса токена она не нужна.
+        """
+        with self._cipher_lock:
+            if self._cipher is None:
+                from cryptography.fernet import Fernet
+                self._cipher = Fernet(self._load_encryption_key())
+            return self._cipher
+
+    def _load_encryption_key(self) -> bytes:
+        """Постоянный ключ шифрования токенов: из окружения или файла рядом с БД
+
+        Со случайным ключом на каждый запуск сохраненные токены после
+        перезапуска невозможно расшифровать.
+        """
+        if Config.TOKEN_ENCRYPTION_KEY:
+            return Config.TOKEN_ENCRYPTION_KEY.encode()
+        key_path = f"{self.db_path}.key"
+        try:
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(key_path, 'rb') as f:
+                return f.read().strip()
+        from cryptography.fernet import Fernet
+        key = Fernet.generate_key()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(key)
+        return key
 
     def _initialize_db(self):
         """Инициализация структуры базы данных"""
         with self._get_connection() as conn:
             cursor = conn.cursor()
             
+            # Инкрементальный vacuum: место удаленных строк возвращается
+            # порциями, без полного VACUUM. Для существующей базы режим
+            # включается однократным VACUUM.
+            if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                conn.commit()
+                cursor.execute('VACUUM')
+            
             # Таблица для хранения арбитражных данных
             cursor.execute('''
             CREATE TABLE IF NOT EXISTS arbitrage_opportunities (
@@ -42,15 +99,84 @@ class DatabaseManager:
             )
             ''')
             
+            # Подписки пользователей на уведомления
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                chat_id INTEGER PRIMARY KEY,
+                min_profit REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+            # Фильтры пользователя (JSON-списки; NULL - без ограничения)
+            self._ensure_column(cursor, 'subscriptions', 'price_ranges', 'TEXT')
+            self._ensure_column(cursor, 'subscriptions', 'models', 'TEXT')
+            self._ensure_column(cursor, 'subscriptions', 'max_time_to_end', 'INTEGER')
+            self._ensure_column(cursor, 'subscriptions', 'notify', 'INTEGER NOT NULL DEFAULT 1')
+            # Направление сделки; в старых базах все возможности - Tonnel -> Portals.
+            # current_bid - цена покупки, portals_price - цена продажи,
+            # tonnel_price - цена покупки с комиссией, auction_end = 0 - лот без срока
+            self._ensure_column(cursor, 'arbitrage_opportunities', 'buy_market',
+                                "TEXT NOT NULL DEFAULT 'tonnel'")
+            self._ensure_column(cursor, 'arbitrage_opportunities', 'sell_market',
+                                "TEXT NOT NULL DEFAULT 'portals'")
+            
             # Индексы для оптимизации запросов
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_profit ON arbitrage_opportunities(profit)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_auction_end ON arbitrage_opportunities(auction_end)')
             
             conn.commit()
 
+    @staticmethod
+    def _ensure_column(cursor, table: str, column: str, definition: str):
+        """Добавление колонки в существующую таблицу, если ее еще нет"""
+        columns = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
     def _get_connection(self):
-        """Установка соединения с базой данных"""
-        return sqlite3.connect(self.db_path, timeout=20)
+        """Постоянное соединение текущего потока с базой данных"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._prune_connections()
+                self._connections.append((threading.current_thread(), conn))
+        return conn
+
+    def _prune_connections(self):
+        """Закрытие соединений потоков, которые уже завершились"""
+        alive = []
+        for thread, conn in self._connections:
+            if thread.is_alive():
+                alive.append((thread, conn))
+            else:
+                conn.close()
+        self._connections = alive
+
+    def _connect(self):
+        """Открытие соединения с настройками WAL"""
+        # check_same_thread=False только для закрытия из close();
+        # каждое соединение используется лишь своим потоком
+        conn = sqlite3.connect(self.db_path, timeout=20, check_same_thread=False)
+        # WAL: читатели не блокируются записью планировщика
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{Config.DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={Config.DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def close(self):
+        """Закрытие всех соединений (при остановке процесса)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for _, conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logging.getLogger(__name__).warning(f"Error closing connection: {e}")
+        self._local = threading.local()
     
     def _encrypt_token(self, token: str) -> str:
         """Шифрование токена перед сохранением"""
@@ -72,38 +198,155 @@ class DatabaseManager:
 
     def get_auth_token(self, service: str) -> str:
         """Получение токена авторизации из БД"""
+        return self.get_auth_token_entry(service)[0]
+
+    def get_auth_token_entry(self, service: str):
+        """Токен и срок его действия: (token, expires_at) или (None, None)"""
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-            SELECT encrypted_token FROM auth_tokens WHERE service = ?
+            SELECT encrypted_token, expires_at FROM auth_tokens WHERE service = ?
             ''', (service,))
             row = cursor.fetchone()
-            return self._decrypt_token(row[0]) if row else None
+        if not row:
+            return None, None
+        from cryptography.fernet import InvalidToken
+        try:
+            return self._decrypt_token(row[0]), row[1]
+        except InvalidToken:
+            # Токен зашифрован другим ключом - считаем его отсутствующим
+            logging.getLogger(__name__).warning(f"Cannot decrypt {service} token, it will be refreshed")
+            return None, None
 
-    def save_arbitrage_opportunities(self, opportunities: list):
-        """Сохранение арбитражных возможностей в БД"""
-        if not opportunities:
-            return
-            
+    def save_arbitrage_opportunities(self, opportunities: list, removed: list = None,
+                                     prune_missing: bool = False, keep_ids: list = None):
+        """Сохранение арбитражных возможностей в БД
+
+        В одной транзакции:
+        - upsert только тех строк, значения которых действительно изменились;
+        - удаление возможностей из removed, а при prune_missing - всех,
+          которых нет в полном снимке (keep_ids, по умолчанию - id из
+          opportunities);
+        - удаление аукционов, у которых прошел auction_end (лоты без срока
+          с auction_end = 0 не истекают).
+        """
+        started = time.perf_counter()
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.executemany('''
-            INSERT OR REPLACE INTO arbitrage_opportunities (
-                nft_id, name, model, auction_end, current_bid, 
-                portals_price, tonnel_price, profit, price_range
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', opportunities)
+            if opportunities:
+                cursor.executemany('''
+                INSERT INTO arbitrage_opportunities (
+                    nft_id, name, model, auction_end, current_bid, 
+                    portals_price, tonnel_price, profit, price_range,
+                    buy_market, sell_market
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(nft_id) DO UPDATE SET
+                    name = excluded.name,
+                    model = excluded.model,
+                    auction_end = excluded.auction_end,
+                    current_bid = excluded.current_bid,
+                    portals_price = excluded.portals_price,
+                    tonnel_price = excluded.tonnel_price,
+                    profit = excluded.profit,
+                    price_range = excluded.price_range,
+                    buy_market = excluded.buy_market,
+                    sell_market = excluded.sell_market,
+                    last_updated = CURRENT_TIMESTAMP
+                WHERE name IS NOT excluded.name
+                   OR model IS NOT excluded.model
+                   OR auction_end IS NOT excluded.auction_end
+                   OR current_bid IS NOT excluded.current_bid
+                   OR portals_price IS NOT excluded.portals_price
+                   OR tonnel_price IS NOT excluded.tonnel_price
+                   OR profit IS NOT excluded.profit
+                   OR price_range IS NOT excluded.price_range
+                   OR buy_market IS NOT excluded.buy_market
+                   OR sell_market IS NOT excluded.sell_market
+                ''', opportunities)
+                self.rows_written.labels(op='upsert').inc(max(cursor.rowcount, 0))
+            
+            if removed:
+                cursor.executemany(
+                    'DELETE FROM arbitrage_opportunities WHERE nft_id = ?',
+                    [(nft_id,) for nft_id in removed]
+                )
+                self.rows_written.labels(op='delete').inc(max(cursor.rowcount, 0))
+            
+            if prune_missing:
+                cursor.execute(
+                    'CREATE TEMP TABLE IF NOT EXISTS scan_ids (nft_id TEXT PRIMARY KEY)'
+                )
+                cursor.execute('DELETE FROM scan_ids')
+                if keep_ids is None:
+                    keep_ids = [opp[0] for opp in opportunities]
+                cursor.executemany(
+                    'INSERT OR IGNORE INTO scan_ids (nft_id) VALUES (?)',
+                    [(nft_id,) for nft_id in keep_ids]
+                )
+                cursor.execute('''
+                DELETE FROM arbitrage_opportunities
+                WHERE nft_id NOT IN (SELECT nft_id FROM scan_ids)
+                ''')
+                self.rows_written.labels(op='prune').inc(max(cursor.rowcount, 0))
+            
+            cursor.execute(
+                'DELETE FROM arbitrage_opportunities WHERE auction_end > 0 AND auction_end < ?',
+                (int(time.time()),)
+            )
+            self.rows_written.labels(op='expire').inc(max(cursor.rowcount, 0))
+            conn.commit()
+        
+        self.write_time.observe(time.perf_counter() - started)
+        self._maybe_incremental_vacuum()
+
+    def _maybe_incremental_vacuum(self):
+        """Периодический возврат свободных страниц файлу базы"""
+        if time.monotonic() - self._last_vacuum < Config.DB_VACUUM_INTERVAL:
+            return
+        self._last_vacuum = time.monotonic()
+        conn = self._get_connection()
+        conn.execute(f'PRAGMA incremental_vacuum({Config.DB_VACUUM_PAGES})')
+        conn.commit()
+
+    def save_subscription(self, chat_id: int, min_profit: float, price_ranges: str = None,
+                          models: str = None, max_time_to_end: int = None, notify: int = 1):
+        """Сохранение настроек и подписки пользователя"""
+        with self._get_connection() as conn:
+            conn.execute('''
+            INSERT INTO subscriptions (
+                chat_id, min_profit, price_ranges, models, max_time_to_end, notify
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                min_profit = excluded.min_profit,
+                price_ranges = excluded.price_ranges,
+                models = excluded.models,
+                max_time_to_end = excluded.max_time_to_end,
+                notify = excluded.notify
+            ''', (chat_id, min_profit, price_ranges, models, max_time_to_end, notify))
             conn.commit()
 
+    def get_subscriptions(self):
+        """Все настройки пользователей:
+        (chat_id, min_profit, price_ranges, models, max_time_to_end, notify)"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT chat_id, min_profit, price_ranges, models, max_time_to_end, notify
+            FROM subscriptions
+            ''')
+            return cursor.fetchall()
+
     def get_arbitrage_opportunities(self, sort_by: str = 'profit', limit: int = 20):
         """Получение арбитражных возможностей из БД с сортировкой"""
-        valid_sorts = {'profit': 'profit DESC', 'time': 'auction_end ASC'}
+        # Лоты без срока (auction_end = 0) при сортировке по времени идут последними
+        valid_sorts = {'profit': 'profit DESC', 'time': 'auction_end = 0, auction_end ASC, profit DESC'}
         sort_order = valid_sorts.get(sort_by, 'profit DESC')
         
         query = f'''
         SELECT 
             nft_id, name, model, auction_end, current_bid,
-            portals_price, tonnel_price, profit, price_range
+            portals_price, tonnel_price, profit, price_range,
+            buy_market, sell_market
         FROM arbitrage_opportunities
         WHERE profit > ?
         ORDER BY {sort_order}
@@ -113,4 +356,18 @@ class DatabaseManager:
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(query, (Config.MIN_PROFIT, limit))
-            return cursor.fetchall()
+            return [Opportunity._make(row) for row in cursor.fetchall()]
+
+
+_shared_instances = {}
+_shared_lock = threading.Lock()
+
+
+def get_database(db_path=Config.DB_PATH) -> DatabaseManager:
+    """Общий на процесс экземпляр DatabaseManager для указанного файла"""
+    with _shared_lock:
+        db = _shared_instances.get(db_path)
+        if db is None:
+            db = DatabaseManager(db_path)
+            _shared_instances[db_path] = db
+        return db
@@ -0,0 +1,184 @@
+"""Синтетический рынок NFT-подарков для разработки и бенчмарков
+
+Лоты Portals и аукционы Tonnel генерируются в тех же полях, что отдают
+настоящие API. Цена каждой модели берется из выбранного распределения,
+лоты и ставки разбрасываются вокруг нее, поэтому часть аукционов
+оказывается выгодной. tick() изменяет рынок: меняет цены, снимает и
+выставляет лоты, поднимает ставки и завершает аукционы; bid() поднимает
+ставку одного аукциона. Каждое изменение после создания рынка попадает
+в журнал событий площадки (для потоковых API заглушки).
+"""
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+PRICE_DISTRIBUTIONS = ('lognormal', 'uniform', 'pareto')
+
+
+class SyntheticMarket:
+    """Каталоги Portals и Tonnel с настраиваемым размером, ценами и оборотом
+
+    churn - доля лотов и аукционов, которые меняются за один tick().
+    """
+
+    def __init__(self, listings: int = 1000, auctions: int = None, models: int = 200,
+                 collections: int = 20, price_distribution: str = 'lognormal',
+                 median_price: float = 8.0, spread: float = 0.6, churn: float = 0.05,
+                 seed: int = 0, event_retention: int = 10000):
+        if price_distribution not in PRICE_DISTRIBUTIONS:
+            raise ValueError(f"Unknown price distribution: {price_distribution}")
+        self.rnd = random.Random(seed)
+        self.price_distribution = price_distribution
+        self.median_price = median_price
+        self.spread = spread
+        self.churn = churn
+        self.auction_count = auctions if auctions is not None else max(listings // 5, 1)
+        self.lock = threading.Lock()
+        # Версия каталога растет при каждом изменении (для ETag)
+        self.versions = {'portals': 0, 'tonnel': 0}
+        # Упорядоченные каталоги для постраничной выдачи: market -> (версия, список)
+        self._ordered = {}
+        # Журналы событий: market -> последние (номер, тип, элемент); номера без пропусков
+        self._events = {market: deque(maxlen=event_retention) for market in self.versions}
+        self._event_seq = {market: 0 for market in self.versions}
+        self._recording = False
+
+        self.models = [
+            (f"Collection {i % collections}", f"Model {i}", self._base_price())
+            for i in range(models)
+        ]
+        self.portals = {}
+        self.auctions = {}
+        self._next_id = 1
+        for _ in range(listings):
+            self._add_listing()
+        now = time.time()
+        for _ in range(self.auction_count):
+            self._add_auction(now)
+        self._recording = True
+
+    def _base_price(self) -> float:
+        rnd = self.rnd
+        if self.price_distribution == 'lognormal':
+            price = self.median_price * rnd.lognormvariate(0, self.spread)
+        elif self.price_distribution == 'uniform':
+            price = rnd.uniform(self.median_price * (1 - self.spread), self.median_price * (1 + self.spread))
+        else:
+            # Тяжелый хвост: редкие модели стоят на порядки дороже
+            price = self.median_price * rnd.paretovariate(1 / max(self.spread, 0.01)) / 2
+        return round(max(price, 0.1), 2)
+
+    def _new_id(self) -> int:
+        gift_id = self._next_id
+        self._next_id += 1
+        return gift_id
+
+    def _emit(self, market: str, kind: str, item: dict):
+        """Запись события в журнал площадки (копия элемента на момент изменения)"""
+        if not self._recording:
+            return
+        self._event_seq[market] += 1
+        self._events[market].append((self._event_seq[market], kind, dict(item)))
+
+    def _add_listing(self):
+        name, model, base = self.rnd.choice(self.models)
+        gift_id = self._new_id()
+        self.portals[gift_id] = {
+            'id': gift_id,
+            'name': name,
+            'model': model,
+            'price': round(base * self.rnd.lognormvariate(0, 0.15), 2),
+            'status': 'active',
+        }
+        self._emit('portals', 'update', self.portals[gift_id])
+
+    def _add_auction(self, now: float):
+        name, model, base = self.rnd.choice(self.models)
+        gift_id = self._new_id()
+        auction_id = f"a{gift_id}"
+        self.auctions[auction_id] = {
+            'id': auction_id,
+            'gift_id': gift_id,
+            'name': name,
+            'model': model,
+            'current_bid': round(base * self.rnd.uniform(0.6, 1.05), 2),
+            'end_time': int(now + self.rnd.uniform(300, 86400)),
+            'status': 'active',
+        }
+        self._emit('tonnel', 'update', self.auctions[auction_id])
+
+    def tick(self, now: float = None):
+        """Один шаг изменений рынка"""
+        now = now or time.time()
+        rnd = self.rnd
+        with self.lock:
+            ids = list(self.portals)
+            for gift_id in rnd.sample(ids, int(len(ids) * self.churn)):
+                action = rnd.random()
+                if action < 0.5:
+                    listing = self.portals[gift_id]
+                    listing['price'] = round(max(listing['price'] * rnd.uniform(0.9, 1.1), 0.1), 2)
+                    self._emit('portals', 'update', listing)
+                elif action < 0.75:
+                    self._emit('portals', 'remove', self.portals.pop(gift_id))
+                else:
+                    self._add_listing()
+
+            for auction_id in [a for a, auction in self.auctions.items() if auction['end_time'] <= now]:
+                self._emit('tonnel', 'remove', self.auctions.pop(auction_id))
+            ids = list(self.auctions)
+            for auction_id in rnd.sample(ids, int(len(ids) * self.churn)):
+                auction = self.auctions[auction_id]
+                auction['current_bid'] = round(auction['current_bid'] * rnd.uniform(1.02, 1.1), 2)
+                self._emit('tonnel', 'update', auction)
+            while len(self.auctions) < self.auction_count:
+                self._add_auction(now)
+
+            self.versions['portals'] += 1
+            self.versions['tonnel'] += 1
+
+    def bid(self):
+        """Новая ставка на случайном аукционе; возвращает копию аукциона"""
+        with self.lock:
+            auction = self.auctions[self.rnd.choice(list(self.auctions))]
+            auction['current_bid'] = round(auction['current_bid'] * self.rnd.uniform(1.02, 1.1), 2)
+            self._emit('tonnel', 'update', auction)
+            self.versions['tonnel'] += 1
+            return dict(auction)
+
+    def event_head(self, market: str) -> int:
+        """Номер последнего события площадки"""
+        with self.lock:
+            return self._event_seq[market]
+
+    def events_since(self, market: str, after: int, limit: int = None):
+        """События с номером больше after или None, если их уже нет в журнале"""
+        with self.lock:
+            log = self._events[market]
+            head = self._event_seq[market]
+            oldest = log[0][0] if log else head + 1
+            if after > head or after < oldest - 1:
+                return None
+            start = after - oldest + 1
+            stop = start + limit if limit else None
+            return list(itertools.islice(log, start, stop))
+
+    def page(self, market: str, offset: int, limit: int):
+        """(элементы страницы, всего, версия каталога)"""
+        with self.lock:
+            version = self.versions[market]
+            cached = self._ordered.get(market)
+            if cached is None or cached[0] != version:
+                catalog = self.portals if market == 'portals' else self.auctions
+                cached = self._ordered[market] = (version, list(catalog.values()))
+            items = cached[1][offset:offset + limit]
+            # Копии, чтобы tick() не менял уже отданные страницы
+            return [dict(item) for item in items], len(cached[1]), version
+
+    def auction(self, auction_id: str):
+        """Один аукцион или None, если он завершен"""
+        with self.lock:
+            auction = self.auctions.get(auction_id)
+            return dict(auction) if auction else None
@@ -0,0 +1,284 @@
+"""Локальные HTTP-заглушки Portals и Tonnel поверх синтетического рынка
+
+Запуск из корня проекта:
+    python -m dev.stub_server --listings 10000 --port 8080 --tick 45
+
+Сервер печатает адреса API; бот направляется на них переменными
+окружения PORTALS_API_URL и TONNEL_API_URL. Ответы повторяют формат
+настоящих API: страницы offset/limit с total, ETag и 304 на
+If-None-Match, точечный запрос аукциона. Задержку и долю ошибок 503
+можно задать для проверки повторов и хеджирования. POST /control/tick
+применяет шаг изменений рынка по запросу (используется бенчмарками),
+POST /control/bid - одну новую ставку.
+
+Изменения рынка отдаются потоком событий: GET .../events (Server-Sent
+Events, возобновление по Last-Event-ID) и GET .../events/poll (long-poll
+с after=<id>). id события - <эпоха запуска>-<номер>; на id из другой
+эпохи или вышедший из журнала отвечается событием reset.
+    python -m dev.stub_server --listings 10000 --bid-rate 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from aiohttp import web
+from dev.market import PRICE_DISTRIBUTIONS, SyntheticMarket
+
+
+# Пинг SSE-соединения без событий, сек (меньше STREAM_IDLE_TIMEOUT бота)
+HEARTBEAT_INTERVAL = 15
+# Событий в одной записи SSE или одном ответе long-poll
+EVENTS_CHUNK = 500
+
+
+class StubMarketServer:
+    """aiohttp-приложение с маршрутами /portals/v1 и /tonnel/v1"""
+
+    def __init__(self, market: SyntheticMarket, latency: float = 0.0,
+                 error_rate: float = 0.0, tick_interval: float = None, bid_rate: float = 0.0):
+        self.market = market
+        self.latency = latency
+        self.error_rate = error_rate
+        self.tick_interval = tick_interval
+        self.bid_rate = bid_rate
+        self.requests = 0
+        # Эпоха в id событий: после перезапуска заглушки старые id недействительны
+        self.epoch = format(time.time_ns(), 'x')
+        self._changed = asyncio.Event()
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get('/portals/v1/gifts', self._portals_page),
+            web.get('/tonnel/v1/auctions', self._tonnel_page),
+            web.get('/tonnel/v1/auctions/{auction_id}', self._tonnel_auction),
+            web.get('/{market:portals|tonnel}/v1/events', self._events_sse),
+            web.get('/{market:portals|tonnel}/v1/events/poll', self._events_poll),
+            web.post('/control/tick', self._tick),
+            web.post('/control/bid', self._bid),
+        ])
+        self.app.on_startup.append(self._start_ticker)
+        self.app.on_cleanup.append(self._stop_ticker)
+        self._tickers = []
+
+    async def _simulate(self):
+        """Задержка и случайный отказ перед ответом; None - отвечать штатно"""
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return web.json_response({'error': 'unavailable'}, status=503)
+        return None
+
+    async def _page(self, request, market: str, items_field: str):
+        failure = await self._simulate()
+        if failure is not None:
+            return failure
+        try:
+            offset = int(request.query.get('offset', 0))
+            limit = int(request.query.get('limit', 100))
+        except ValueError:
+            return web.json_response({'error': 'bad pagination'}, status=400)
+        items, total, version = self.market.page(market, offset, limit)
+        etag = f'"{market}-{version}-{offset}-{limit}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.json_response(
+            {items_field: items, 'total': total},
+            headers={'ETag': etag},
+            dumps=lambda payload: json.dumps(payload, separators=(',', ':'))
+        )
+
+    async def _portals_page(self, request):
+        return await self._page(request, 'portals', 'data')
+
+    async def _tonnel_page(self, request):
+        return await self._page(request, 'tonnel', 'items')
+
+    async def _tonnel_auction(self, request):
+        failure = await self._simulate()
+        if failure is not None:
+            return failure
+        auction = self.market.auction(request.match_info['auction_id'])
+        if auction is None:
+            return web.json_response({'error': 'not found'}, status=404)
+        return web.json_response({'item': auction})
+
+    def _event_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def _resume_point(self, market: str, event_id: str):
+        """Номер события из id клиента; None - продолжить нельзя"""
+        if not event_id:
+            # Без позиции поток начинается с текущего момента
+            return self.market.event_head(market)
+        epoch, _, seq = event_id.rpartition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def _notify(self):
+        """Пробуждение ожидающих потоков после изменения рынка"""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _events_sse(self, request):
+        failure = await self._simulate()
+        if failure is not None:
+            return failure
+        market = request.match_info['market']
+        cursor = self._resume_point(market, request.headers.get('Last-Event-ID'))
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        try:
+            await self._write_events(response, market, cursor)
+        except ConnectionResetError:
+            # Клиент отключился; при переподключении он пришлет Last-Event-ID
+            pass
+        return response
+
+    async def _write_events(self, response, market: str, cursor):
+        """Запись событий SSE с позиции cursor, пока клиент подключен"""
+        while True:
+            changed = self._changed
+            events = self.market.events_since(market, cursor, EVENTS_CHUNK) if cursor is not None else None
+            if events is None:
+                # Клиент отстал дальше журнала или пришел из прошлой эпохи
+                cursor = self.market.event_head(market)
+                await response.write(f"id: {self._event_id(cursor)}\nevent: reset\n\n".encode())
+                continue
+            if events:
+                # write() ждет, пока клиент читает: медленный клиент отстает, а не копит буфер
+                await response.write(''.join(
+                    f"id: {self._event_id(seq)}\nevent: {kind}\n"
+                    f"data: {json.dumps({'item': item}, separators=(',', ':'))}\n\n"
+                    for seq, kind, item in events
+                ).encode())
+                cursor = events[-1][0]
+                continue
+            try:
+                await asyncio.wait_for(changed.wait(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(b': ping\n\n')
+
+    async def _events_poll(self, request):
+        failure = await self._simulate()
+        if failure is not None:
+            return failure
+        market = request.match_info['market']
+        try:
+            timeout = min(float(request.query.get('timeout', 25)), 60)
+        except ValueError:
+            return web.json_response({'error': 'bad timeout'}, status=400)
+        after = request.query.get('after')
+        cursor = self._resume_point(market, after)
+        if after is None or cursor is None:
+            head = self.market.event_head(market)
+            return web.json_response({'events': [], 'last_id': self._event_id(head), 'reset': after is not None})
+
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = self._changed
+            events = self.market.events_since(market, cursor, EVENTS_CHUNK)
+            if events is None:
+                head = self.market.event_head(market)
+                return web.json_response({'events': [], 'last_id': self._event_id(head), 'reset': True})
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return web.json_response({
+                    'events': [
+                        {'id': self._event_id(seq), 'type': kind, 'item': item}
+                        for seq, kind, item in events
+                    ],
+                    'last_id': self._event_id(events[-1][0] if events else cursor),
+                }, dumps=lambda payload: json.dumps(payload, separators=(',', ':')))
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _tick(self, request):
+        self.market.tick()
+        self._notify()
+        return web.json_response(self.market.versions)
+
+    async def _bid(self, request):
+        auction = self.market.bid()
+        self._notify()
+        return web.json_response({'item': auction})
+
+    async def _start_ticker(self, app):
+        if self.tick_interval:
+            self._tickers.append(asyncio.ensure_future(self._tick_loop()))
+        if self.bid_rate:
+            self._tickers.append(asyncio.ensure_future(self._bid_loop()))
+
+    async def _stop_ticker(self, app):
+        for ticker in self._tickers:
+            ticker.cancel()
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            self.market.tick()
+            self._notify()
+
+    async def _bid_loop(self):
+        """Ставки с частотой bid_rate в секунду (пачками, если чаще 100/с)"""
+        interval = max(1 / self.bid_rate, 0.01)
+        per_step = max(int(self.bid_rate * interval), 1)
+        while True:
+            await asyncio.sleep(interval)
+            for _ in range(per_step):
+                self.market.bid()
+            self._notify()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local Portals/Tonnel API stubs with a synthetic market')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080, help='0 - any free port')
+    parser.add_argument('--listings', type=int, default=1000)
+    parser.add_argument('--auctions', type=int, default=None, help='Default: listings / 5')
+    parser.add_argument('--models', type=int, default=200)
+    parser.add_argument('--distribution', choices=PRICE_DISTRIBUTIONS, default='lognormal')
+    parser.add_argument('--median-price', type=float, default=8.0)
+    parser.add_argument('--spread', type=float, default=0.6)
+    parser.add_argument('--churn', type=float, default=0.05, help='Share of items changed per tick')
+    parser.add_argument('--tick', type=float, default=None, help='Seconds between market ticks')
+    parser.add_argument('--bid-rate', type=float, default=0.0, help='Auction bids per second')
+    parser.add_argument('--event-retention', type=int, default=10000, help='Events kept per market for resume')
+    parser.add_argument('--latency', type=float, default=0.0, help='Added response delay, s')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of 503 responses')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    market = SyntheticMarket(
+        listings=args.listings, auctions=args.auctions, models=args.models,
+        price_distribution=args.distribution, median_price=args.median_price,
+        spread=args.spread, churn=args.churn, seed=args.seed, event_retention=args.event_retention
+    )
+    server = StubMarketServer(market, args.latency, args.error_rate, args.tick, args.bid_rate)
+
+    async def serve():
+        runner = web.AppRunner(server.app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, args.host, args.port)
+        await site.start()
+        port = runner.addresses[0][1]
+        base = f"http://{args.host}:{port}"
+        # Первые строки вывода читают бенчмарки, поэтому сразу сбрасываем буфер
+        print(f"PORTALS_API_URL={base}/portals/v1", flush=True)
+        print(f"TONNEL_API_URL={base}/tonnel/v1", flush=True)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
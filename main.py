@@ -1,50 +1,76 @@
+import asyncio
 import logging
-from telegram.ext import Updater, Dispatcher
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
-from services.scheduler import DataScheduler
-from services.auth_manager import AuthManager
-from bot.handlers import BotHandlers
+from database import get_database
 from utils.logger import setup_logger
+from utils.metrics import start_metrics_server
 
 # Настройка логгера
 logger = setup_logger('main')
 
 def main():
     """Основная функция запуска бота"""
+    # Тяжелые модули импортируются здесь, а не при импорте main: процессы
+    # шардированного сканирования (spawn) повторно выполняют этот модуль
+    from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+    from services.scheduler import DataScheduler
+    from services.auth_manager import AuthManager
+    from bot.handlers import BotHandlers
     
-    # Инициализация менеджера аутентификации
+    # Инициализация менеджера аутентификации; токены получаются уже после старта
     auth_manager = AuthManager()
-    auth_manager.initialize_tokens()
     
-    # Запуск бота
-    updater = Updater(token=Config.BOT_TOKEN, use_context=True)
-    dp = updater.dispatcher
+    async def on_startup(app: Application):
+        # Ограниченный пул для блокирующих операций (SQLite, синхронный код)
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=Config.HANDLER_WORKERS, thread_name_prefix='worker')
+        )
+        scheduler.start(app.job_queue)
+        app.job_queue.run_once(auth_manager.initialize_tokens_job, when=0, name='token_init')
+        # Периодическое обновление токенов
+        app.job_queue.run_repeating(
+            auth_manager.refresh_tokens_job,
+            interval=auth_manager.token_refresh_interval,
+            first=auth_manager.token_refresh_interval,
+            name='token_refresh'
+        )
     
-    # Инициализация и запуск планировщика данных
-    scheduler = DataScheduler(updater.bot)
-    scheduler.start()
+    async def on_shutdown(app: Application):
+        # Остановка планировщика при завершении
+        await scheduler.stop()
+        if metrics_server:
+            metrics_server.shutdown()
+        get_database().close()
     
-    # Инициализация обработчиков
+    # Обработчики выполняются конкурентно в одном event loop
+    application = (
+        Application.builder()
+        .token(Config.BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    
+    # Инициализация планировщика данных и обработчиков
+    scheduler = DataScheduler(application.bot)
     handlers = BotHandlers(scheduler, auth_manager)
     
     # Регистрация обработчиков
-    dp.add_handler(CommandHandler("start", handlers.start))
-    dp.add_handler(CallbackQueryHandler(handlers.button_handler))
-    dp.add_error_handler(handlers.error_handler)
-    
-    # Запуск периодического обновления токенов
-    token_refresh_thread = threading.Thread(
-        target=auth_manager.run_token_refresh_scheduler,
-        daemon=True
-    )
-    token_refresh_thread.start()
+    application.add_handler(CommandHandler("start", handlers.start))
+    application.add_handler(CommandHandler("subscribe", handlers.subscribe))
+    application.add_handler(CommandHandler("unsubscribe", handlers.unsubscribe))
+    application.add_handler(CommandHandler("metrics", handlers.show_metrics))
+    application.add_handler(CallbackQueryHandler(handlers.button_handler))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.text_input))
+    application.add_error_handler(handlers.error_handler)
     
-    logger.info("Bot started")
-    updater.start_polling()
-    updater.idle()
+    # Prometheus-эндпоинт только на localhost
+    metrics_server = start_metrics_server(Config.METRICS_PORT) if Config.METRICS_PORT else None
     
-    # Остановка планировщика при завершении
-    scheduler.stop()
+    logger.info("Bot started")
+    application.run_polling()
 
 if __name__ == "__main__":
     main()
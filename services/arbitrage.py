@@ -1,77 +1,557 @@
-import logging
-from datetime import datetime
+import asyncio
+import bisect
+import time
+import numpy as np
 from config import Config
+from api.portals_api import PortalsMarket
+from api.tonnel_api import TonnelMarket
+from services.floor_index import CrossMarketIndex
+from services.records import Opportunity
 from utils.logger import setup_logger
+from utils.metrics import metrics
 
 logger = setup_logger('arbitrage')
 
+
+class OpportunityDelta:
+    """Изменения набора арбитражных возможностей между двумя сканированиями"""
+    
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.removed = []
+        # Сколько предложений пришлось пересчитать (мера активности рынка)
+        self.market_changes = 0
+        # Сканирование обошло все площадки целиком: набор возможностей полный
+        self.complete = False
+    
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+
 class ArbitrageCalculator:
-    """Калькулятор арбитражных возможностей между маркетплейсами"""
+    """Калькулятор арбитражных возможностей между маркетплейсами
+    
+    Площадки подключаются адаптерами (api.marketplace.Marketplace), элементы
+    каталогов - записи Listing. Любой элемент - предложение на покупку;
+    площадки с sellable=True дают еще и цену продажи (floor модели). Все
+    направления покупка -> продажа считаются через общий индекс моделей
+    CrossMarketIndex. Результат - записи Opportunity.
+    """
+    
+    def __init__(self, async_portals_api=None, async_tonnel_api=None, markets=None):
+        self.async_portals_api = async_portals_api
+        self.async_tonnel_api = async_tonnel_api
+        if markets is None:
+            markets = [PortalsMarket(async_portals_api), TonnelMarket(async_tonnel_api)]
+        self.markets = {market.name: market for market in markets}
+        # Площадки, для предложений которых есть хотя бы одна другая площадка продажи
+        sellable = [market.name for market in markets if market.sellable]
+        self.buy_markets = [
+            name for name in self.markets if any(other != name for other in sellable)
+        ]
+        self._build_range_lookup()
+        
+        # Состояние инкрементального режима: снимки рынков с прошлого цикла
+        self._snapshots = {name: {} for name in self.markets}
+        self._opportunities = {}
+        # Индекс floor-цен площадок продажи по (name, model) и обратная
+        # карта модель -> предложения для пересчета при смене floor
+        self.market_index = self._new_index()
+        self._offer_keys = {}
+        self._offers_by_key = {}
+        self._unkeyed_offers = set()
+        
+        self.match_time = metrics.histogram(
+            'arbitrage_match_seconds', 'Time to match buy offers with the best sell market'
+        )
+        self.profit_time = metrics.histogram(
+            'arbitrage_profit_seconds', 'Time to compute profit for matched pairs'
+        )
+        self.pairs_evaluated = metrics.counter(
+            'arbitrage_pairs_evaluated_total', 'Buy/sell pairs evaluated'
+        )
     
-    def __init__(self, portals_api, tonnel_api):
-        self.portals_api = portals_api
-        self.tonnel_api = tonnel_api
-        self.commissions = Config.COMMISSIONS
+    def _new_index(self) -> CrossMarketIndex:
+        return CrossMarketIndex({
+            name: market.fees for name, market in self.markets.items() if market.sellable
+        })
+    
+    
+    @property
+    def opportunity_count(self) -> int:
+        """Число возможностей после последнего сканирования или точечной проверки"""
+        return len(self._opportunities)
+    
+    def opportunity_ids(self) -> list:
+        """Идентификаторы всех текущих возможностей"""
+        return list(self._opportunities)
+    
+    def settings_key(self) -> str:
+        """Параметры, от которых зависит расчет возможностей: комиссии, порог и диапазоны"""
+        fees = sorted(
+            (name, market.fees.buy, market.fees.sell, market.fees.withdraw)
+            for name, market in self.markets.items()
+        )
+        return repr((fees, Config.MIN_PROFIT, sorted(Config.PRICE_RANGES)))
+    
+    def export_state(self):
+        """Состояние для снимка быстрого старта: (каталоги площадок, возможности)
+        
+        Записи неизменяемы, так что копируются только списки ссылок на них;
+        вызывать из event loop, пока сканирование не меняет словари.
+        """
+        markets = {name: list(items.values()) for name, items in self._snapshots.items()}
+        return markets, list(self._opportunities.values())
+    
+    def restore(self, markets: dict, opportunities=None):
+        """Восстановление состояния из снимка прошлого запуска
+        
+        Снимки площадок, индекс floor-цен и карта предложений строятся так
+        же, как после сканирования, и первый цикл после старта считает только
+        изменения за время простоя. Без opportunities (снимок сделан с другими
+        комиссиями или порогом) возможности пересчитываются по каталогам.
+        """
+        self._snapshots = {name: {} for name in self.markets}
+        self.market_index = self._new_index()
+        self._offer_keys = {}
+        self._offers_by_key = {}
+        self._unkeyed_offers = set()
+        for name, items in markets.items():
+            snapshot = self._snapshots.get(name)
+            if snapshot is None:
+                # Площадка отключена с прошлого запуска
+                continue
+            for item in items:
+                snapshot[item.id] = item
+        for name in self.market_index.markets:
+            self.market_index.load(name, (
+                (item.id, item.key, item.price) for item in self._snapshots[name].values()
+            ))
+        for name in self.buy_markets:
+            for item_id in self._snapshots[name]:
+                self._update_offer_key(name, item_id)
+        
+        if opportunities is None:
+            opportunities = self._evaluate_pairs(self._match_exits(
+                self._all_offers(self._snapshots), self._snapshots, self.market_index
+            ))
+        self._opportunities = self._best_per_nft(opportunities, as_dict=True)
+    
+    def snapshot(self, market: str) -> dict:
+        """Последнее известное состояние каталога площадки: id -> Listing"""
+        return self._snapshots.get(market, {})
+    
+    @property
+    def auction_snapshot(self) -> dict:
+        """Последнее известное состояние аукционов: gift_id -> аукцион"""
+        return self.snapshot('tonnel')
+    
+    def market_rows(self, auctions=None):
+        """Цены рынков в виде строк для истории: (gift_id, (name, model), цена, окончание)
+        
+        Без auctions - полный последний снимок обоих рынков, иначе только
+        переданные аукционы. Аукционы без известной модели пропускаются.
+        """
+        listings = [] if auctions is not None else [
+            (gift.id, gift.key, gift.price, 0)
+            for gift in self.snapshot('portals').values()
+        ]
+        auction_rows = []
+        for auction in (self.auction_snapshot.values() if auctions is None else auctions):
+            key = self._offer_key('tonnel', auction)
+            if key is not None:
+                auction_rows.append((auction.id, key, auction.price, auction.end_time))
+        return listings, auction_rows
+    
+    def _build_range_lookup(self):
+        """Подготовка границ ценовых диапазонов для бинарного поиска"""
+        ranges = sorted(Config.PRICE_RANGES)
+        self._range_starts = [min_val for min_val, _ in ranges]
+        self._range_ends = [max_val for _, max_val in ranges]
+        self._range_starts_arr = np.array(self._range_starts, dtype=np.float64)
+        self._range_ends_arr = np.array(self._range_ends, dtype=np.float64)
+        # Последняя метка - для цен вне всех диапазонов
+        self.price_range_labels = [
+            f"{min_val}-{max_val}" for min_val, max_val in ranges
+        ] + ["other"]
     
     def _determine_price_range(self, price: float) -> str:
         """Определение ценового диапазона"""
-        for min_val, max_val in Config.PRICE_RANGES:
-            if min_val <= price < max_val:
-                return f"{min_val}-{max_val}"
+        idx = bisect.bisect_right(self._range_starts, price) - 1
+        if idx >= 0 and price < self._range_ends[idx]:
+            return self.price_range_labels[idx]
         return "other"
     
-    def calculate_profit(self, auction_price: float, market_price: float) -> float:
-        """Расчет прибыли с учетом комиссий"""
+    def price_range_indices(self, prices) -> np.ndarray:
+        """Индексы ценовых диапазонов для массива цен (searchsorted)
+        
+        Индекс len(PRICE_RANGES) соответствует метке "other".
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        idx = np.searchsorted(self._range_starts_arr, prices, side='right') - 1
+        safe_idx = np.clip(idx, 0, None)
+        in_range = (idx >= 0) & (prices < self._range_ends_arr[safe_idx])
+        return np.where(in_range, idx, len(self._range_starts))
+    
+    def calculate_profit(self, auction_price: float, market_price: float,
+                         buy_market: str = 'tonnel', sell_market: str = 'portals') -> float:
+        """Расчет прибыли с учетом комиссий площадок покупки и продажи"""
         if not auction_price or not market_price:
             return 0.0
         
-        # Расчет чистой выручки после комиссий
-        net_revenue = market_price * (1 - self.commissions['portals'])
+        # Чистая выручка после комиссии продажи минус затраты на покупку и вывод
+        return (
+            self.markets[sell_market].fees.proceeds(market_price)
+            - self.markets[buy_market].fees.cost(auction_price)
+        )
+    
+    def calculate_profit_batch(self, auction_prices, market_prices,
+                               buy_market: str = 'tonnel', sell_market: str = 'portals'):
+        """Векторный расчет прибыли и ценовых диапазонов за один проход
+        
+        Принимает колонки цен покупки и продажи одного направления,
+        возвращает массив прибыли (совпадает с calculate_profit поэлементно)
+        и массив индексов диапазонов в price_range_labels.
+        """
+        buy_fees = self.markets[buy_market].fees
+        sell_fees = self.markets[sell_market].fees
+        return self._profit_batch(
+            auction_prices, market_prices,
+            buy_fees.buy, buy_fees.withdraw, sell_fees.sell
+        )
+    
+    def _profit_batch(self, bids, asks, buy_rate, withdraw, sell_rate):
+        """Прибыль для колонок цен и комиссий (комиссии - числа или массивы)"""
+        bids = np.asarray(bids, dtype=np.float64)
+        asks = np.asarray(asks, dtype=np.float64)
         
-        # Расчет общих затрат
-        total_cost = auction_price * (1 + self.commissions['tonnel']) + self.commissions['transfer']
+        net_revenue = asks * (1 - sell_rate)
+        total_cost = bids * (1 + buy_rate) + withdraw
         
-        # Прибыль
-        return net_revenue - total_cost
+        # Нулевая цена покупки или продажи - прибыль не считается, как в скалярной версии
+        valid = (bids != 0) & (asks != 0)
+        profits = np.where(valid, net_revenue - total_cost, 0.0)
+        return profits, self.price_range_indices(bids)
     
     def find_arbitrage_opportunities(self):
-        """Поиск арбитражных возможностей"""
-        portals_gifts = {
-            gift['id']: gift for gift in self.portals_api.get_active_gifts()
-        }
+        """Поиск арбитражных возможностей для кода вне event loop
         
-        opportunities = []
+        Выполняет find_arbitrage_opportunities_async() через asyncio.run;
+        HTTP-сессии клиентов привязаны к этому event loop и закрываются
+        в конце вызова.
+        """
+        async def scan():
+            try:
+                return await self.find_arbitrage_opportunities_async()
+            finally:
+                for market in self.markets.values():
+                    if market.client is not None:
+                        await market.client.close()
+        
+        return asyncio.run(scan())
+    
+    async def find_arbitrage_opportunities_async(self):
+        """Поиск арбитражных возможностей с параллельной загрузкой всех площадок
+        
+        Индекс floor-цен наполняется по мере прихода страниц, так что к
+        концу загрузки остается только сопоставить предложения с готовым
+        индексом.
+        """
+        snapshots = {name: {} for name in self.markets}
+        index = self._new_index()
         
-        for auction in self.tonnel_api.get_auction_gifts():
-            gift_id = auction['gift_id']
-            if gift_id not in portals_gifts:
+        async for name, page in self._iter_market_pages_async():
+            items = snapshots[name]
+            sellable = self.markets[name].sellable
+            for item in page:
+                items[item.id] = item
+                if sellable:
+                    index.upsert(name, item.id, item.key, item.price)
+        
+        # Последнее состояние рынков для истории цен и снимка быстрого старта
+        # (в этом режиме дельты не считаются)
+        self._snapshots = snapshots
+        self._opportunities = self._best_per_nft(self._evaluate_pairs(
+            self._match_exits(self._all_offers(snapshots), snapshots, index)
+        ), as_dict=True)
+        return list(self._opportunities.values())
+    
+    async def find_arbitrage_delta_async(self) -> OpportunityDelta:
+        """Инкрементальное сканирование: пересчет только изменившихся лотов
+        
+        Новые данные сравниваются со снимком прошлого цикла. Индекс floor-цен
+        обновляется только изменившимися лотами, а прибыль пересчитывается
+        лишь для предложений, которые изменились сами, либо у модели которых
+        сдвинулась лучшая цена продажи. Страницы, на которые сервер ответил
+        304, не сравниваются вовсе.
+        """
+        fresh = {name: {} for name in self.markets}
+        changed = {name: set() for name in self.markets}
+        
+        async for name, page in self._iter_market_pages_async():
+            snapshot = self._snapshots[name]
+            items = fresh[name]
+            for item in page:
+                items[item.id] = item
+                if page.not_modified:
+                    continue
+                if snapshot.get(item.id) != item:
+                    changed[name].add(item.id)
+        
+        # Исчезнувшие лоты учитываем только при полном обходе рынка,
+        # иначе ошибка одной страницы выглядела бы как массовое снятие лотов
+        removed = {}
+        for name, market in self.markets.items():
+            snapshot = self._snapshots[name]
+            if market.last_scan_complete:
+                removed[name] = snapshot.keys() - fresh[name].keys()
+            else:
+                removed[name] = set()
+                fresh[name] = {**snapshot, **fresh[name]}
+        self._snapshots = fresh
+        delta = self._apply_changes(changed, removed)
+        delta.complete = all(market.last_scan_complete for market in self.markets.values())
+        return delta
+    
+    def apply_updates(self, market: str, items, removed_ids=()) -> OpportunityDelta:
+        """Точечное обновление лотов одной площадки без полного сканирования
+        
+        Используется для повторных проверок аукционов и событий потоковых
+        API: снимок и индекс floor-цен меняются только переданными лотами,
+        пересчитываются их предложения и предложения затронутых моделей.
+        """
+        snapshot = self._snapshots[market]
+        changed, removed = set(), set()
+        for item in items:
+            if snapshot.get(item.id) != item:
+                changed.add(item.id)
+                snapshot[item.id] = item
+        for item_id in removed_ids:
+            if snapshot.pop(item_id, None) is not None:
+                removed.add(item_id)
+        return self._apply_changes({market: changed}, {market: removed})
+    
+    def apply_auction_updates(self, auctions, removed_ids=(), market: str = 'tonnel') -> OpportunityDelta:
+        """Точечное обновление аукционов (повторные проверки перед окончанием)"""
+        return self.apply_updates(market, auctions, removed_ids)
+    
+    def _apply_changes(self, changed: dict, removed: dict) -> OpportunityDelta:
+        """Обновление индекса и пересчет по изменившимся лотам: market -> set(id)
+        
+        Снимки площадок к этому моменту уже содержат новые версии лотов.
+        """
+        # Обновление индекса: затронутые модели помечают свои предложения
+        touched_keys = set()
+        listing_ids = set()
+        for name in self.market_index.markets:
+            for item_id in removed.get(name, ()):
+                touched_keys |= self.market_index.remove(name, item_id)
+            for item_id in changed.get(name, ()):
+                item = self._snapshots[name][item_id]
+                touched_keys |= self.market_index.upsert(name, item_id, item.key, item.price)
+            listing_ids |= changed.get(name, set()) | removed.get(name, set())
+        
+        dirty = set()
+        for name in self.buy_markets:
+            dirty.update((name, item_id) for item_id in changed.get(name, set()) | removed.get(name, set()))
+        for key in touched_keys:
+            dirty.update(self._offers_by_key.get(key, ()))
+        # Предложения без name/model могли получить ключ через лот с тем же id
+        dirty.update(offer for offer in self._unkeyed_offers if offer[1] in listing_ids)
+        
+        return self._reevaluate(dirty)
+    
+    def _reevaluate(self, dirty) -> OpportunityDelta:
+        """Пересчет возможностей для набора предложений (market, id) по текущим снимкам"""
+        for offer in dirty:
+            self._update_offer_key(*offer)
+        
+        # NFT может продаваться сразу на нескольких площадках: пересчитываются
+        # все его предложения, в возможность попадает самое выгодное
+        nft_ids = {item_id for _, item_id in dirty}
+        offers = [
+            (name, self._snapshots[name][item_id])
+            for item_id in nft_ids
+            for name in self.buy_markets
+            if item_id in self._snapshots[name]
+        ]
+        pairs = self._match_exits(offers, self._snapshots, self.market_index)
+        evaluated = self._best_per_nft(self._evaluate_pairs(pairs), as_dict=True)
+        
+        delta = OpportunityDelta()
+        delta.market_changes = len(dirty)
+        for nft_id in nft_ids:
+            opportunity = evaluated.get(nft_id)
+            previous = self._opportunities.get(nft_id)
+            if opportunity is None:
+                if previous is not None:
+                    del self._opportunities[nft_id]
+                    delta.removed.append(nft_id)
+            elif previous is None:
+                self._opportunities[nft_id] = opportunity
+                delta.added.append(opportunity)
+            elif previous != opportunity:
+                self._opportunities[nft_id] = opportunity
+                delta.changed.append(opportunity)
+        
+        logger.debug(
+            f"Delta scan: {len(dirty)} dirty, +{len(delta.added)} "
+            f"~{len(delta.changed)} -{len(delta.removed)}"
+        )
+        return delta
+    
+    def _update_offer_key(self, market, item_id):
+        """Поддержка обратной карты модель -> предложения"""
+        offer = (market, item_id)
+        item = self._snapshots[market].get(item_id)
+        key = self._offer_key(market, item) if item is not None else None
+        old_key = self._offer_keys.get(offer)
+        if old_key is not None and old_key == key:
+            # Модель не сменилась - обычный случай при изменении цены
+            return
+        
+        if old_key is not None:
+            del self._offer_keys[offer]
+            keyed = self._offers_by_key[old_key]
+            keyed.discard(offer)
+            if not keyed:
+                del self._offers_by_key[old_key]
+        self._unkeyed_offers.discard(offer)
+        
+        if item is None:
+            return
+        if key is None:
+            self._unkeyed_offers.add(offer)
+            return
+        self._offer_keys[offer] = key
+        self._offers_by_key.setdefault(key, set()).add(offer)
+    
+    async def _iter_market_pages_async(self, stripe: int = 0, stripes: int = 1):
+        """Общий поток страниц всех площадок, загружаемых одновременно"""
+        if any(market.client is None for market in self.markets.values()):
+            raise RuntimeError("Async API clients are not configured")
+        
+        queue = asyncio.Queue(maxsize=Config.API_MAX_CONCURRENT_PAGES * 2)
+        
+        async def pump(source, pages):
+            try:
+                async for page in pages:
+                    await queue.put((source, page))
+            finally:
+                await queue.put((source, None))
+        
+        # Площадки грузятся одновременно: цикл стоит как самая медленная из них
+        tasks = [
+            asyncio.create_task(pump(name, market.iter_pages(stripe, stripes)))
+            for name, market in self.markets.items()
+        ]
+        try:
+            finished = 0
+            while finished < len(tasks):
+                source, page = await queue.get()
+                if page is None:
+                    finished += 1
+                    continue
+                yield source, page
+            # Пробрасываем ошибки загрузчиков, если они были
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    def _all_offers(self, snapshots):
+        """Все предложения площадок, у которых есть куда продать"""
+        return [
+            (name, item)
+            for name in self.buy_markets
+            for item in snapshots.get(name, {}).values()
+        ]
+    
+    def _offer_key(self, market, item, snapshots=None):
+        """Ключ модели предложения; без name/model берется из лота с тем же id"""
+        key = item.key
+        if key is not None:
+            return key
+        for name, other in self.markets.items():
+            if name == market or not other.sellable:
                 continue
-                
-            portals_gift = portals_gifts[gift_id]
-            auction_price = auction['current_bid']
-            market_price = portals_gift['price']
-            
-            # Расчет прибыли
-            profit = self.calculate_profit(auction_price, market_price)
-            
-            # Фильтрация по минимальной прибыли
-            if profit < Config.MIN_PROFIT:
+            listing = (snapshots or self._snapshots).get(name, {}).get(item.id)
+            if listing is not None and listing.key is not None:
+                return listing.key
+        return None
+    
+    def _match_exits(self, offers, snapshots, index):
+        """Пары (площадка покупки, предложение, площадка продажи, лот floor)
+        
+        Один поиск в хэш-индексе моделей на предложение, без перебора пар
+        площадок.
+        """
+        started = time.perf_counter()
+        pairs = []
+        for market, item in offers:
+            key = self._offer_key(market, item, snapshots)
+            if key is None:
                 continue
-                
-            # Определение ценового диапазона
-            price_range = self._determine_price_range(auction_price)
-            
-            opportunities.append((
-                gift_id,
-                portals_gift['name'],
-                portals_gift['model'],
-                auction['end_time'],
-                auction_price,
-                market_price,
-                # Расчетная цена для Tonnel (для полноты данных)
-                auction_price * (1 + self.commissions['tonnel']),
-                profit,
-                price_range
-            ))
+            best = index.best_exit(key, market)
+            if best is None:
+                continue
+            _, sell_market, _, listing_id = best
+            pairs.append((market, item, sell_market, snapshots[sell_market][listing_id]))
+        self.match_time.observe(time.perf_counter() - started)
+        return pairs
+    
+    def _evaluate_pairs(self, pairs):
+        """Пакетный расчет возможностей для списка пар покупка/продажа"""
+        if not pairs:
+            return []
+        
+        started = time.perf_counter()
+        count = len(pairs)
+        markets = self.markets
+        bids = np.fromiter((item.price for _, item, _, _ in pairs), dtype=np.float64, count=count)
+        asks = np.fromiter((listing.price for _, _, _, listing in pairs), dtype=np.float64, count=count)
+        # Комиссии по строкам: в одном пакете могут быть разные направления
+        buy_rates = np.fromiter((markets[buy].fees.buy for buy, _, _, _ in pairs), dtype=np.float64, count=count)
+        withdraws = np.fromiter((markets[buy].fees.withdraw for buy, _, _, _ in pairs), dtype=np.float64, count=count)
+        sell_rates = np.fromiter((markets[sell].fees.sell for _, _, sell, _ in pairs), dtype=np.float64, count=count)
+        profits, range_indices = self._profit_batch(bids, asks, buy_rates, withdraws, sell_rates)
+        buy_prices = bids * (1 + buy_rates)
         
+        # Фильтрация по минимальной прибыли
+        keep = np.flatnonzero(profits >= Config.MIN_PROFIT).tolist()
+        profits = profits.tolist()
+        buy_prices = buy_prices.tolist()
+        range_indices = range_indices.tolist()
+        labels = self.price_range_labels
+        
+        opportunities = []
+        for i in keep:
+            buy, item, sell, listing = pairs[i]
+            opportunities.append(Opportunity(
+                item.id,
+                listing.name,
+                listing.model,
+                item.end_time,
+                item.price,
+                listing.price,
+                # Цена покупки с комиссией площадки (для полноты данных)
+                buy_prices[i],
+                profits[i],
+                labels[range_indices[i]],
+                buy,
+                sell
+            ))
+        self.profit_time.observe(time.perf_counter() - started)
+        self.pairs_evaluated.inc(count)
         return opportunities
+    
+    @staticmethod
+    def _best_per_nft(opportunities, as_dict=False):
+        """Одна возможность на NFT - с наибольшей прибылью"""
+        best = {}
+        for opp in opportunities:
+            current = best.get(opp.nft_id)
+            if current is None or opp.profit > current.profit:
+                best[opp.nft_id] = opp
+        return best if as_dict else list(best.values())
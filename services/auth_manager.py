@@ -1,8 +1,9 @@
-import requests
-import logging
+import asyncio
 import time
 from config import Config
-from database import DatabaseManager
+from database import get_database
+from services.token_provider import get_token_provider
+from utils.concurrency import SingleFlight
 from utils.logger import setup_logger
 
 logger = setup_logger('auth_manager')
@@ -11,45 +12,68 @@ class AuthManager:
     """Управление аутентификацией и обновлением токенов"""
     
     def __init__(self):
-        self.db = DatabaseManager()
+        self.db = get_database()
+        self.tokens = get_token_provider()
+        self.tokens.set_refresher('portals', self._fetch_portals_token)
+        self.tokens.set_refresher('tonnel', self._fetch_tonnel_token)
         self.token_refresh_interval = 3600  # 1 час
+        self._single_flight = SingleFlight()
+        self._last_refresh_at = None
+        self._last_refresh_result = (False, False)
     
     def initialize_tokens(self):
-        """Инициализация токенов при запуске"""
-        if not self.db.get_auth_token('portals'):
-            self.refresh_portals_token()
-        
-        if not self.db.get_auth_token('tonnel'):
-            self.refresh_tonnel_token()
+        """Инициализация токенов при запуске (отсутствующие и истекшие получаются заново)"""
+        self.tokens.get('portals')
+        self.tokens.get('tonnel')
+    
+    def _fetch_portals_token(self):
+        """Получение нового токена Portals Market: (token, expires_at)"""
+        # Реальная логика получения токена через OAuth
+        # Для примера - эмуляция
+        new_token = "new_portals_token_" + str(int(time.time()))
+        return new_token, int(time.time()) + Config.TOKEN_TTL
+    
+    def _fetch_tonnel_token(self):
+        """Получение нового токена Tonnel Relayer: (token, expires_at)"""
+        # Реальная логика получения токена
+        new_token = "new_tonnel_token_" + str(int(time.time()))
+        return new_token, int(time.time()) + Config.TOKEN_TTL
     
     def refresh_portals_token(self):
         """Обновление токена Portals Market"""
-        try:
-            # Реальная логика получения токена через OAuth
-            # Для примера - эмуляция
-            new_token = "new_portals_token_" + str(int(time.time()))
-            self.db.save_auth_token('portals', new_token)
-            logger.info("Portals token refreshed")
-            return True
-        except Exception as e:
-            logger.error(f"Error refreshing Portals token: {str(e)}")
-            return False
+        return self.tokens.refresh('portals') is not None
     
     def refresh_tonnel_token(self):
         """Обновление токена Tonnel Relayer"""
-        try:
-            # Реальная логика получения токена
-            new_token = "new_tonnel_token_" + str(int(time.time()))
-            self.db.save_auth_token('tonnel', new_token)
-            logger.info("Tonnel token refreshed")
-            return True
-        except Exception as e:
-            logger.error(f"Error refreshing Tonnel token: {str(e)}")
-            return False
-    
-    def run_token_refresh_scheduler(self):
-        """Периодическое обновление токенов"""
-        while True:
-            time.sleep(self.token_refresh_interval)
-            self.refresh_portals_token()
-            self.refresh_tonnel_token()
+        return self.tokens.refresh('tonnel') is not None
+    
+    def refresh_all_tokens(self):
+        """Обновление обоих токенов с объединением одновременных запросов
+
+        Возвращает (portals_success, tonnel_success). Повторный запрос в
+        течение TOKEN_REFRESH_MIN_INTERVAL отдает результат прошлого обновления.
+        """
+        if (self._last_refresh_at is not None
+                and time.monotonic() - self._last_refresh_at < Config.TOKEN_REFRESH_MIN_INTERVAL):
+            return self._last_refresh_result
+        return self._single_flight.do('refresh', self._refresh_all_tokens)
+    
+    def _refresh_all_tokens(self):
+        """Последовательное обновление токенов обоих сервисов"""
+        result = (self.refresh_portals_token(), self.refresh_tonnel_token())
+        self._last_refresh_at = time.monotonic()
+        self._last_refresh_result = result
+        return result
+    
+    async def initialize_tokens_job(self, context):
+        """Инициализация токенов после старта бота (задача JobQueue)
+
+        Получение токенов (и импорт cryptography для их расшифровки) не
+        задерживает начало обработки сообщений; сканирование, начавшееся
+        раньше, получит токен по запросу через тот же провайдер.
+        """
+        await asyncio.to_thread(self.initialize_tokens)
+    
+    async def refresh_tokens_job(self, context):
+        """Периодическое обновление токенов (задача JobQueue)"""
+        await asyncio.to_thread(self._single_flight.do, 'refresh', self._refresh_all_tokens)
@@ -0,0 +1,302 @@
+"""Бэктест параметров арбитража на записанной истории цен
+
+Запуск из корня проекта:
+    python -m services.backtest --days 30 \
+        --grid min_profit=0.1,0.5,1 tonnel.buy=0.05,0.06 --workers 4
+
+Прогон состоит из двух этапов. Сначала история (services.history) один
+раз проигрывается через ArbitrageCalculator: его индекс floor-цен и
+правила сопоставления дают для каждого аукциона последовательность пар
+(ставка, floor) и итог - последнюю ставку и floor на момент завершения.
+От комиссий и порога прибыли этот этап не зависит, поэтому сетка
+параметров затем считается векторно по готовым массивам, порциями в
+пуле процессов. В истории записаны только Portals и Tonnel, поэтому
+проигрывается направление покупки на Tonnel и продажи на Portals.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from api.marketplace import FeeModel
+from config import Config
+from services.arbitrage import ArbitrageCalculator
+from services.history import HistoryReader, PORTALS
+from services.records import Listing
+
+# Параметры сетки: комиссии площадок в виде '<market>.<buy|sell|withdraw>' и порог прибыли
+PARAMETERS = tuple(
+    f'{market}.{fee}' for market, fees in Config.MARKET_FEES.items() for fee in fees
+) + ('min_profit',)
+
+
+def default_params() -> dict:
+    params = {
+        f'{market}.{fee}': value
+        for market, fees in Config.MARKET_FEES.items() for fee, value in fees.items()
+    }
+    params['min_profit'] = Config.MIN_PROFIT
+    return params
+
+
+class MarketReplay:
+    """Проигрывание истории через ArbitrageCalculator
+
+    Каждое появление аукциона получает свой номер. events - смены пары
+    (ставка, floor) по аукционам, outcomes - итог завершившихся аукционов.
+    """
+
+    def __init__(self, reader: HistoryReader):
+        self.reader = reader
+        self.calc = ArbitrageCalculator()
+        # item id -> аукцион (Listing) и его номер
+        self._auctions = {}
+        self._auction_seq = {}
+        self._auctions_by_key = {}
+        self._next_seq = 0
+        self._events = ([], [], [], [])      # номер, время, ставка, floor
+        self._outcomes = ([], [], [], [])    # номер, время, ставка, floor
+        self.scans = 0
+
+    def run(self, days: int = None, until: float = None) -> dict:
+        last_ts = None
+        for ts, keyframe, rows in self.reader.iter_scans(days, until):
+            self._apply_scan(ts, keyframe, rows)
+            last_ts = ts
+            self.scans += 1
+        # Аукционы, окончание которых прошло до конца истории, тоже закрываются
+        if last_ts is not None:
+            for item_id, auction in list(self._auctions.items()):
+                if auction.end_time and auction.end_time <= last_ts:
+                    self._close_auction(item_id, last_ts)
+        return self.arrays()
+
+    def arrays(self) -> dict:
+        """Массивы итогов и событий завершившихся аукционов (сгруппированы по номеру)"""
+        outcomes = [np.array(column) for column in self._outcomes]
+        outcome_order = np.argsort(np.asarray(outcomes[0], dtype=np.int64), kind='stable')
+        events = [np.array(column) for column in self._events]
+        closed = np.isin(np.asarray(events[0], dtype=np.int64), np.asarray(outcomes[0], dtype=np.int64))
+        order = np.flatnonzero(closed)
+        order = order[np.argsort(np.asarray(events[0], dtype=np.int64)[order], kind='stable')]
+        names = ('auction', 'ts', 'bid', 'ask')
+        dtypes = (np.int64, np.int64, np.float64, np.float64)
+        result = {}
+        for prefix, columns, idx in (('event', events, order), ('outcome', outcomes, outcome_order)):
+            for name, dtype, column in zip(names, dtypes, columns):
+                result[f'{prefix}_{name}'] = column.astype(dtype)[idx]
+        return result
+
+    def _apply_scan(self, ts, keyframe, rows):
+        calc = self.calc
+        portals_gifts = calc.snapshot('portals')
+        markets = rows['market']
+        items = rows['item'].tolist()
+        models = rows['model'].tolist()
+        prices = rows['price'].tolist()
+        ends = rows['end'].tolist()
+        model_names = self.reader.models.values
+
+        touched_keys = set()
+        dirty = set()
+        if keyframe:
+            # Полный снимок: все, чего в нем нет, снято или завершено
+            present = set(items)
+            for item_id in list(portals_gifts):
+                if item_id not in present:
+                    touched_keys |= calc.market_index.remove('portals', item_id)
+                    del portals_gifts[item_id]
+            for item_id in list(self._auctions):
+                if item_id not in present:
+                    self._close_auction(item_id, ts)
+
+        # Сначала лоты Portals, чтобы итоги аукционов видели актуальный floor
+        portals_rows = np.flatnonzero(markets == PORTALS).tolist()
+        tonnel_rows = np.flatnonzero(markets != PORTALS).tolist()
+        for i in portals_rows:
+            item_id, price = items[i], prices[i]
+            if price != price:
+                if portals_gifts.pop(item_id, None) is not None:
+                    touched_keys |= calc.market_index.remove('portals', item_id)
+                continue
+            name, model = model_names[models[i]]
+            portals_gifts[item_id] = Listing(item_id, name, model, price)
+            touched_keys |= calc.market_index.upsert('portals', item_id, (name, model), price)
+
+        for i in tonnel_rows:
+            item_id, price = items[i], prices[i]
+            if price != price:
+                self._close_auction(item_id, ts)
+                continue
+            name, model = model_names[models[i]]
+            if item_id not in self._auctions:
+                self._auction_seq[item_id] = self._next_seq
+                self._next_seq += 1
+            else:
+                self._auctions_by_key[self._auctions[item_id].key].discard(item_id)
+            self._auctions[item_id] = Listing(item_id, name, model, price, ends[i])
+            self._auctions_by_key.setdefault((name, model), set()).add(item_id)
+            dirty.add(item_id)
+
+        for key in touched_keys:
+            dirty.update(self._auctions_by_key.get(key, ()))
+        self._record_pairs(ts, dirty)
+
+    def _record_pairs(self, ts, dirty):
+        """События для аукционов, у которых могла смениться пара"""
+        auctions = [self._auctions[item_id] for item_id in dirty if item_id in self._auctions]
+        calc = self.calc
+        offers = [('tonnel', auction) for auction in auctions]
+        paired = set()
+        for _, auction, _, portals_gift in calc._match_exits(offers, calc._snapshots, calc.market_index):
+            paired.add(auction.id)
+            self._add(self._events, auction.id, ts, auction.price, portals_gift.price)
+        # Модель без лотов на Portals: пара пропала, прибыль нулевая
+        for auction in auctions:
+            if auction.id not in paired:
+                self._add(self._events, auction.id, ts, auction.price, 0.0)
+
+    def _close_auction(self, item_id, ts):
+        auction = self._auctions.pop(item_id, None)
+        if auction is None:
+            return
+        self._auctions_by_key[auction.key].discard(item_id)
+        floor = self.calc.market_index.floor('portals', auction.key)
+        self._add(self._outcomes, item_id, ts, auction.price, floor[0] if floor else 0.0)
+        del self._auction_seq[item_id]
+
+    def _add(self, target, item_id, ts, bid, ask):
+        for column, value in zip(target, (self._auction_seq[item_id], ts, bid, ask)):
+            column.append(value)
+
+
+def evaluate(data: dict, params: dict) -> dict:
+    """Метрики одной комбинации параметров
+
+    Сигнал - первый момент, когда прибыль пары достигла min_profit
+    (прогнозная прибыль). Итоговая прибыль - по последней ставке и floor
+    на момент завершения, то есть результат покупки по финальной цене.
+    Попадание - сигнал, итог которого не ниже min_profit; пропуск -
+    аукцион с таким итогом, по которому сигнала не было.
+    """
+    calc = ArbitrageCalculator()
+    for name, market in calc.markets.items():
+        market.fees = FeeModel(**{
+            fee: params[f'{name}.{fee}'] for fee in Config.MARKET_FEES.get(name, {})
+        })
+    min_profit = params['min_profit']
+
+    closed = data['outcome_auction']
+    realized, _ = calc.calculate_profit_batch(data['outcome_bid'], data['outcome_ask'])
+    event_auction = data['event_auction']
+    profits, _ = calc.calculate_profit_batch(data['event_bid'], data['event_ask'])
+
+    predicted = np.full(len(closed), np.nan)
+    alert_ts = np.zeros(len(closed), dtype=np.int64)
+    if len(event_auction):
+        auctions, starts = np.unique(event_auction, return_index=True)
+        positions = np.searchsorted(closed, auctions)
+        signal = np.where(profits >= min_profit, np.arange(len(profits)), len(profits))
+        first = np.minimum.reduceat(signal, starts)
+        has_signal = first < len(profits)
+        predicted[positions[has_signal]] = profits[first[has_signal]]
+        alert_ts[positions[has_signal]] = data['event_ts'][first[has_signal]]
+
+    alerted = ~np.isnan(predicted)
+    profitable = realized >= min_profit
+    hits = int(np.count_nonzero(alerted & profitable))
+    alerts = int(np.count_nonzero(alerted))
+    lead = data['outcome_ts'][alerted] - alert_ts[alerted]
+    return {
+        **params,
+        'auctions': len(closed),
+        'alerts': alerts,
+        'hits': hits,
+        'hit_rate': round(hits / alerts, 4) if alerts else 0.0,
+        'missed': int(np.count_nonzero(~alerted & profitable)),
+        'predicted_profit': round(float(predicted[alerted].sum()), 4),
+        'realized_profit': round(float(realized[alerted].sum()), 4),
+        'median_lead_seconds': float(np.median(lead)) if len(lead) else 0.0,
+    }
+
+
+_worker_data = None
+
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _evaluate_chunk(chunk):
+    return [evaluate(_worker_data, params) for params in chunk]
+
+
+def parameter_grid(grid: dict) -> list:
+    """Все комбинации значений; неуказанные параметры - из Config"""
+    base = default_params()
+    names = list(grid)
+    return [
+        {**base, **dict(zip(names, values))}
+        for values in itertools.product(*(grid[name] for name in names))
+    ]
+
+
+def sweep(data: dict, combinations: list, workers: int = None) -> list:
+    """Оценка комбинаций в пуле процессов; массивы передаются воркеру один раз"""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(combinations) <= 1:
+        return [evaluate(data, params) for params in combinations]
+    chunk_size = max(len(combinations) // (workers * 4), 1)
+    chunks = [combinations[i:i + chunk_size] for i in range(0, len(combinations), chunk_size)]
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(data,)) as pool:
+        return [result for chunk in pool.map(_evaluate_chunk, chunks) for result in chunk]
+
+
+def _parse_grid(specs) -> dict:
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        if name not in PARAMETERS:
+            raise SystemExit(f"Unknown parameter {name!r}, expected one of {', '.join(PARAMETERS)}")
+        grid[name] = [float(value) for value in values.split(',') if value]
+    return grid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Backtest arbitrage parameters on recorded price history')
+    parser.add_argument('--history', default=Config.HISTORY_DIR, help='History directory')
+    parser.add_argument('--days', type=int, default=None, help='Last N days (default: all)')
+    parser.add_argument('--grid', nargs='*', default=[], metavar='NAME=V1,V2',
+                        help=f"Parameter values: {', '.join(PARAMETERS)}")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--top', type=int, default=20, help='Rows to print')
+    parser.add_argument('--output', help='Write all results as JSON')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    replay = MarketReplay(HistoryReader(args.history))
+    data = replay.run(args.days)
+    replayed = time.perf_counter() - started
+    combinations = parameter_grid(_parse_grid(args.grid))
+    results = sweep(data, combinations, args.workers)
+    results.sort(key=lambda row: row['realized_profit'], reverse=True)
+    print(
+        f"{replay.scans} scans, {len(data['outcome_auction'])} closed auctions, "
+        f"{len(data['event_auction'])} pair changes; replayed in {replayed:.1f}s; "
+        f"{len(combinations)} combinations in {time.perf_counter() - started - replayed:.1f}s"
+    )
+
+    columns = PARAMETERS + ('alerts', 'hits', 'hit_rate', 'missed', 'predicted_profit', 'realized_profit')
+    print(' '.join(f'{name:>16}' for name in columns))
+    for row in results[:args.top]:
+        print(' '.join(f'{row[name]:>16}' for name in columns))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import threading
+import time
+
+
+class VersionedCache:
+    """Кэш чтения с инвалидацией по номеру поколения данных
+
+    Планировщик увеличивает поколение после каждого сохранения, и все
+    записи предыдущего поколения становятся недействительными. Между
+    сканированиями ответы отдаются из памяти.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.generation = 0
+        self.updated_at = time.time()
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Повторный захват нужен для вложенных вычислений (страница -> строки)
+        self._compute_lock = threading.RLock()
+
+    def bump(self):
+        """Переход к новому поколению данных"""
+        with self._lock:
+            self.generation += 1
+            self.updated_at = time.time()
+            self._entries.clear()
+
+    def get_or_compute(self, key, compute):
+        """Значение из кэша или результат compute() для текущего поколения"""
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+
+        # Одновременные промахи не должны превращаться в одинаковые запросы к БД
+        with self._compute_lock:
+            with self._lock:
+                if key in self._entries:
+                    return self._entries[key]
+                generation = self.generation
+
+            value = compute()
+
+            with self._lock:
+                # Результат, посчитанный по устаревшим данным, не сохраняем
+                if generation == self.generation:
+                    if len(self._entries) >= self.max_entries:
+                        self._entries.clear()
+                    self._entries[key] = value
+            return value
@@ -0,0 +1,157 @@
+import bisect
+
+
+class FloorPriceIndex:
+    """Упорядоченные цены лотов по ключу (name, model)
+
+    Для каждого ключа хранится отсортированный список (цена, id) - минимальная
+    цена модели (floor) доступна за O(1), вставка и удаление лота выполняются
+    через бинарный поиск, без пересборки индекса.
+    """
+
+    def __init__(self):
+        self._books = {}
+        # listing_id -> (ключ, запись в книге)
+        self._entries = {}
+
+    @classmethod
+    def from_listings(cls, listings):
+        """Построение индекса из (listing_id, key, price) одной сортировкой
+
+        При повторе id действует последняя запись, как при upsert.
+        """
+        latest = {listing_id: (key, price) for listing_id, key, price in listings}
+        index = cls()
+        for listing_id, (key, price) in latest.items():
+            if not price:
+                continue
+            entry = (price, str(listing_id), listing_id)
+            index._entries[listing_id] = (key, entry)
+            index._books.setdefault(key, []).append(entry)
+
+        for book in index._books.values():
+            book.sort()
+        return index
+
+    def upsert(self, listing_id, key, price) -> bool:
+        """Добавление или обновление лота; True, если индекс изменился"""
+        current = self._entries.get(listing_id)
+        if current is not None:
+            current_key, current_entry = current
+            if current_key == key and current_entry[0] == price:
+                return False
+            self.remove(listing_id)
+
+        if not price:
+            return current is not None
+
+        # Строковый id в записи гарантирует сравнимость при равных ценах
+        entry = (price, str(listing_id), listing_id)
+        bisect.insort(self._books.setdefault(key, []), entry)
+        self._entries[listing_id] = (key, entry)
+        return True
+
+    def remove(self, listing_id):
+        """Удаление лота; возвращает ключ модели или None, если лота не было"""
+        current = self._entries.pop(listing_id, None)
+        if current is None:
+            return None
+
+        key, entry = current
+        book = self._books[key]
+        del book[bisect.bisect_left(book, entry)]
+        if not book:
+            del self._books[key]
+        return key
+
+    def key_of(self, listing_id):
+        """Ключ модели, под которым хранится лот"""
+        current = self._entries.get(listing_id)
+        return current[0] if current else None
+
+    def floor(self, key):
+        """Минимальная цена модели: (price, listing_id) или None"""
+        book = self._books.get(key)
+        if not book:
+            return None
+        price, _, listing_id = book[0]
+        return price, listing_id
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, listing_id):
+        return listing_id in self._entries
+
+
+class CrossMarketIndex:
+    """Общий индекс моделей по всем площадкам, где можно продать NFT
+
+    У каждой площадки свой FloorPriceIndex. Для ключа модели кэшируются две
+    лучшие точки выхода с разных площадок по чистой выручке (floor после
+    комиссии продажи). Для покупки на площадке A лучший выход - первая из
+    них, если она не на A, иначе вторая, поэтому поиск стоит O(1) при любом
+    числе площадок, а полный расчет растет линейно с числом лотов.
+    """
+
+    def __init__(self, fees: dict):
+        # market -> FeeModel только для площадок, где можно продать
+        self.fees = fees
+        self.floors = {market: FloorPriceIndex() for market in fees}
+        # key -> ((выручка, market, цена, listing_id), ...) не больше двух
+        self._exits = {}
+
+    @property
+    def markets(self):
+        return self.floors.keys()
+
+    def upsert(self, market, listing_id, key, price) -> set:
+        """Добавление или обновление лота; возвращает затронутые ключи моделей"""
+        index = self.floors[market]
+        old_key = index.key_of(listing_id)
+        if not index.upsert(listing_id, key, price):
+            return set()
+        touched = {old_key, key} - {None}
+        for touched_key in touched:
+            self._exits.pop(touched_key, None)
+        return touched
+
+    def load(self, market, listings):
+        """Замена индекса площадки целиком из (listing_id, key, price) одной сортировкой"""
+        self.floors[market] = FloorPriceIndex.from_listings(listings)
+        self._exits.clear()
+
+    def remove(self, market, listing_id) -> set:
+        """Удаление лота; возвращает затронутые ключи моделей"""
+        key = self.floors[market].remove(listing_id)
+        if key is None:
+            return set()
+        self._exits.pop(key, None)
+        return {key}
+
+    def floor(self, market, key):
+        """Floor модели на площадке: (price, listing_id) или None"""
+        return self.floors[market].floor(key)
+
+    def best_exit(self, key, buy_market=None):
+        """Лучшая площадка для продажи модели, кроме площадки покупки
+
+        Возвращает (выручка, market, цена, listing_id) или None.
+        """
+        exits = self._exits.get(key)
+        if exits is None:
+            exits = self._exits[key] = self._top_exits(key)
+        for candidate in exits:
+            if candidate[1] != buy_market:
+                return candidate
+        return None
+
+    def _top_exits(self, key):
+        candidates = []
+        for market, index in self.floors.items():
+            floor = index.floor(key)
+            if floor is not None:
+                price, listing_id = floor
+                candidates.append((self.fees[market].proceeds(price), market, price, listing_id))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        return tuple(candidates[:2])
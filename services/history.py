@@ -0,0 +1,526 @@
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from config import Config
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger('history')
+
+PORTALS, TONNEL = 0, 1
+
+# Колонки строк: одна строка - одно изменение цены лота или ставки аукциона
+ROW_COLUMNS = {
+    'market': np.uint8,
+    'model': np.uint32,    # id модели из словаря models.jsonl
+    'item': np.uint32,     # id лота из словаря items.jsonl
+    'price': np.float32,   # NaN - лот снят или аукцион завершен
+    'end': np.uint32,      # окончание аукциона (для лотов Portals - 0)
+}
+# Колонки сканирований: признак полного снимка, смещение времени от
+# предыдущего сканирования и конец его строк
+SCAN_COLUMNS = {
+    'scan_key': np.uint8,
+    'scan_dt': np.uint32,
+    'scan_end': np.uint32,
+}
+# Версия формата в format.json: 1 - разделы без scan_key (полный снимок -
+# только первое сканирование раздела), 2 - с признаком снимка у сканирований,
+# 3 - строки словарей с явным id ([id, значение]), чтобы их можно было сжимать
+FORMAT_VERSION = 3
+FORMAT_FILE = 'format.json'
+
+
+def _day_start(day: str) -> int:
+    return int(datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
+
+
+def _day_of(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _format_version(root: str) -> int:
+    """Версия формата истории; каталог без format.json с разделами - версия 1"""
+    try:
+        with open(os.path.join(root, FORMAT_FILE), encoding='utf-8') as f:
+            return int(json.load(f)['version'])
+    except FileNotFoundError:
+        pass
+    if os.path.isdir(root) and any(os.path.isdir(os.path.join(root, name)) for name in os.listdir(root)):
+        return 1
+    return FORMAT_VERSION
+
+
+def _legacy_scan_keys(scans: int):
+    """Признаки снимков раздела версии 1: снимок - только первое сканирование"""
+    keys = np.zeros(scans, dtype=SCAN_COLUMNS['scan_key'])
+    keys[:1] = 1
+    return keys
+
+
+class _Dictionary:
+    """Словарь значение -> id, дописываемый в файл строками [id, значение]
+
+    id не переиспользуются: после сжатия (compact) в разделах остаются
+    только id сохраненных значений. В формате версии 2 строка - само
+    значение, а id - ее номер (numbered=False, только для чтения и перевода).
+    """
+
+    def __init__(self, path: str, numbered: bool = True):
+        self.path = path
+        # id -> значение
+        self.values = {}
+        self.ids = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    value = json.loads(line)
+                    # Строку [id, [...]] старого формата не дает: значения
+                    # версии 2 - плоские списки. Так перевод, прерванный
+                    # после перезаписи словаря, повторяется без ошибок
+                    if numbered or isinstance(value[1], list):
+                        value_id, value = value
+                    else:
+                        value_id = len(self.values)
+                    value = tuple(value)
+                    self.ids[value] = value_id
+                    self.values[value_id] = value
+        self._next_id = max(self.values, default=-1) + 1
+        self._file = None
+
+    def id_of(self, value, create: bool = True):
+        value_id = self.ids.get(value)
+        if value_id is None and create:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            value_id = self.ids[value] = self._next_id
+            self._next_id += 1
+            self.values[value_id] = value
+            self._file.write(self._line(value_id, value))
+        return value_id
+
+    @staticmethod
+    def _line(value_id, value):
+        return json.dumps([value_id, list(value)], ensure_ascii=False) + '\n'
+
+    def compact(self, keep):
+        """Перезапись файла только со значениями, id которых в keep"""
+        self.values = {value_id: value for value_id, value in self.values.items() if value_id in keep}
+        self.ids = {value: value_id for value_id, value in self.values.items()}
+        self.rewrite()
+
+    def rewrite(self):
+        """Атомарная перезапись файла текущими значениями"""
+        self.close()
+        with open(f"{self.path}.tmp", 'w', encoding='utf-8') as f:
+            for value_id, value in sorted(self.values.items()):
+                f.write(self._line(value_id, value))
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class HistoryStore:
+    """Дописываемая история цен обоих рынков в колоночных файлах
+
+    Данные разбиты на суточные (UTC) разделы history/YYYY-MM-DD/, в каждом
+    колонка - отдельный файл с массивом фиксированного типа. Пишутся только
+    изменения относительно прошлого сканирования. Первое полное
+    сканирование раздела и первое после запуска записываются полным
+    снимком: раздел читается независимо с первого снимка. Неполное
+    сканирование снимком не бывает: после смены суток оно пишется
+    изменениями, а после запуска, пока нет базового снимка, не пишется
+    вовсе. Время хранится на уровне сканирований как разность
+    с предыдущим (для первого - с началом суток), модели и лоты - как id
+    словарей, общих для всех разделов. После удаления разделов по сроку
+    хранения из словарей удаляются значения, на которые разделы больше
+    не ссылаются.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or Config.HISTORY_DIR
+        os.makedirs(self.root, exist_ok=True)
+        self._migrate()
+        self.models = _Dictionary(os.path.join(self.root, 'models.jsonl'))
+        self.items = _Dictionary(os.path.join(self.root, 'items.jsonl'))
+        # item id -> (model id, цена, окончание) по последней записи
+        self._state = None
+        self._day = None
+        # Разделу нужен полный снимок (новые сутки)
+        self._keyframe_due = False
+        self._files = {}
+        self._last_ts = 0
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.rows_written = metrics.counter(
+            'history_rows_written_total', 'Price history rows appended'
+        )
+
+    def _migrate(self):
+        """Перевод разделов старых версий формата в текущую"""
+        version = _format_version(self.root)
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Price history in {self.root} has unsupported format {version}")
+        if version < 2:
+            # Разделы без scan_key иначе выглядели бы пустыми и обрезались при дозаписи
+            for name in sorted(os.listdir(self.root)):
+                path = os.path.join(self.root, name)
+                if os.path.isdir(path) and not os.path.exists(os.path.join(path, 'scan_key.bin')):
+                    scans = _Partition(path, name).scans
+                    tmp_path = os.path.join(path, 'scan_key.bin.tmp')
+                    with open(tmp_path, 'wb') as f:
+                        f.write(_legacy_scan_keys(scans).tobytes())
+                    os.replace(tmp_path, os.path.join(path, 'scan_key.bin'))
+        if version < 3:
+            # id значений - номера строк; теперь они записываются явно
+            for name in ('models.jsonl', 'items.jsonl'):
+                _Dictionary(os.path.join(self.root, name), numbered=False).rewrite()
+        if version < FORMAT_VERSION:
+            logger.info(f"Price history in {self.root} migrated to format {FORMAT_VERSION}")
+        format_path = os.path.join(self.root, FORMAT_FILE)
+        if version < FORMAT_VERSION or not os.path.exists(format_path):
+            with open(f"{format_path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump({'version': FORMAT_VERSION}, f)
+            os.replace(f"{format_path}.tmp", format_path)
+
+    def record_scan(self, ts: float, listings, auctions, complete: bool = True):
+        """Запись полного состояния рынков
+
+        listings и auctions - итерируемые (gift_id, (name, model), цена,
+        окончание). При неполном сканировании отсутствующие лоты не
+        считаются снятыми.
+        """
+        with self._lock:
+            current = {}
+            for market, rows in ((PORTALS, listings), (TONNEL, auctions)):
+                for gift_id, key, price, end in rows:
+                    item_id = self.items.id_of((market, gift_id))
+                    current[item_id] = (market, self.models.id_of(tuple(key)), price, end or 0)
+            self._append(ts, current, complete)
+
+    def record_updates(self, ts: float, auctions, removed=()):
+        """Запись точечных обновлений аукционов (проверки перед окончанием)"""
+        with self._lock:
+            if self._state is None:
+                # Без базового снимка частичные данные не записываются
+                return
+            current = {}
+            for gift_id, key, price, end in auctions:
+                item_id = self.items.id_of((TONNEL, gift_id))
+                current[item_id] = (TONNEL, self.models.id_of(tuple(key)), price, end or 0)
+            for gift_id in removed:
+                item_id = self.items.id_of((TONNEL, gift_id), create=False)
+                if item_id is not None and item_id in self._state:
+                    market, model_id, _, end = self._state[item_id]
+                    current[item_id] = (market, model_id, float('nan'), end)
+            self._append(ts, current, complete=False)
+
+    def _append(self, ts, current, complete):
+        day = _day_of(ts)
+        if day != self._day:
+            self._open_partition(day)
+            self._prune(day, current)
+            self._keyframe_due = True
+        if self._state is None and not complete:
+            # Без базового снимка частичные данные не записываются
+            return
+        # Снимок заменяет состояние при чтении, поэтому только из полного сканирования
+        keyframe = complete and (self._state is None or self._keyframe_due)
+        if keyframe:
+            self._keyframe_due = False
+
+        state = {} if self._state is None else self._state
+        if complete:
+            new_state = current
+        else:
+            new_state = {**state, **current}
+
+        if keyframe:
+            changes = new_state
+        else:
+            changes = {
+                item_id: row for item_id, row in new_state.items()
+                if state.get(item_id) != row
+            }
+            if complete:
+                for item_id in state.keys() - new_state.keys():
+                    market, model_id, _, end = state[item_id]
+                    changes[item_id] = (market, model_id, float('nan'), end)
+        # Снятые лоты в состоянии не хранятся
+        self._state = {
+            item_id: row for item_id, row in new_state.items() if row[2] == row[2]
+        }
+
+        count = len(changes)
+        columns = {
+            'item': np.fromiter(changes.keys(), dtype=np.uint32, count=count),
+            'market': np.fromiter((row[0] for row in changes.values()), dtype=np.uint8, count=count),
+            'model': np.fromiter((row[1] for row in changes.values()), dtype=np.uint32, count=count),
+            'price': np.fromiter((row[2] for row in changes.values()), dtype=np.float32, count=count),
+            'end': np.fromiter((row[3] for row in changes.values()), dtype=np.uint32, count=count),
+        }
+        # Сначала строки, потом запись сканирования: оборванная запись
+        # оставляет лишь хвост строк, который отбрасывается при открытии
+        for name in ROW_COLUMNS:
+            self._files[name].write(columns[name].tobytes())
+        self._rows += count
+        self.rows_written.inc(count)
+        ts = int(ts)
+        base = self._last_ts if self._last_ts else _day_start(day)
+        self._files['scan_key'].write(np.array([keyframe], dtype=np.uint8).tobytes())
+        self._files['scan_dt'].write(np.array([max(ts - base, 0)], dtype=np.uint32).tobytes())
+        self._files['scan_end'].write(np.array([self._rows], dtype=np.uint32).tobytes())
+        self._last_ts = max(ts, base)
+        for f in self._files.values():
+            f.flush()
+        self.models.flush()
+        self.items.flush()
+
+    def _open_partition(self, day: str):
+        """Открытие раздела на дозапись с отбрасыванием недописанного хвоста"""
+        self._close_files()
+        path = os.path.join(self.root, day)
+        os.makedirs(path, exist_ok=True)
+        reader = _Partition(path, day)
+        self._rows = reader.rows
+        self._last_ts = int(reader.scan_times()[-1]) if reader.scans else 0
+        for name, dtype in {**ROW_COLUMNS, **SCAN_COLUMNS}.items():
+            file_path = os.path.join(path, f'{name}.bin')
+            length = reader.scans if name in SCAN_COLUMNS else reader.rows
+            with open(file_path, 'ab') as f:
+                f.truncate(length * np.dtype(dtype).itemsize)
+            self._files[name] = open(file_path, 'ab')
+        self._day = day
+
+    def _prune(self, today: str, pending):
+        """Удаление разделов старше HISTORY_RETENTION_DAYS и сжатие словарей
+
+        pending - строки сканирования, которое еще не записано: их id
+        должны остаться в словарях.
+        """
+        if not Config.HISTORY_RETENTION_DAYS:
+            return
+        first = (
+            datetime.strptime(today, '%Y-%m-%d') - timedelta(days=Config.HISTORY_RETENTION_DAYS - 1)
+        ).strftime('%Y-%m-%d')
+        removed = False
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path) and name < first:
+                shutil.rmtree(path, ignore_errors=True)
+                logger.info(f"Price history partition {name} removed")
+                removed = True
+        if removed:
+            self._compact_dictionaries(pending)
+
+    def _compact_dictionaries(self, pending):
+        """Удаление из словарей id, на которые не ссылается ни один раздел
+
+        Иначе словари росли бы все время работы: разделы удаляются по
+        сроку хранения, а значения словарей - нет.
+        """
+        models, items = set(), set()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                partition = _Partition(path, name)
+                models.update(np.unique(partition.column('model')).tolist())
+                items.update(np.unique(partition.column('item')).tolist())
+        for rows in (self._state or {}, pending):
+            items.update(rows)
+            models.update(row[1] for row in rows.values())
+        dropped = len(self.items.values) - len(items & self.items.values.keys())
+        self.models.compact(models)
+        self.items.compact(items)
+        if dropped:
+            logger.info(f"Price history dictionaries compacted: {dropped} items dropped")
+
+    def _close_files(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+            self.models.close()
+            self.items.close()
+
+
+class _Partition:
+    """Суточный раздел, открытый через memory map (только чтение)"""
+
+    def __init__(self, path: str, day: str):
+        self.path = path
+        self.day = day
+        scan_end = self._map('scan_end', SCAN_COLUMNS['scan_end'])
+        scan_dt = self._map('scan_dt', SCAN_COLUMNS['scan_dt'])
+        if os.path.exists(os.path.join(path, 'scan_key.bin')):
+            scan_key = self._map('scan_key', SCAN_COLUMNS['scan_key'])
+        else:
+            # Раздел версии 1, еще не переведенный записью
+            scan_key = _legacy_scan_keys(min(len(scan_end), len(scan_dt)))
+        self.scans = min(len(scan_end), len(scan_dt), len(scan_key))
+        self.rows = int(scan_end[self.scans - 1]) if self.scans else 0
+        # Строки, не подтвержденные записью сканирования, не видны
+        lengths = [len(self._map(name, dtype)) for name, dtype in ROW_COLUMNS.items()]
+        if lengths and min(lengths) < self.rows:
+            self.rows = min(lengths)
+            self.scans = int(np.searchsorted(scan_end[:self.scans], self.rows, side='right'))
+            self.rows = int(scan_end[self.scans - 1]) if self.scans else 0
+        self.scan_end = scan_end[:self.scans]
+        self.scan_dt = scan_dt[:self.scans]
+        self.scan_key = scan_key[:self.scans]
+
+    def _map(self, name, dtype):
+        file_path = os.path.join(self.path, f'{name}.bin')
+        if not os.path.exists(file_path) or os.path.getsize(file_path) < np.dtype(dtype).itemsize:
+            return np.empty(0, dtype=dtype)
+        count = os.path.getsize(file_path) // np.dtype(dtype).itemsize
+        return np.memmap(file_path, dtype=dtype, mode='r', shape=(count,))
+
+    def column(self, name):
+        return self._map(name, ROW_COLUMNS[name])[:self.rows]
+
+    def scan_times(self):
+        """Абсолютное время каждого сканирования (восстановление из разностей)"""
+        return _day_start(self.day) + np.cumsum(self.scan_dt, dtype=np.int64)
+
+    def row_scans(self, rows):
+        """Номера сканирований для номеров строк"""
+        return np.searchsorted(self.scan_end, rows, side='right')
+
+    def row_times(self, rows):
+        """Время сканирования для номеров строк"""
+        return self.scan_times()[self.row_scans(rows)]
+
+
+class HistoryReader:
+    """Запросы к истории без загрузки всех данных в память
+
+    Колонки открываются через memory map; для выборки по модели читается
+    только колонка id моделей, остальные - лишь в найденных строках.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or Config.HISTORY_DIR
+        version = _format_version(self.root)
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Price history in {self.root} has unsupported format {version}")
+        numbered = version >= 3
+        self.models = _Dictionary(os.path.join(self.root, 'models.jsonl'), numbered)
+        self.items = _Dictionary(os.path.join(self.root, 'items.jsonl'), numbered)
+
+    def partitions(self, days: int = None, until: float = None):
+        """Разделы за последние days суток (все, если days не указан)"""
+        if not os.path.isdir(self.root):
+            return []
+        names = sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, name))
+        )
+        if days is not None:
+            last = datetime.fromtimestamp(until or time.time(), timezone.utc)
+            first = (last - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+            names = [name for name in names if first <= name <= last.strftime('%Y-%m-%d')]
+        return [_Partition(os.path.join(self.root, name), name) for name in names]
+
+    def _model_rows(self, partition, model_id, market):
+        rows = np.flatnonzero(partition.column('model') == model_id)
+        if market is not None and len(rows):
+            rows = rows[partition.column('market')[rows] == market]
+        return rows
+
+    def model_series(self, name: str, model: str, days: int = 7, market: int = None):
+        """Все записанные цены модели за days суток
+
+        Возвращает словарь массивов ts, market, item, price, end в порядке
+        записи. price=NaN означает снятие лота/окончание аукциона.
+        """
+        result = {key: [] for key in ('ts', 'market', 'item', 'price', 'end')}
+        model_id = self.models.id_of((name, model), create=False)
+        if model_id is not None:
+            for partition in self.partitions(days):
+                rows = self._model_rows(partition, model_id, market)
+                if not len(rows):
+                    continue
+                result['ts'].append(partition.row_times(rows))
+                for key in ('market', 'item', 'price', 'end'):
+                    result[key].append(np.asarray(partition.column(key)[rows]))
+        dtypes = {'ts': np.int64, **ROW_COLUMNS}
+        return {
+            key: np.concatenate(parts) if parts else np.empty(0, dtype=dtypes[key])
+            for key, parts in result.items()
+        }
+
+    def floor_series(self, name: str, model: str, days: int = 7, market: int = PORTALS):
+        """Минимальная цена модели после каждого ее изменения: (ts, floor)
+
+        floor=NaN, если живых лотов модели не осталось.
+        """
+        times, floors = [], []
+        model_id = self.models.id_of((name, model), create=False)
+        if model_id is None:
+            return np.array(times, dtype=np.int64), np.array(floors, dtype=np.float64)
+        live = {}
+        for partition in self.partitions(days):
+            rows = self._model_rows(partition, model_id, market)
+            scans = partition.row_scans(rows)
+            # Полный снимок заменяет состояние, даже если строк модели в нем нет
+            keyframes = np.flatnonzero(partition.scan_key)
+            changed = np.union1d(np.unique(scans), keyframes)
+            scan_times = partition.scan_times()
+            items = partition.column('item')[rows].tolist()
+            prices = partition.column('price')[rows].tolist()
+            bounds = np.searchsorted(scans, changed, side='left').tolist()
+            ends = np.searchsorted(scans, changed, side='right').tolist()
+            is_key = partition.scan_key[changed].tolist()
+            for scan_idx, start, end, key in zip(changed.tolist(), bounds, ends, is_key):
+                if key:
+                    live.clear()
+                for item, price in zip(items[start:end], prices[start:end]):
+                    if price != price:
+                        live.pop(item, None)
+                    else:
+                        live[item] = price
+                floor = min(live.values()) if live else float('nan')
+                previous = floors[-1] if floors else None
+                # Записываются только изменения floor (NaN считается равным NaN)
+                if previous is None or not (floor == previous or floor != floor and previous != previous):
+                    times.append(int(scan_times[scan_idx]))
+                    floors.append(floor)
+        return np.array(times, dtype=np.int64), np.array(floors, dtype=np.float64)
+
+    def iter_scans(self, days: int = None, until: float = None):
+        """Поток сканирований: (ts, полный ли снимок, {колонка: массив строк})
+
+        Строки обычного сканирования - изменения относительно предыдущего;
+        полный снимок (начало раздела, перезапуск записи) заменяет состояние
+        целиком.
+        """
+        for partition in self.partitions(days, until):
+            if not partition.scans:
+                continue
+            columns = {name: partition.column(name) for name in ROW_COLUMNS}
+            times = partition.scan_times()
+            keyframes = partition.scan_key.tolist()
+            start = 0
+            for scan_idx in range(partition.scans):
+                end = int(partition.scan_end[scan_idx])
+                yield int(times[scan_idx]), bool(keyframes[scan_idx]), {
+                    name: np.asarray(column[start:end]) for name, column in columns.items()
+                }
+                start = end
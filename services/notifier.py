@@ -0,0 +1,302 @@
+import asyncio
+import html
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from api.marketplace import market_title
+from config import Config
+from database import get_database
+from services.subscriptions import Subscription, SubscriptionIndex
+from utils.logger import setup_logger
+from utils.metrics import metrics
+from utils.rate_limit import TokenBucket
+
+logger = setup_logger('notifier')
+
+# Секунды между очистками состояния неактивных чатов
+IDLE_SWEEP_INTERVAL = 60
+
+
+class AlertNotifier:
+    """Рассылка уведомлений о новых возможностях подписчикам
+
+    Планировщик только кладет список новых возможностей во входящую
+    очередь (без блокировки). Задача в event loop бота раскладывает их по чатам,
+    убирает дубликаты, склеивает несколько возможностей в одно сообщение
+    и отправляет с соблюдением лимитов Telegram: ведро токенов на каждый
+    чат и общее ведро на бота.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.db = get_database()
+        # Очередь создается в start(), внутри event loop
+        self._inbound = None
+        # chat_id -> OrderedDict(nft_id -> (opportunity, время постановки))
+        self._pending = {}
+        self._ready = deque()
+        self._chat_buckets = {}
+        self._blocked_until = {}
+        # chat_id -> {nft_id: время отправки} для подавления повторов
+        self._sent = {}
+        self._last_sweep = time.monotonic()
+        self._global_bucket = TokenBucket(
+            rate=Config.ALERT_GLOBAL_RATE,
+            capacity=Config.ALERT_GLOBAL_RATE
+        )
+        self._subscriptions_lock = threading.Lock()
+        self._load_subscriptions()
+        self.running = False
+        self._task = None
+
+        self.queue_depth = metrics.gauge('alert_queue_depth', 'Alerts waiting to be sent')
+        self.send_latency = metrics.histogram(
+            'alert_send_latency_seconds', 'Time from enqueue to Telegram delivery'
+        )
+        self.sent_total = metrics.counter('alerts_sent_total', 'Alert messages sent')
+        self.dropped_total = metrics.counter('alerts_dropped_total', 'Alerts dropped on overflow')
+        self.errors_total = metrics.counter('alert_send_errors_total', 'Failed alert sends')
+
+    def _load_subscriptions(self):
+        """Загрузка настроек пользователей и построение индекса подписчиков"""
+        subscriptions = [Subscription.from_row(row) for row in self.db.get_subscriptions()]
+        with self._subscriptions_lock:
+            self._subscriptions = {sub.chat_id: sub for sub in subscriptions}
+            self._index = SubscriptionIndex(subscriptions)
+
+    def get_settings(self, chat_id: int) -> Subscription:
+        """Настройки пользователя (по умолчанию - без фильтров и уведомлений)"""
+        with self._subscriptions_lock:
+            subscription = self._subscriptions.get(chat_id)
+        return subscription.copy() if subscription else Subscription(chat_id)
+
+    def update_settings(self, subscription: Subscription):
+        """Сохранение настроек и подмена индекса подписчиков"""
+        self.db.save_subscription(*subscription.to_row())
+        with self._subscriptions_lock:
+            self._subscriptions[subscription.chat_id] = subscription
+            # Новый индекс строится целиком и подменяется атомарно
+            self._index = SubscriptionIndex(self._subscriptions.values())
+
+    def subscribe(self, chat_id: int, min_profit: float = None):
+        """Включение уведомлений (и, при указании, смена порога прибыли)"""
+        subscription = self.get_settings(chat_id)
+        if min_profit is not None:
+            subscription.min_profit = min_profit
+        subscription.notify = True
+        self.update_settings(subscription)
+
+    def unsubscribe(self, chat_id: int):
+        """Отключение уведомлений с сохранением фильтров"""
+        subscription = self.get_settings(chat_id)
+        subscription.notify = False
+        self.update_settings(subscription)
+
+    def publish(self, opportunities):
+        """Передача новых возможностей на рассылку; никогда не блокирует"""
+        if not opportunities or self._inbound is None:
+            return
+        try:
+            self._inbound.put_nowait((list(opportunities), time.monotonic()))
+        except asyncio.QueueFull:
+            self.dropped_total.inc(len(opportunities))
+            logger.warning(f"Alert queue is full, dropped {len(opportunities)} opportunities")
+
+    def start(self):
+        """Запуск задачи отправки в текущем event loop"""
+        self.running = True
+        self._inbound = asyncio.Queue(maxsize=Config.ALERT_QUEUE_SIZE)
+        self._task = asyncio.create_task(self._run())
+        logger.info("Alert notifier started")
+
+    async def stop(self):
+        """Остановка задачи отправки"""
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        logger.info("Alert notifier stopped")
+
+    async def _run(self):
+        while self.running:
+            try:
+                await self._drain_inbound(block=not self._ready)
+                wait = await self._send_ready()
+                if wait:
+                    await self._drain_inbound(block=True, timeout=wait)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Alert sender error: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def _drain_inbound(self, block: bool, timeout: float = 0.5):
+        """Раскладка входящих возможностей по очередям чатов"""
+        try:
+            if block:
+                item = await asyncio.wait_for(self._inbound.get(), timeout=timeout)
+            else:
+                item = self._inbound.get_nowait()
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return
+        while item is not None:
+            opportunities, enqueued_at = item
+            self._route(opportunities, enqueued_at)
+            try:
+                item = self._inbound.get_nowait()
+            except asyncio.QueueEmpty:
+                item = None
+        self._update_depth()
+
+    def _route(self, opportunities, enqueued_at):
+        """Рассылка по подписчикам через индекс фильтров"""
+        with self._subscriptions_lock:
+            index = self._index
+
+        now = time.monotonic()
+        wall_now = time.time()
+        for opp in opportunities:
+            nft_id = opp.nft_id
+            for chat_id in index.match(opp, wall_now):
+                sent_at = self._sent.get(chat_id, {}).get(nft_id)
+                if sent_at is not None and now - sent_at < Config.ALERT_DEDUP_TTL:
+                    continue
+                pending = self._pending.get(chat_id)
+                if pending is None:
+                    pending = self._pending[chat_id] = OrderedDict()
+                    self._ready.append(chat_id)
+                # Повтор той же возможности заменяет прежнюю версию
+                previous = pending.pop(nft_id, None)
+                pending[nft_id] = (opp, previous[1] if previous else enqueued_at)
+                if len(pending) > Config.ALERT_MAX_PENDING_PER_CHAT:
+                    pending.popitem(last=False)
+                    self.dropped_total.inc()
+
+    async def _send_ready(self) -> float:
+        """Один проход по чатам с ожидающими сообщениями
+
+        Возвращает время, через которое стоит повторить попытку, или 0.
+        """
+        min_wait = None
+        for _ in range(len(self._ready)):
+            chat_id = self._ready.popleft()
+            now = time.monotonic()
+            wait = self._blocked_until.get(chat_id, 0) - now
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(
+                    rate=Config.ALERT_CHAT_RATE, capacity=1
+                )
+            if wait <= 0:
+                wait = bucket.wait_time(1)
+            if wait > 0:
+                self._ready.append(chat_id)
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+                continue
+
+            global_wait = self._global_bucket.wait_time(1)
+            if global_wait > 0:
+                # Общий лимит бота исчерпан: чат остается первым в очереди
+                self._ready.appendleft(chat_id)
+                return global_wait
+
+            bucket.try_acquire(1)
+            self._global_bucket.try_acquire(1)
+            await self._send_batch(chat_id)
+            if self._pending.get(chat_id):
+                self._ready.append(chat_id)
+            else:
+                self._pending.pop(chat_id, None)
+        self._update_depth()
+        self._sweep_idle_chats()
+        return min_wait or 0
+
+    def _sweep_idle_chats(self):
+        """Удаление состояния чатов, которым нечего отправлять
+
+        Ведро чата без ожидающих сообщений удаляется, когда пополнилось
+        до полного запаса: новое ведро ничем от него не отличается, так что
+        лимит не сбрасывается раньше времени. Вместе с ним уходят истекшие
+        flood wait и отметки отправок старше окна подавления повторов.
+        """
+        now = time.monotonic()
+        if now - self._last_sweep < IDLE_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if chat_id not in self._pending and bucket.tokens >= bucket.capacity:
+                del self._chat_buckets[chat_id]
+        for chat_id, until in list(self._blocked_until.items()):
+            if until <= now:
+                del self._blocked_until[chat_id]
+        for chat_id, sent in list(self._sent.items()):
+            recent = {key: ts for key, ts in sent.items() if now - ts < Config.ALERT_DEDUP_TTL}
+            if recent:
+                self._sent[chat_id] = recent
+            else:
+                del self._sent[chat_id]
+
+    async def _send_batch(self, chat_id):
+        """Отправка одного сообщения с несколькими возможностями"""
+        pending = self._pending[chat_id]
+        batch = []
+        while pending and len(batch) < Config.ALERT_BATCH_SIZE:
+            batch.append(pending.popitem(last=False))
+
+        try:
+            await self.bot.send_message(
+                chat_id=chat_id,
+                text=self._render(batch),
+                parse_mode='HTML'
+            )
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is None:
+                self.errors_total.inc()
+                logger.error(f"Failed to send alert to {chat_id}: {str(e)}")
+                return
+            # Flood wait: возвращаем пачку в начало очереди и ждем указанное время
+            logger.warning(f"Flood wait {retry_after}s for chat {chat_id}")
+            self._blocked_until[chat_id] = time.monotonic() + float(retry_after)
+            for nft_id, item in reversed(batch):
+                pending[nft_id] = item
+                pending.move_to_end(nft_id, last=False)
+            return
+
+        now = time.monotonic()
+        sent = self._sent.setdefault(chat_id, {})
+        for nft_id, (_, enqueued_at) in batch:
+            sent[nft_id] = now
+            self.send_latency.observe(now - enqueued_at)
+        self.sent_total.inc()
+        if len(sent) > Config.ALERT_MAX_PENDING_PER_CHAT * 10:
+            # Забываем отправки старше окна подавления повторов
+            self._sent[chat_id] = {
+                key: ts for key, ts in sent.items() if now - ts < Config.ALERT_DEDUP_TTL
+            }
+
+    @staticmethod
+    def _render(batch) -> str:
+        """HTML-текст уведомления"""
+        message = "<b>🔔 Новые арбитражные возможности:</b>\n\n"
+        for _, (opp, _) in batch:
+            end_time_str = (
+                datetime.fromtimestamp(opp.end_time).strftime('%d.%m %H:%M') if opp.end_time else "—"
+            )
+            message += (
+                f"<b>{html.escape(opp.name)} ({html.escape(opp.model)})</b>, "
+                f"{market_title(opp.buy_market)} → {market_title(opp.sell_market)}\n"
+                f"💰 {opp.buy_price:.2f} → 🏷 {opp.sell_price:.2f} TON, "
+                f"💵 <b>{opp.profit:.2f} TON</b>, ⏱ {end_time_str}\n\n"
+            )
+        return message
+
+    def _update_depth(self):
+        self.queue_depth.set(
+            sum(len(pending) for pending in self._pending.values())
+            + (self._inbound.qsize() if self._inbound else 0)
+        )
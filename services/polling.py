@@ -0,0 +1,143 @@
+import heapq
+import time
+from config import Config
+from utils.rate_limit import TokenBucket
+
+
+class AdaptivePollPlanner:
+    """Планирование опросов с учетом окончания аукционов и волатильности
+
+    Полное сканирование выполняется с адаптивным интервалом: на спокойном
+    рынке он растет до POLL_MAX_INTERVAL, при изменениях возвращается к
+    POLL_MIN_INTERVAL. Аукционы, которые закончатся раньше следующего
+    полного сканирования, попадают в очередь с приоритетом по времени
+    следующей проверки: чем ближе конец и чем сильнее менялась ставка,
+    тем чаще проверка.
+
+    Все запросы списываются с общего бюджета. Его скорость равна средней
+    стоимости полного сканирования, деленной на API_UPDATE_INTERVAL, то есть
+    нагрузке до адаптивного режима, поэтому суммарный поток запросов не
+    превышает прежний.
+    """
+
+    def __init__(self):
+        self.full_scan_interval = Config.API_UPDATE_INTERVAL
+        self.scan_cost = 2.0  # Запросов на полное сканирование (оценка)
+        self.budget = TokenBucket(
+            rate=self.scan_cost / Config.API_UPDATE_INTERVAL,
+            capacity=self.scan_cost * 2
+        )
+        self.next_full_scan_at = 0.0
+        self._heap = []
+        # gift_id -> время следующей проверки (для отсева устаревших записей кучи)
+        self._scheduled = {}
+        # gift_id -> (последняя ставка, волатильность) для всех аукционов
+        self._bids = {}
+
+    def full_scan_due(self, now: float = None) -> bool:
+        """Пора ли делать полное сканирование (и позволяет ли бюджет)"""
+        now = time.monotonic() if now is None else now
+        return now >= self.next_full_scan_at and self.budget.tokens >= 0
+
+    def record_full_scan(self, requests_used: int, changes: int, auctions):
+        """Учет результата полного сканирования и перестроение очереди"""
+        self.budget.consume(requests_used)
+        if requests_used:
+            # Бюджет следует за реальной стоимостью сканирования
+            self.scan_cost = 0.8 * self.scan_cost + 0.2 * requests_used
+            self.budget.set_rate(
+                self.scan_cost / Config.API_UPDATE_INTERVAL,
+                capacity=self.scan_cost * 2
+            )
+
+        if changes:
+            self.full_scan_interval = max(
+                Config.POLL_MIN_INTERVAL,
+                self.full_scan_interval / Config.POLL_BACKOFF_FACTOR
+            )
+        else:
+            self.full_scan_interval = min(
+                Config.POLL_MAX_INTERVAL,
+                self.full_scan_interval * Config.POLL_BACKOFF_FACTOR
+            )
+        self.next_full_scan_at = time.monotonic() + self.full_scan_interval
+        self._rebuild(auctions)
+
+    def _rebuild(self, auctions):
+        """Очередь проверок только для аукционов, заканчивающихся до следующего сканирования"""
+        now = time.monotonic()
+        wall_now = time.time()
+        horizon = wall_now + self.full_scan_interval + Config.POLL_MIN_RECHECK
+        bids = {}
+        self._scheduled = {}
+        self._heap = []
+
+        for auction in auctions:
+            gift_id = auction.id
+            end_time = auction.end_time
+            volatility = self._observe_bid(gift_id, auction.price)
+            bids[gift_id] = (auction.price, volatility)
+            if end_time > horizon or end_time <= wall_now:
+                continue
+            next_check = now + self.recheck_interval(end_time - wall_now, volatility)
+            self._scheduled[gift_id] = next_check
+            self._heap.append((next_check, gift_id))
+
+        self._bids = bids
+        heapq.heapify(self._heap)
+
+    def _observe_bid(self, gift_id, bid) -> float:
+        """Экспоненциальное среднее относительного изменения ставки"""
+        previous = self._bids.get(gift_id)
+        if previous is None:
+            return 0.0
+        last_bid, volatility = previous
+        change = abs(bid - last_bid) / last_bid if last_bid else 0.0
+        return 0.7 * volatility + 0.3 * change
+
+    @staticmethod
+    def recheck_interval(time_to_end: float, volatility: float) -> float:
+        """Интервал проверки: доля оставшегося времени, сжатая волатильностью"""
+        interval = time_to_end / 4 / (1 + Config.POLL_VOLATILITY_WEIGHT * volatility)
+        return min(max(interval, Config.POLL_MIN_RECHECK), Config.API_UPDATE_INTERVAL)
+
+    def pop_due(self, now: float = None):
+        """Аукционы, которым пора на проверку, в пределах доступного бюджета"""
+        now = time.monotonic() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            next_check, gift_id = self._heap[0]
+            if self._scheduled.get(gift_id) != next_check:
+                # Устаревшая запись (аукцион перепланирован или убран)
+                heapq.heappop(self._heap)
+                continue
+            if not self.budget.try_acquire(1):
+                break
+            heapq.heappop(self._heap)
+            due.append(gift_id)
+        return due
+
+    def record_recheck(self, gift_id, auction):
+        """Перепланирование аукциона после точечной проверки"""
+        time_to_end = auction.end_time - time.time() if auction else 0
+        if time_to_end <= 0:
+            # Аукцион завершен - больше не проверяем
+            self._scheduled.pop(gift_id, None)
+            self._bids.pop(gift_id, None)
+            return
+
+        volatility = self._observe_bid(gift_id, auction.price)
+        self._bids[gift_id] = (auction.price, volatility)
+        next_check = time.monotonic() + self.recheck_interval(time_to_end, volatility)
+        self._scheduled[gift_id] = next_check
+        heapq.heappush(self._heap, (next_check, gift_id))
+
+    def next_wakeup(self) -> float:
+        """Ближайший момент (monotonic), когда планировщику есть что делать"""
+        now = time.monotonic()
+        # Полное сканирование ждет, пока бюджет не выйдет из долга
+        wakeup = max(self.next_full_scan_at, now + self.budget.wait_time(0))
+        if self._heap:
+            # Проверке нужен хотя бы один свободный токен
+            wakeup = min(wakeup, max(self._heap[0][0], now + self.budget.wait_time(1)))
+        return wakeup
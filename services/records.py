@@ -0,0 +1,47 @@
+from typing import NamedTuple, Optional
+
+
+class Listing(NamedTuple):
+    """Лот или аукцион площадки в компактном виде
+
+    id - идентификатор NFT (общий для площадок), ref - идентификатор
+    предложения на площадке, если он отличается от id (например, id
+    аукциона Tonnel). end_time = 0 - лот без срока. Записи неизменяемы:
+    сравнение двух версий лота - обычное ==, а страницы из кэша ETag
+    можно отдавать в снимки без копирования.
+    """
+
+    id: object
+    name: Optional[str]
+    model: Optional[str]
+    price: float
+    end_time: int = 0
+    ref: object = None
+
+    @property
+    def key(self):
+        """Ключ модели (name, model) или None, если площадка его не отдает"""
+        if self.name is None or self.model is None:
+            return None
+        return self.name, self.model
+
+
+class Opportunity(NamedTuple):
+    """Арбитражная возможность
+
+    Порядок полей совпадает с колонками arbitrage_opportunities:
+    buy_price - current_bid, sell_price - portals_price, buy_cost (цена
+    покупки с комиссией) - tonnel_price.
+    """
+
+    nft_id: object
+    name: str
+    model: str
+    end_time: int
+    buy_price: float
+    sell_price: float
+    buy_cost: float
+    profit: float
+    price_range: str
+    buy_market: str
+    sell_market: str
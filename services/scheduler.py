@@ -1,56 +1,396 @@
-import threading
+import asyncio
 import time
 import logging
+from datetime import datetime
 from config import Config
 from services.arbitrage import ArbitrageCalculator
-from api.portals_api import PortalsAPI
-from api.tonnel_api import TonnelAPI
-from database import DatabaseManager
+from services.cache import VersionedCache
+from services.history import HistoryStore
+from services.notifier import AlertNotifier
+from services.polling import AdaptivePollPlanner
+from services.sharding import ShardedScanner
+from services.streaming import EventIngestor
+from services.warm_start import WarmStartStore
+from api.portals_api import AsyncPortalsAPI
+from api.tonnel_api import AsyncTonnelAPI
+from database import get_database
 from utils.logger import setup_logger
+from utils.metrics import metrics
 
 logger = setup_logger('scheduler')
 
 class DataScheduler:
-    """Планировщик автоматического обновления данных"""
+    """Планировщик автоматического обновления данных
+
+    Работает в event loop бота: каждый шаг - задача JobQueue, которая
+    после выполнения ставит следующую с вычисленной задержкой.
+    """
     
     def __init__(self, bot_instance):
         self.bot = bot_instance
-        self.portals_api = PortalsAPI()
-        self.tonnel_api = TonnelAPI()
-        self.arbitrage_calc = ArbitrageCalculator(self.portals_api, self.tonnel_api)
-        self.db = DatabaseManager()
+        self.async_portals_api = AsyncPortalsAPI()
+        self.async_tonnel_api = AsyncTonnelAPI()
+        self.arbitrage_calc = ArbitrageCalculator(self.async_portals_api, self.async_tonnel_api)
+        self.db = get_database()
+        # Кэш чтения для бота; поколение растет после каждого сохранения
+        self.cache = VersionedCache()
         self.running = False
-        self.thread = None
+        self._job = None
+        # Объединение одновременных сканирований
+        self._scan_task = None
+        self._last_scan_at = None
+        self._last_scan_count = 0
+        # Полное сканирование в нескольких процессах; процессы стартуют при первом цикле
+        self.sharded = ShardedScanner() if Config.SCAN_SHARDS > 1 else None
+        # Потоковый прием событий площадок; полное сканирование становится сверкой
+        self.stream = None
+        if Config.STREAM_MARKETS and Config.INCREMENTAL_SCAN and not self.sharded:
+            self.stream = EventIngestor(
+                self.arbitrage_calc.markets, self._apply_stream_events, self._reconcile
+            )
+        # Запись изменений в БД в порядке их расчета (сканирование, проверки, события)
+        self._write_lock = asyncio.Lock()
+        # Адаптивный опрос: очередь проверок и общий бюджет запросов
+        self.adaptive = (Config.ADAPTIVE_POLLING and Config.INCREMENTAL_SCAN
+                         and not self.sharded and not self.stream)
+        self.planner = AdaptivePollPlanner()
+        self._last_market_changes = 0
+        self._requests_accounted = 0
+        # Push-уведомления подписчикам о новых возможностях
+        self.notifier = AlertNotifier(bot_instance)
+        self._published_ids = set()
+        # История цен для анализа и бэктестов
+        self.history = HistoryStore() if Config.HISTORY_ENABLED and not self.sharded else None
+        # Быстрый старт: состояние рынков прошлого запуска и время данных в БД
+        self.warm_start = WarmStartStore() if Config.WARM_START and not self.sharded else None
+        self.stale_since = None
+        self._restore_task = None
+        self._warm_saved_at = time.monotonic()
+        self.scan_time = metrics.histogram(
+            'scan_duration_seconds', 'Market scan duration including the database write',
+            ('mode',), buckets=(0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+        )
+        self.opportunities_gauge = metrics.gauge(
+            'arbitrage_opportunities', 'Arbitrage opportunities after the last scan'
+        )
     
-    def start(self):
-        """Запуск периодического обновления данных"""
+    def start(self, job_queue):
+        """Запуск периодического обновления данных в JobQueue бота"""
         self.running = True
-        self.thread = threading.Thread(target=self._run_scheduler)
-        self.thread.daemon = True
-        self.thread.start()
+        self.notifier.start()
+        if self.warm_start:
+            # Возможности прошлого запуска уже в БД: бот отдает их сразу с
+            # пометкой об их времени, а снимок рынков загружается в фоне
+            self.stale_since = self.warm_start.saved_at()
+            self._restore_task = asyncio.ensure_future(self._restore_warm_state())
+        if self.stream:
+            # Поток подключается до первого сканирования, чтобы не пропустить события
+            self.stream.start()
+        self._job = job_queue.run_once(self._run_step, when=0, name='data_scheduler')
         logger.info("Data scheduler started")
     
-    def stop(self):
+    async def stop(self):
         """Остановка обновления данных"""
         self.running = False
-        if self.thread:
-            self.thread.join(timeout=30)
+        if self._job:
+            self._job.schedule_removal()
+        if self.stream:
+            await self.stream.stop()
+        if self._scan_task and not self._scan_task.done():
+            self._scan_task.cancel()
+        # Прерванный цикл состояние не меняет: словари заменяются только после загрузки
+        await self._save_warm_state(force=True)
+        await self.notifier.stop()
+        await self.async_portals_api.close()
+        await self.async_tonnel_api.close()
+        if self.sharded:
+            await asyncio.to_thread(self.sharded.close)
+        if self.history:
+            self.history.close()
         logger.info("Data scheduler stopped")
     
-    def _run_scheduler(self):
-        """Основной цикл обновления данных"""
-        while self.running:
-            try:
-                opportunities = self.arbitrage_calc.find_arbitrage_opportunities()
-                self.db.save_arbitrage_opportunities(opportunities)
-                logger.info(f"Updated {len(opportunities)} arbitrage opportunities")
-            except Exception as e:
-                logger.error(f"Scheduler error: {str(e)}")
-            
-            time.sleep(Config.API_UPDATE_INTERVAL)
-    
-    def force_update(self):
-        """Принудительное обновление данных"""
-        opportunities = self.arbitrage_calc.find_arbitrage_opportunities()
-        self.db.save_arbitrage_opportunities(opportunities)
-        return len(opportunities)
+    async def _run_step(self, context):
+        """Один шаг планировщика; обе площадки опрашиваются параллельно"""
+        if not self.running:
+            return
+        try:
+            await self._wait_restored()
+            if self.adaptive:
+                await self._adaptive_step()
+            else:
+                await self.scan_once()
+        except Exception as e:
+            logger.error(f"Scheduler error: {str(e)}")
+        
+        if not self.running:
+            return
+        await self._save_warm_state()
+        if self.adaptive:
+            delay = max(self.planner.next_wakeup() - time.monotonic(), 0.1)
+        elif self.stream and self.stream.covers_all:
+            delay = Config.STREAM_RECONCILE_INTERVAL
+        else:
+            delay = Config.API_UPDATE_INTERVAL
+        self._job = context.job_queue.run_once(self._run_step, when=delay, name='data_scheduler')
+    
+    def _request_count(self):
+        """Всего запросов, сделанных асинхронными клиентами"""
+        return self.async_portals_api.request_count + self.async_tonnel_api.request_count
+    
+    async def _adaptive_step(self):
+        """Полное сканирование по адаптивному интервалу или проверка аукционов у финиша"""
+        if self.planner.full_scan_due():
+            await self.scan_once()
+            # Списываем все запросы с прошлого учета, включая ручные обновления
+            requests_used = self._request_count() - self._requests_accounted
+            self._requests_accounted += requests_used
+            self.planner.record_full_scan(
+                requests_used,
+                self._last_market_changes,
+                self.arbitrage_calc.auction_snapshot.values()
+            )
+            logger.debug(
+                f"Next full scan in {self.planner.full_scan_interval:.0f}s, "
+                f"{requests_used} requests used"
+            )
+            return
+        
+        due = self.planner.pop_due()
+        if due:
+            await self._recheck_auctions(due)
+    
+    async def _recheck_auctions(self, gift_ids):
+        """Точечная проверка аукционов, близких к окончанию"""
+        snapshot = self.arbitrage_calc.auction_snapshot
+        gift_ids = [gift_id for gift_id in gift_ids if gift_id in snapshot]
+        requests_before = self._request_count()
+        results = await asyncio.gather(*(
+            self.async_tonnel_api.get_auction(snapshot[gift_id].ref or gift_id, gift_id)
+            for gift_id in gift_ids
+        ))
+        # По запросу на аукцион уже оплачено в pop_due; повторы и дубли - сверх того
+        requests_used = self._request_count() - requests_before
+        self.planner.budget.consume(max(requests_used - len(gift_ids), 0))
+        self._requests_accounted += requests_used
+        
+        updated, ended = [], []
+        for gift_id, (ok, auction) in zip(gift_ids, results):
+            if not ok:
+                # Ошибка запроса: пробуем снова по прежнему расписанию
+                self.planner.record_recheck(gift_id, snapshot.get(gift_id))
+                continue
+            if auction is None:
+                ended.append(gift_id)
+            else:
+                updated.append(auction)
+            self.planner.record_recheck(gift_id, auction)
+        
+        delta = self.arbitrage_calc.apply_auction_updates(updated, ended)
+        if self.history:
+            _, auction_rows = self.arbitrage_calc.market_rows(updated)
+            await self._record_history(self.history.record_updates, auction_rows, ended)
+        if delta:
+            await self._persist_delta(delta)
+            logger.info(
+                f"Recheck of {len(gift_ids)} auctions: +{len(delta.added)} "
+                f"~{len(delta.changed)} -{len(delta.removed)}"
+            )
+    
+    async def scan_once(self):
+        """Сканирование с объединением: пока идет цикл, новые вызовы ждут его"""
+        if self._scan_task is None or self._scan_task.done():
+            self._scan_task = asyncio.ensure_future(self.update_async())
+        # shield: отмена одного ожидающего не прерывает общее сканирование
+        return await asyncio.shield(self._scan_task)
+    
+    async def update_async(self):
+        """Один цикл сканирования через асинхронные клиенты"""
+        await self._wait_restored()
+        started = time.monotonic()
+        if self.sharded:
+            # Загрузка, расчет и запись - в процессах шардов и процессе записи
+            count, new = await self.sharded.scan()
+            self.cache.bump()
+            self.notifier.publish(new)
+            self.scan_time.labels(mode='sharded').observe(time.monotonic() - started)
+            logger.info(
+                f"Sharded scan: {count} opportunities, {len(new)} new "
+                f"in {time.monotonic() - started:.2f}s"
+            )
+            return self._mark_scanned(count)
+        
+        if Config.INCREMENTAL_SCAN:
+            delta = await self.arbitrage_calc.find_arbitrage_delta_async()
+            await self._persist_delta(delta)
+            self._last_market_changes = delta.market_changes
+            if self.history:
+                # При неполном сканировании снимки объединены с прошлыми, но
+                # полным снимком для истории такое сканирование не считается
+                await self._record_history(
+                    self.history.record_scan, *self.arbitrage_calc.market_rows(), delta.complete
+                )
+            self.scan_time.labels(mode='delta').observe(time.monotonic() - started)
+            logger.info(
+                f"Arbitrage delta: +{len(delta.added)} ~{len(delta.changed)} "
+                f"-{len(delta.removed)} in {time.monotonic() - started:.2f}s"
+            )
+            return self._mark_scanned(self.arbitrage_calc.opportunity_count)
+        
+        opportunities = await self.arbitrage_calc.find_arbitrage_opportunities_async()
+        await asyncio.to_thread(
+            self.db.save_arbitrage_opportunities,
+            opportunities,
+            prune_missing=self.async_portals_api.last_scan_complete
+            and self.async_tonnel_api.last_scan_complete
+        )
+        self.cache.bump()
+        self._publish_new(opportunities)
+        if self.history:
+            await self._record_history(
+                self.history.record_scan, *self.arbitrage_calc.market_rows(),
+                self.async_portals_api.last_scan_complete
+                and self.async_tonnel_api.last_scan_complete
+            )
+        self.scan_time.labels(mode='full').observe(time.monotonic() - started)
+        logger.info(
+            f"Updated {len(opportunities)} arbitrage opportunities "
+            f"in {time.monotonic() - started:.2f}s"
+        )
+        return self._mark_scanned(len(opportunities))
+    
+    async def _persist_delta(self, delta):
+        """Сохранение изменений возможностей, сброс кэша и уведомления о новых
+        
+        Запись в SQLite - в пуле потоков, чтобы не задерживать обработчики
+        бота; блокировка сохраняет порядок записей: изменения, посчитанные
+        позже, не перезаписываются более старыми. После полного обхода
+        площадок из БД удаляются и строки, которых нет в памяти (например,
+        оставшиеся от прошлого запуска).
+        """
+        keep_ids = self.arbitrage_calc.opportunity_ids() if delta.complete else None
+        async with self._write_lock:
+            await asyncio.to_thread(
+                self.db.save_arbitrage_opportunities,
+                delta.added + delta.changed, removed=delta.removed,
+                prune_missing=delta.complete, keep_ids=keep_ids
+            )
+        self.cache.bump()
+        self.notifier.publish(delta.added)
+    
+    async def _apply_stream_events(self, market, items, removed_ids):
+        """Применение событий потока площадки: пересчет только затронутых возможностей"""
+        await self._wait_restored()
+        # Сканирование заменяет снимки целиком: события ждут его окончания в
+        # очереди приема и ложатся поверх свежих снимков
+        while self._scan_task is not None and not self._scan_task.done():
+            await asyncio.wait([self._scan_task])
+        delta = self.arbitrage_calc.apply_updates(market, items, removed_ids)
+        if delta:
+            await self._persist_delta(delta)
+            logger.debug(
+                f"{market} events: {len(items)} updated, {len(removed_ids)} removed, "
+                f"+{len(delta.added)} ~{len(delta.changed)} -{len(delta.removed)}"
+            )
+    
+    async def _reconcile(self):
+        """Полное сканирование, начатое после запроса сверки"""
+        # Идущее сканирование могло загрузить страницы до пропущенных событий
+        while self._scan_task is not None and not self._scan_task.done():
+            await asyncio.wait([self._scan_task])
+        await self.scan_once()
+    
+    async def _record_history(self, record, *args):
+        """Запись в историю цен в пуле потоков; ошибка не прерывает сканирование
+
+        Строки собираются до передачи в поток, так что снимки рынков
+        не читаются параллельно с их обновлением.
+        """
+        try:
+            await asyncio.to_thread(record, time.time(), *args)
+        except Exception as e:
+            logger.error(f"Error recording price history: {str(e)}")
+    
+    def _publish_new(self, opportunities):
+        """Уведомление только о возможностях, которых не было в прошлом полном скане"""
+        current_ids = {opp.nft_id for opp in opportunities}
+        self.notifier.publish(
+            [opp for opp in opportunities if opp.nft_id not in self._published_ids]
+        )
+        self._published_ids = current_ids
+    
+    def _mark_scanned(self, count):
+        """Запоминание времени и результата последнего сканирования"""
+        self._last_scan_at = time.monotonic()
+        self._last_scan_count = count
+        self.opportunities_gauge.set(count)
+        if self.stale_since is not None:
+            # Первое сканирование после старта: страницы с пометкой о старых данных сбрасываются
+            self.stale_since = None
+            self.cache.bump()
+        return count
+    
+    async def _restore_warm_state(self):
+        """Загрузка снимка прошлого запуска; ошибка означает обычный холодный старт"""
+        started = time.monotonic()
+        try:
+            state = await asyncio.to_thread(self._load_warm_state)
+        except Exception as e:
+            logger.error(f"Error restoring warm start snapshot: {str(e)}")
+            return
+        if state is not None:
+            logger.info(
+                f"Warm start from snapshot of {datetime.fromtimestamp(state.saved_at):%Y-%m-%d %H:%M:%S}: "
+                f"{sum(len(items) for items in state.markets.values())} listings, "
+                f"{self.arbitrage_calc.opportunity_count} opportunities "
+                f"in {time.monotonic() - started:.2f}s"
+            )
+    
+    def _load_warm_state(self):
+        """Чтение снимка и восстановление калькулятора (в пуле потоков, до первого цикла)"""
+        state = self.warm_start.load()
+        if state is None:
+            return None
+        calc = self.arbitrage_calc
+        # Снимок с другими комиссиями или порогом: возможности пересчитываются по каталогам
+        trusted = state.settings == calc.settings_key()
+        calc.restore(state.markets, state.opportunities if trusted else None)
+        self._published_ids = {opp.nft_id for opp in calc.export_state()[1]}
+        return state
+    
+    async def _wait_restored(self):
+        """Сканирование начинается только после восстановления состояния"""
+        if self._restore_task is not None:
+            # shield: отмена ожидающего не прерывает загрузку снимка
+            await asyncio.shield(self._restore_task)
+    
+    async def _save_warm_state(self, force: bool = False):
+        """Сохранение снимка быстрого старта не чаще WARM_START_INTERVAL"""
+        if not self.warm_start or self._last_scan_at is None:
+            # До первого сканирования на диске и так лежит текущее состояние
+            return
+        if not force and time.monotonic() - self._warm_saved_at < Config.WARM_START_INTERVAL:
+            return
+        self._warm_saved_at = time.monotonic()
+        calc = self.arbitrage_calc
+        # Списки собираются в event loop, запись - в пуле потоков
+        markets, opportunities = calc.export_state()
+        try:
+            await asyncio.to_thread(
+                self.warm_start.save, markets, opportunities,
+                calc.settings_key(), self.cache.updated_at
+            )
+        except Exception as e:
+            logger.error(f"Error saving warm start snapshot: {str(e)}")
+    
+    async def force_update(self):
+        """Принудительное обновление данных
+
+        Одновременные вызовы получают результат одного сканирования, а
+        запрос сразу после завершенного цикла отдает его результат без
+        нового обращения к маркетплейсам.
+        """
+        if (self._last_scan_at is not None
+                and time.monotonic() - self._last_scan_at < Config.FORCE_UPDATE_MIN_INTERVAL):
+            return self._last_scan_count
+        # Присоединяемся к текущему сканированию планировщика или запускаем новое
+        return await self.scan_once()
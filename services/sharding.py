@@ -0,0 +1,355 @@
+import asyncio
+import multiprocessing
+import queue
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from api.portals_api import AsyncPortalsAPI
+from api.tonnel_api import AsyncTonnelAPI
+from database import DatabaseManager
+from services.arbitrage import ArbitrageCalculator
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger('sharding')
+
+# Способы разбиения предложений между процессами
+SHARD_KEYS = ('collection', 'price')
+
+
+class ShardError(Exception):
+    """Ошибка или таймаут процесса шардированного сканирования"""
+
+
+def shard_of(calc, key, price, shards: int, shard_by: str) -> int:
+    """Номер шарда предложения
+
+    По коллекции - crc32 имени (hash() строк в каждом процессе свой), по
+    цене - номер ценового диапазона из Config.PRICE_RANGES по модулю
+    числа шардов.
+    """
+    if shard_by == 'price':
+        return int(calc.price_range_indices([price])[0]) % shards
+    return zlib.crc32(key[0].encode()) % shards
+
+
+def _is_lower(listing, current) -> bool:
+    """Порядок лотов как в FloorPriceIndex: цена, затем строковый id"""
+    return current is None or (listing.price, str(listing.id)) < (current.price, str(current.id))
+
+
+async def _fetch_stripe(calc, stripe: int, shards: int, shard_by: str):
+    """Загрузка полосы страниц всех площадок
+
+    Возвращает (floors, offers, complete): floors - лучший лот каждой
+    модели на каждой площадке продажи в пределах полосы, offers - список
+    предложений (market, Listing) для каждого шарда. Предложения уходят
+    процессам-владельцам шардов, в основной процесс - только floors;
+    остальные лоты площадок продажи дальше процесса не уходят.
+    """
+    floors = {name: {} for name in calc.market_index.markets}
+    buy_markets = set(calc.buy_markets)
+    offers = [[] for _ in range(shards)]
+
+    async for name, page in calc._iter_market_pages_async(stripe, shards):
+        local = floors.get(name)
+        for item in page:
+            key = item.key
+            # Без name/model предложение нельзя сопоставить: лот с тем же
+            # id может оказаться в другой полосе
+            if key is None or not item.price:
+                continue
+            if local is not None and _is_lower(item, local.get(key)):
+                local[key] = item
+            if name in buy_markets:
+                offers[shard_of(calc, key, item.price, shards, shard_by)].append((name, item))
+
+    complete = all(market.last_scan_complete for market in calc.markets.values())
+    return floors, offers, complete
+
+
+def _evaluate_shard(calc, offers, floors):
+    """Возможности шарда по общим floor-ценам всех полос"""
+    index = calc._new_index()
+    snapshots = {name: {} for name in calc.markets}
+    for name, listings in floors.items():
+        for listing in listings.values():
+            snapshots[name][listing.id] = listing
+            index.upsert(name, listing.id, listing.key, listing.price)
+    return calc._best_per_nft(calc._evaluate_pairs(calc._match_exits(offers, snapshots, index)))
+
+
+def _worker_main(stripe, shards, shard_by, inboxes, replies, writer_inbox):
+    """Процесс шарда: загрузка своей полосы страниц и расчет своего шарда
+
+    Предложения чужих шардов из своей полосы процесс отправляет их
+    владельцам напрямую, основному процессу уходят только floor-цены
+    полосы. Расчет начинается, когда пришли предложения от всех полос и
+    общие floor-цены от основного процесса. Полоса закреплена за
+    процессом, поэтому кэш ETag его клиентов работает между
+    сканированиями так же, как в однопроцессном режиме.
+    """
+    calc = ArbitrageCalculator(AsyncPortalsAPI(), AsyncTonnelAPI())
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    inbox = inboxes[stripe]
+    # Текущее сканирование: предложения по полосам и общие floor-цены
+    scan_id, offers, floors = 0, {}, None
+    try:
+        while True:
+            message = inbox.get()
+            if message is None:
+                break
+            kind, message_scan = message[:2]
+            if message_scan < scan_id:
+                continue
+            if message_scan > scan_id:
+                # Предложения соседей могут прийти раньше команды загрузки
+                scan_id, offers, floors = message_scan, {}, None
+            try:
+                if kind == 'fetch':
+                    stripe_floors, stripe_offers, complete = loop.run_until_complete(
+                        _fetch_stripe(calc, stripe, shards, shard_by)
+                    )
+                    for shard, shard_offers in enumerate(stripe_offers):
+                        if shard == stripe:
+                            offers[stripe] = shard_offers
+                        else:
+                            inboxes[shard].put(('offers', scan_id, stripe, shard_offers))
+                    replies.put(('fetched', scan_id, stripe, (stripe_floors, complete)))
+                elif kind == 'offers':
+                    offers[message[2]] = message[3]
+                elif kind == 'evaluate':
+                    floors = message[2]
+            except Exception as e:
+                logger.error(f"Shard {stripe} error: {str(e)}")
+                replies.put(('error', scan_id, stripe, str(e)))
+                continue
+
+            if floors is None or len(offers) < shards:
+                continue
+            shard_offers = [offer for source in sorted(offers) for offer in offers[source]]
+            shard_floors, offers, floors = floors, {}, None
+            try:
+                writer_inbox.put(('batch', scan_id, _evaluate_shard(calc, shard_offers, shard_floors)))
+            except Exception as e:
+                logger.error(f"Shard {stripe} error: {str(e)}")
+                # Процесс записи перестает ждать пакеты этого сканирования
+                writer_inbox.put(('failed', scan_id))
+    finally:
+        for market in calc.markets.values():
+            loop.run_until_complete(market.client.close())
+        loop.close()
+
+
+def _writer_main(db_path, inbox, done):
+    """Единственный процесс, пишущий результаты шардов в SQLite
+
+    Пакеты шардов одного сканирования сливаются (одна возможность на
+    NFT - с наибольшей прибылью) и записываются одной транзакцией вместе
+    с удалением исчезнувших возможностей. Основному процессу уходит
+    только число возможностей и новые по сравнению с прошлым сканированием.
+    """
+    db = DatabaseManager(db_path)
+    pending = {}
+    published = set()
+    failed_scan = None
+    try:
+        while True:
+            message = inbox.get()
+            if message is None:
+                break
+            kind, scan_id = message[:2]
+            if scan_id == failed_scan:
+                continue
+            # Сканирования идут по очереди: незавершенные старые уже не придут
+            for stale in [s for s in pending if s < scan_id]:
+                del pending[stale]
+            if kind == 'failed':
+                pending.pop(scan_id, None)
+                failed_scan = scan_id
+                done.put(('failed', scan_id, 'shard evaluation failed', None))
+                continue
+
+            state = pending.setdefault(scan_id, {'best': {}, 'batches': 0, 'expected': None})
+            if kind == 'batch':
+                best = state['best']
+                for opp in message[2]:
+                    current = best.get(opp.nft_id)
+                    if current is None or opp.profit > current.profit:
+                        best[opp.nft_id] = opp
+                state['batches'] += 1
+            elif kind == 'commit':
+                state['expected'], state['complete'] = message[2], message[3]
+
+            if state['expected'] is None or state['batches'] < state['expected']:
+                continue
+            del pending[scan_id]
+            opportunities = list(state['best'].values())
+            try:
+                db.save_arbitrage_opportunities(opportunities, prune_missing=state['complete'])
+            except Exception as e:
+                done.put(('failed', scan_id, str(e), None))
+                continue
+            new = [opp for opp in opportunities if opp.nft_id not in published]
+            published = {opp.nft_id for opp in opportunities}
+            done.put(('done', scan_id, len(opportunities), new))
+    finally:
+        db.close()
+
+
+class ShardedScanner:
+    """Полное сканирование в нескольких процессах
+
+    Каждый процесс загружает свою полосу страниц всех площадок (страница
+    i достается процессу i mod N) и разбирает ее. Предложения шардов (по
+    коллекции или ценовому диапазону) процессы передают друг другу
+    напрямую. Основной процесс получает только лучшие лоты моделей
+    каждой полосы, сливает их в общие floor-цены и рассылает всем
+    шардам; результаты шардов собирает отдельный процесс записи в
+    SQLite. Основной процесс не держит каталоги и не пишет в базу.
+    """
+
+    def __init__(self, shards: int = None, shard_by: str = None, db_path: str = None):
+        self.shards = shards or Config.SCAN_SHARDS
+        self.shard_by = shard_by or Config.SCAN_SHARD_BY
+        if self.shard_by not in SHARD_KEYS:
+            raise ValueError(f"Unknown shard key: {self.shard_by}")
+        self.db_path = db_path or Config.DB_PATH
+        # spawn: процесс бота многопоточный, fork унаследовал бы чужие блокировки
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = []
+        self._commands = []
+        self._replies = None
+        self._writer = None
+        self._writer_inbox = None
+        self._writer_done = None
+        self._scan_id = 0
+        self.last_scan_complete = True
+        # Ожидание ответов процессов блокирует поток на все сканирование:
+        # свой поток, чтобы не занимать пул обработчиков бота (HANDLER_WORKERS)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scan-shards')
+        self.phase_time = metrics.histogram(
+            'sharded_scan_phase_seconds', 'Sharded scan phase duration', ('phase',)
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._writer is not None
+
+    def start(self):
+        """Запуск процессов шардов и процесса записи"""
+        if self.running:
+            return
+        ctx = self._context
+        self._replies = ctx.Queue()
+        self._writer_inbox = ctx.Queue()
+        self._writer_done = ctx.Queue()
+        self._writer = ctx.Process(
+            target=_writer_main, args=(self.db_path, self._writer_inbox, self._writer_done),
+            name='scan-writer', daemon=True
+        )
+        self._writer.start()
+        # Очередь каждого шарда: команды основного процесса и предложения соседей
+        self._commands = [ctx.Queue() for _ in range(self.shards)]
+        for stripe in range(self.shards):
+            worker = ctx.Process(
+                target=_worker_main,
+                args=(stripe, self.shards, self.shard_by, self._commands, self._replies, self._writer_inbox),
+                name=f'scan-shard-{stripe}', daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Started {self.shards} scan shards by {self.shard_by}")
+
+    def close(self, timeout: float = 5):
+        """Остановка процессов; зависшие завершаются принудительно"""
+        if not self.running:
+            return
+        for commands in self._commands:
+            commands.put(None)
+        self._writer_inbox.put(None)
+        for process in self._workers + [self._writer]:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._workers, self._commands = [], []
+        self._writer = None
+
+    async def scan(self):
+        """Одно сканирование: (число возможностей, новые возможности)"""
+        self.start()
+        loop = asyncio.get_running_loop()
+        self._scan_id += 1
+        scan_id = self._scan_id
+        deadline = time.monotonic() + Config.SCAN_SHARD_TIMEOUT
+        try:
+            started = time.monotonic()
+            for commands in self._commands:
+                commands.put(('fetch', scan_id))
+            fetched = await loop.run_in_executor(self._executor, self._collect, scan_id, deadline)
+            self.phase_time.labels(phase='fetch').observe(time.monotonic() - started)
+
+            started = time.monotonic()
+            floors, complete = self._merge(fetched)
+            self.last_scan_complete = complete
+            # Floor-цены - по лоту на модель и площадку, во много раз меньше каталогов
+            for commands in self._commands:
+                commands.put(('evaluate', scan_id, floors))
+            self._writer_inbox.put(('commit', scan_id, self.shards, complete))
+            result = await loop.run_in_executor(self._executor, self._wait_written, scan_id, deadline)
+            self.phase_time.labels(phase='evaluate').observe(time.monotonic() - started)
+            return result
+        except ShardError:
+            # Процесс мог зависнуть или упасть: следующее сканирование начнется с новых
+            await loop.run_in_executor(self._executor, self.close)
+            raise
+
+    def _collect(self, scan_id, deadline):
+        """Ответы всех шардов на загрузку (блокирующее ожидание в потоке)"""
+        results = {}
+        while len(results) < self.shards:
+            kind, reply_id, stripe, payload = self._get(self._replies, deadline)
+            if reply_id != scan_id:
+                continue
+            if kind == 'error':
+                raise ShardError(f"Shard {stripe} failed: {payload}")
+            results[stripe] = payload
+        return [results[stripe] for stripe in range(self.shards)]
+
+    def _wait_written(self, scan_id, deadline):
+        """Итог записи сканирования; ошибки расчета шардов приходят через процесс записи"""
+        while True:
+            kind, reply_id, count, new = self._get(self._writer_done, deadline)
+            if reply_id != scan_id:
+                continue
+            if kind == 'failed':
+                raise ShardError(f"Sharded scan not written: {count}")
+            return count, new
+
+    @staticmethod
+    def _get(source, deadline):
+        """Сообщение из очереди с общим сроком сканирования"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ShardError("Sharded scan timed out")
+        try:
+            return source.get(timeout=remaining)
+        except queue.Empty:
+            raise ShardError("Sharded scan timed out") from None
+
+    @staticmethod
+    def _merge(fetched):
+        """Слияние floor-цен полос: (общие floor-цены, полный ли обход)"""
+        floors = {}
+        complete = True
+        for stripe_floors, stripe_complete in fetched:
+            complete = complete and stripe_complete
+            for name, listings in stripe_floors.items():
+                merged = floors.setdefault(name, {})
+                for key, listing in listings.items():
+                    if _is_lower(listing, merged.get(key)):
+                        merged[key] = listing
+        return floors, complete
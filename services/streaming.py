@@ -0,0 +1,135 @@
+import asyncio
+import time
+from api.events import REMOVE, RESET
+from config import Config
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger('streaming')
+
+
+class EventIngestor:
+    """Прием событий площадок с потоковым API
+
+    Для каждой площадки из STREAM_MARKETS читается свой поток
+    (api.events.EventStream), события складываются в общую ограниченную
+    очередь. Когда пересчет не успевает, чтение потоков останавливается и
+    сервер упирается в окно TCP, а не копит события в памяти бота. Задача
+    применения забирает события пачками, схлопывает повторы одного лота и
+    передает изменения в apply(market, items, removed_ids). Событие reset
+    (первое подключение или невозможность продолжить поток) запускает
+    reconcile() - полное сканирование, восстанавливающее пропущенное.
+    """
+
+    def __init__(self, markets: dict, apply, reconcile):
+        self.apply = apply
+        self.reconcile = reconcile
+        self.streams = {}
+        for name in Config.STREAM_MARKETS:
+            market = markets.get(name)
+            stream = market.event_stream() if market is not None else None
+            if stream is None:
+                logger.warning(f"Market {name} has no event stream, it is polled as usual")
+                continue
+            self.streams[name] = stream
+        # Все площадки приходят потоком: полное сканирование нужно только для сверки
+        self.covers_all = bool(self.streams) and set(self.streams) == set(markets)
+        self._queue = None
+        self._tasks = []
+        self._reconcile_task = None
+        self._reconcile_pending = False
+        self.events_total = metrics.counter(
+            'stream_events_total', 'Market events received from event streams', ('market',)
+        )
+        self.queue_depth = metrics.gauge(
+            'stream_queue_depth', 'Market events waiting to be applied'
+        )
+        self.reaction_time = metrics.histogram(
+            'stream_reaction_seconds', 'Time from receiving a market event to a saved recalculation',
+            buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+        )
+
+    def start(self):
+        """Запуск чтения потоков и применения событий в текущем event loop"""
+        self._queue = asyncio.Queue(maxsize=Config.STREAM_QUEUE_SIZE)
+        self._tasks = [asyncio.create_task(self._read(name, stream)) for name, stream in self.streams.items()]
+        self._tasks.append(asyncio.create_task(self._consume()))
+        logger.info(f"Event ingestion started for {', '.join(self.streams)} ({Config.STREAM_MODE})")
+
+    async def stop(self):
+        """Остановка чтения и применения; сверка в процессе отменяется"""
+        tasks = self._tasks + ([self._reconcile_task] if self._reconcile_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Event ingestion stopped")
+
+    async def _read(self, name, stream):
+        """Чтение потока площадки в общую очередь"""
+        counter = self.events_total.labels(market=name)
+        while True:
+            try:
+                async for event in stream.events():
+                    counter.inc()
+                    # put() ждет свободного места - это и есть обратное давление на поток
+                    await self._queue.put((name, event))
+                    self.queue_depth.set(self._queue.qsize())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Сетевые ошибки поток обрабатывает сам; здесь - непредвиденные
+                logger.error(f"Event stream {name} failed: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def _consume(self):
+        """Применение событий пачками, пока задача не отменена"""
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < Config.STREAM_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self.queue_depth.set(self._queue.qsize())
+            try:
+                await self._apply_batch(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error applying market events: {str(e)}")
+
+    async def _apply_batch(self, batch):
+        """Последняя версия каждого лота в пачке - одно обновление на площадку"""
+        changes = {}
+        reset = False
+        for name, event in batch:
+            if event.kind == RESET:
+                reset = True
+                continue
+            changes.setdefault(name, {})[event.item.id] = None if event.kind == REMOVE else event.item
+        for name, items in changes.items():
+            await self.apply(
+                name,
+                [item for item in items.values() if item is not None],
+                [item_id for item_id, item in items.items() if item is None]
+            )
+        now = time.monotonic()
+        for _, event in batch:
+            if event.kind != RESET:
+                self.reaction_time.observe(now - event.received)
+        if reset:
+            self._request_reconcile()
+
+    def _request_reconcile(self):
+        """Сверка полным сканированием; запросы во время сверки дают еще одну после нее"""
+        self._reconcile_pending = True
+        if self._reconcile_task is None or self._reconcile_task.done():
+            self._reconcile_task = asyncio.create_task(self._reconcile())
+
+    async def _reconcile(self):
+        while self._reconcile_pending:
+            self._reconcile_pending = False
+            try:
+                await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Stream reconciliation error: {str(e)}")
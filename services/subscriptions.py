@@ -0,0 +1,156 @@
+import bisect
+import json
+import time
+from config import Config
+
+
+class Subscription:
+    """Фильтры пользователя: мин. прибыль, диапазоны цен, модели, время до конца"""
+
+    def __init__(self, chat_id: int, min_profit: float = Config.MIN_PROFIT,
+                 price_ranges=None, models=None, max_time_to_end: int = None,
+                 notify: bool = False):
+        self.chat_id = chat_id
+        self.min_profit = min_profit
+        # None означает "без ограничения"
+        self.price_ranges = frozenset(price_ranges) if price_ranges else None
+        self.models = frozenset(models) if models else None
+        self.max_time_to_end = max_time_to_end
+        self.notify = notify
+
+    @classmethod
+    def from_row(cls, row):
+        """Создание из строки таблицы subscriptions"""
+        chat_id, min_profit, price_ranges, models, max_time_to_end, notify = row
+        return cls(
+            chat_id, min_profit,
+            json.loads(price_ranges) if price_ranges else None,
+            json.loads(models) if models else None,
+            max_time_to_end, bool(notify)
+        )
+
+    def to_row(self):
+        """Значения для сохранения в БД"""
+        return (
+            self.chat_id, self.min_profit,
+            json.dumps(sorted(self.price_ranges)) if self.price_ranges else None,
+            json.dumps(sorted(self.models), ensure_ascii=False) if self.models else None,
+            self.max_time_to_end, int(self.notify)
+        )
+
+    def copy(self):
+        """Независимая копия для изменения настроек"""
+        return Subscription(
+            self.chat_id, self.min_profit, self.price_ranges, self.models,
+            self.max_time_to_end, self.notify
+        )
+
+    def matches(self, opp, now: float = None) -> bool:
+        """Проходит ли возможность через фильтры пользователя"""
+        if opp.profit < self.min_profit:
+            return False
+        if self.price_ranges is not None and opp.price_range not in self.price_ranges:
+            return False
+        if self.models is not None and opp.model not in self.models:
+            return False
+        if self.max_time_to_end is not None:
+            now = time.time() if now is None else now
+            # Лот без срока (окончание 0) не проходит фильтр по времени до конца
+            if not opp.end_time or opp.end_time - now > self.max_time_to_end:
+                return False
+        return True
+
+    def filter_key(self):
+        """Ключ набора фильтров (для кэша отображения)"""
+        return (
+            self.min_profit,
+            tuple(sorted(self.price_ranges)) if self.price_ranges else None,
+            tuple(sorted(self.models)) if self.models else None,
+            self.max_time_to_end
+        )
+
+
+class SubscriptionIndex:
+    """Индекс подписчиков для маршрутизации возможностей без перебора N×M
+
+    По каждому измерению фильтра построена своя структура:
+    - мин. прибыль: отсортированные пороги, подходящие - префикс (bisect);
+    - макс. время до конца: отсортированные пределы, подходящие - суффикс;
+    - диапазоны цен и модели: множества подписчиков по значению плюс
+      множество подписчиков без ограничения.
+    Для каждой возможности берется самое узкое из четырех множеств
+    кандидатов, и только они проверяются полностью.
+    Индекс неизменяем: при смене подписок строится новый и подменяется.
+    """
+
+    def __init__(self, subscriptions=()):
+        self._subscriptions = {
+            sub.chat_id: sub for sub in subscriptions if sub.notify
+        }
+        subs = list(self._subscriptions.values())
+
+        by_profit = sorted((sub.min_profit, sub.chat_id) for sub in subs)
+        self._profit_keys = [min_profit for min_profit, _ in by_profit]
+        self._profit_chats = [chat_id for _, chat_id in by_profit]
+
+        limited = sorted(
+            (sub.max_time_to_end, sub.chat_id) for sub in subs
+            if sub.max_time_to_end is not None
+        )
+        self._tte_keys = [limit for limit, _ in limited]
+        self._tte_chats = [chat_id for _, chat_id in limited]
+        self._tte_any = [sub.chat_id for sub in subs if sub.max_time_to_end is None]
+
+        self._by_range, self._range_any = self._group(subs, 'price_ranges')
+        self._by_model, self._model_any = self._group(subs, 'models')
+
+    @staticmethod
+    def _group(subs, attr):
+        """Подписчики по значению фильтра и без ограничения"""
+        grouped, unrestricted = {}, []
+        for sub in subs:
+            values = getattr(sub, attr)
+            if values is None:
+                unrestricted.append(sub.chat_id)
+                continue
+            for value in values:
+                grouped.setdefault(value, []).append(sub.chat_id)
+        return grouped, unrestricted
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def match(self, opp, now: float = None):
+        """chat_id подписчиков, чьи фильтры пропускают возможность"""
+        if not self._subscriptions:
+            return []
+        now = time.time() if now is None else now
+
+        profit_count = bisect.bisect_right(self._profit_keys, opp.profit)
+        if not profit_count:
+            return []
+        tte_start = bisect.bisect_left(
+            self._tte_keys, opp.end_time - now if opp.end_time else float('inf')
+        )
+        range_chats = self._by_range.get(opp.price_range, ())
+        model_chats = self._by_model.get(opp.model, ())
+
+        # Размер каждого множества кандидатов известен без его построения
+        options = (
+            (profit_count, lambda: self._profit_chats[:profit_count]),
+            (len(self._tte_chats) - tte_start + len(self._tte_any),
+             lambda: self._tte_chats[tte_start:] + self._tte_any),
+            (len(range_chats) + len(self._range_any),
+             lambda: list(range_chats) + self._range_any),
+            (len(model_chats) + len(self._model_any),
+             lambda: list(model_chats) + self._model_any),
+        )
+        size, candidates = min(options, key=lambda option: option[0])
+        if not size:
+            return []
+
+        subscriptions = self._subscriptions
+        return [
+            chat_id for chat_id in candidates()
+            if subscriptions[chat_id].matches(opp, now)
+        ]
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from config import Config
+from database import get_database
+from utils.concurrency import SingleFlight
+from utils.logger import setup_logger
+
+logger = setup_logger('token_provider')
+
+
+class TokenProvider:
+    """Общий для API клиентов кэш токенов авторизации
+
+    Расшифрованный токен хранится в памяти вместе со сроком действия,
+    поэтому запрос не обращается ни к SQLite, ни к Fernet. За
+    TOKEN_REFRESH_MARGIN секунд до истечения токен обновляется в фоне,
+    истекший или отклоненный сервером (401) - сразу. Одновременные
+    обновления одного сервиса объединяются в одно.
+    """
+
+    def __init__(self, db=None):
+        self.db = db or get_database()
+        # service -> (token, expires_at); expires_at=None - бессрочный токен
+        self._tokens = {}
+        # service -> функция получения нового токена: () -> (token, expires_at)
+        self._refreshers = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+
+    def set_refresher(self, service: str, refresher):
+        """Регистрация функции получения нового токена для сервиса"""
+        self._refreshers[service] = refresher
+
+    @staticmethod
+    def _expired(entry, margin: float = 0) -> bool:
+        token, expires_at = entry
+        return token is None or (expires_at is not None and expires_at - time.time() <= margin)
+
+    def _load(self, service: str):
+        """Чтение токена из БД в кэш"""
+        entry = self.db.get_auth_token_entry(service)
+        if entry[0] is None:
+            logger.warning(f"{service} API token not found in database")
+        self._tokens[service] = entry
+        return entry
+
+    def get(self, service: str):
+        """Действующий токен сервиса (None, если получить его не удалось)"""
+        entry = self._tokens.get(service)
+        if entry is None:
+            entry = self._load(service)
+        if self._expired(entry):
+            # Без действующего токена запрос бессмыслен - обновляем сразу
+            return self.refresh(service)
+        if service in self._refreshers and self._expired(entry, Config.TOKEN_REFRESH_MARGIN):
+            self._refresh_in_background(service)
+        return entry[0]
+
+    async def get_async(self, service: str):
+        """То же, что get(); обращение к БД и обновление - вне event loop"""
+        entry = self._tokens.get(service)
+        if entry is None or self._expired(entry):
+            return await asyncio.to_thread(self.get, service)
+        return self.get(service)
+
+    def refresh(self, service: str, stale: str = None):
+        """Обновление токена; stale - токен, который отклонил сервер
+
+        Если кэш уже содержит другой действующий токен (его обновил
+        параллельный запрос), повторного обновления не происходит.
+        """
+        entry = self._tokens.get(service)
+        if stale is not None and entry and entry[0] != stale and not self._expired(entry):
+            return entry[0]
+        return self._single_flight.do(service, self._refresh, service)
+
+    async def refresh_async(self, service: str, stale: str = None):
+        """Обновление токена из асинхронного кода"""
+        return await asyncio.to_thread(self.refresh, service, stale)
+
+    def _refresh(self, service: str):
+        refresher = self._refreshers.get(service)
+        if refresher is None:
+            # Токен обновляет другой компонент - перечитываем БД
+            return self._load(service)[0]
+        try:
+            token, expires_at = refresher()
+        except Exception as e:
+            logger.error(f"Error refreshing {service} token: {str(e)}")
+            return None
+        self.db.save_auth_token(service, token, expires_at)
+        self._tokens[service] = (token, expires_at)
+        logger.info(f"{service} token refreshed")
+        return token
+
+    def _refresh_in_background(self, service: str):
+        """Упреждающее обновление без задержки текущего запроса"""
+        with self._lock:
+            if service in self._refreshing:
+                return
+            self._refreshing.add(service)
+
+        def run():
+            try:
+                self.refresh(service)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(service)
+
+        threading.Thread(target=run, name=f'token-refresh-{service}', daemon=True).start()
+
+
+_shared_provider = None
+_shared_lock = threading.Lock()
+
+
+def get_token_provider() -> TokenProvider:
+    """Общий на процесс экземпляр TokenProvider"""
+    global _shared_provider
+    with _shared_lock:
+        if _shared_provider is None:
+            _shared_provider = TokenProvider()
+        return _shared_provider
@@ -0,0 +1,106 @@
+import mmap
+import os
+import pickle
+import struct
+import time
+from typing import NamedTuple, Optional
+from config import Config
+from services.records import Listing, Opportunity
+from utils.logger import setup_logger
+from utils.metrics import metrics
+
+logger = setup_logger('warm_start')
+
+# Заголовок файла: сигнатура с версией формата и время сохранения снимка
+MAGIC = b'ARBWARM1'
+_HEADER = struct.Struct('<8sd')
+
+# Из снимка восстанавливаются только записи; любой другой класс - ошибка
+_RECORDS = {
+    ('services.records', 'Listing'): Listing,
+    ('services.records', 'Opportunity'): Opportunity,
+}
+
+
+class _RecordUnpickler(pickle.Unpickler):
+    """Разбор снимка без импорта произвольных классов"""
+
+    def find_class(self, module, name):
+        record = _RECORDS.get((module, name))
+        if record is None:
+            raise pickle.UnpicklingError(f"Unexpected class in warm start snapshot: {module}.{name}")
+        return record
+
+
+class WarmState(NamedTuple):
+    """Содержимое снимка: каталоги площадок (name -> [Listing]) и возможности"""
+
+    saved_at: float
+    settings: str
+    markets: dict
+    opportunities: list
+
+
+class WarmStartStore:
+    """Снимок состояния рынков и возможностей для быстрого старта
+
+    Файл - заголовок и pickle записей Listing/Opportunity (строки
+    name/model в нем хранятся по разу, как в памяти). Запись атомарная:
+    во временный файл и переименование, так что падение во время
+    сохранения оставляет прошлый снимок. Загрузка читает отображенный
+    в память файл без промежуточной копии.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.WARM_START_PATH
+        self.save_time = metrics.histogram(
+            'warm_start_save_seconds', 'Time to write the warm start snapshot'
+        )
+        self.snapshot_bytes = metrics.gauge(
+            'warm_start_snapshot_bytes', 'Size of the last warm start snapshot'
+        )
+
+    def saved_at(self) -> Optional[float]:
+        """Время сохранения снимка по заголовку или None, если снимка нет"""
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.read(_HEADER.size)
+        except OSError:
+            return None
+        if len(header) < _HEADER.size:
+            return None
+        magic, saved_at = _HEADER.unpack(header)
+        return saved_at if magic == MAGIC else None
+
+    def save(self, markets: dict, opportunities: list, settings: str, saved_at: float = None):
+        """Запись снимка; вызывается в пуле потоков со списками из export_state()"""
+        started = time.monotonic()
+        payload = {'settings': settings, 'markets': markets, 'opportunities': opportunities}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, saved_at or time.time()))
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.save_time.observe(time.monotonic() - started)
+        self.snapshot_bytes.set(os.path.getsize(self.path))
+
+    def load(self) -> Optional[WarmState]:
+        """Снимок прошлого запуска или None, если его нет или он поврежден"""
+        try:
+            with open(self.path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size <= _HEADER.size:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    magic, saved_at = _HEADER.unpack(mapped.read(_HEADER.size))
+                    if magic != MAGIC:
+                        logger.warning(f"Unknown warm start snapshot format in {self.path}")
+                        return None
+                    payload = _RecordUnpickler(mapped).load()
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Cannot read warm start snapshot {self.path}: {str(e)}")
+            return None
+        return WarmState(saved_at, payload['settings'], payload['markets'], payload['opportunities'])
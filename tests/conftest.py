@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Модули импортируются от корня репозитория, как при запуске python -m
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Config читает окружение при импорте: база тестов - во временном каталоге
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(prefix='arbitrage-tests-'), 'arbitrage.db'))
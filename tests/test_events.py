@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import aiohttp
+import pytest
+from config import Config
+from api import events
+from api.events import REMOVE, RESET, UPDATE, EventStream, StreamEvent
+from services.records import Listing
+from services.streaming import EventIngestor
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(events, 'backoff', lambda attempt: 0)
+
+
+def _item(gift_id, price=5.0):
+    return {'id': gift_id, 'name': 'Plush Pepe', 'model': 'Gold', 'price': price}
+
+
+def _sse(*messages):
+    """Строки ответа SSE: сообщения - (id, event, item), между ними пинги"""
+    lines = [': ping']
+    for event_id, kind, item in messages:
+        lines.append(f'id: {event_id}')
+        lines.append(f'event: {kind}')
+        if item is not None:
+            lines.append(f"data: {json.dumps({'item': item})}")
+        lines.append('')
+    return [f'{line}\n'.encode() for line in lines]
+
+
+class FakeResponse:
+    def __init__(self, lines=(), payload=None):
+        self.content = self._lines(lines)
+        self.payload = payload
+
+    @staticmethod
+    async def _lines(lines):
+        for line in lines:
+            yield line
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self):
+        return json.dumps(self.payload).encode()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeClient:
+    """Клиент площадки с заранее заданными ответами на запросы потока"""
+
+    base_url = 'http://market.test'
+    events_endpoint = '/events'
+    service = 'portals'
+    title = 'Portals'
+    logger = logging.getLogger('test_events')
+
+    def __init__(self, responses):
+        self.headers = {'Accept': 'application/json'}
+        self.responses = list(responses)
+        self.requests = []
+
+    async def _request(self, url, headers=None, params=None, **kwargs):
+        self.requests.append({'url': url, 'headers': headers or {}, 'params': params or {}})
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def record(self, item):
+        return Listing(item['id'], item['name'], item['model'], float(item['price']))
+
+
+def _take(stream, count):
+    async def run():
+        taken = []
+        source = stream.events()
+        async for event in source:
+            taken.append(event)
+            if len(taken) == count:
+                break
+        await source.aclose()
+        return taken
+
+    return asyncio.run(run())
+
+
+def test_sse_resumes_from_last_event_id():
+    client = FakeClient([
+        FakeResponse(_sse(('1', UPDATE, _item(1)), ('2', REMOVE, _item(2)))),
+        FakeResponse(_sse(('3', UPDATE, _item(3, 6.0)))),
+    ])
+    stream = EventStream(client, mode='sse')
+    taken = _take(stream, 4)
+    assert [(event.id, event.kind) for event in taken] == [
+        (None, RESET), ('1', UPDATE), ('2', REMOVE), ('3', UPDATE)
+    ]
+    assert taken[3].item == Listing(3, 'Plush Pepe', 'Gold', 6.0)
+    assert 'Last-Event-ID' not in client.requests[0]['headers']
+    # Продолжение после обрыва - без reset, с позиции последнего события
+    assert client.requests[1]['headers']['Last-Event-ID'] == '2'
+    assert stream.last_event_id == '3'
+
+
+def test_sse_server_reset_on_resume():
+    client = FakeClient([
+        FakeResponse(_sse(('1', UPDATE, _item(1)))),
+        FakeResponse(_sse(('40', RESET, None), ('41', UPDATE, _item(4)))),
+    ])
+    stream = EventStream(client, mode='sse')
+    taken = _take(stream, 4)
+    assert [(event.id, event.kind) for event in taken] == [
+        (None, RESET), ('1', UPDATE), ('40', RESET), ('41', UPDATE)
+    ]
+    assert taken[2].item is None
+
+
+def test_sse_error_reconnects():
+    client = FakeClient([
+        aiohttp.ClientConnectionError('refused'),
+        FakeResponse(_sse(('1', UPDATE, _item(1)))),
+    ])
+    stream = EventStream(client, mode='sse')
+    taken = _take(stream, 2)
+    assert [event.kind for event in taken] == [RESET, UPDATE]
+    assert len(client.requests) == 2
+
+
+def test_poll_resume_and_reset():
+    client = FakeClient([
+        FakeResponse(payload={'last_id': '5', 'events': []}),
+        FakeResponse(payload={'last_id': '6', 'events': [
+            {'id': '6', 'type': UPDATE, 'item': _item(1)},
+        ]}),
+        aiohttp.ClientConnectionError('reset by peer'),
+        FakeResponse(payload={'reset': True, 'last_id': '20'}),
+        FakeResponse(payload={'last_id': '21', 'events': [
+            {'id': '21', 'type': REMOVE, 'item': _item(1)},
+        ]}),
+    ])
+    stream = EventStream(client, mode='poll')
+    taken = _take(stream, 4)
+    assert [(event.id, event.kind) for event in taken] == [
+        ('5', RESET), ('6', UPDATE), ('20', RESET), ('21', REMOVE)
+    ]
+    assert [request['params'].get('after') for request in client.requests] == [
+        None, '5', '6', '6', '20'
+    ]
+
+
+def test_unknown_mode_rejected():
+    with pytest.raises(ValueError):
+        EventStream(FakeClient([]), mode='websocket')
+
+
+class FakeMarket:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def event_stream(self):
+        return self.stream
+
+
+def test_ingestor_collapses_batch_and_reconciles_on_reset(monkeypatch):
+    monkeypatch.setattr(Config, 'STREAM_MARKETS', ['portals'])
+    applied, reconciled = [], []
+
+    async def apply(market, items, removed_ids):
+        applied.append((market, items, removed_ids))
+
+    async def reconcile():
+        reconciled.append(True)
+
+    def event(kind, gift_id=None, price=5.0):
+        item = None if gift_id is None else Listing(gift_id, 'Plush Pepe', 'Gold', price)
+        return 'portals', StreamEvent(None, kind, item, 0.0)
+
+    async def run():
+        ingestor = EventIngestor({'portals': FakeMarket(object())}, apply, reconcile)
+        assert ingestor.covers_all
+        await ingestor._apply_batch([
+            event(UPDATE, 1, 5.0), event(UPDATE, 1, 6.0), event(UPDATE, 2), event(REMOVE, 2),
+        ])
+        assert ingestor._reconcile_task is None
+        await ingestor._apply_batch([event(RESET)])
+        await ingestor._reconcile_task
+
+    asyncio.run(run())
+    assert applied == [('portals', [Listing(1, 'Plush Pepe', 'Gold', 6.0)], [2])]
+    assert reconciled == [True]
+
+
+def test_sse_message_without_event_field_is_update():
+    lines = [b'id: 1\n', f"data: {json.dumps({'item': _item(1)})}\n".encode(), b'\n']
+    client = FakeClient([FakeResponse(lines)])
+    taken = _take(EventStream(client, mode='sse'), 2)
+    assert [(event.id, event.kind) for event in taken] == [(None, RESET), ('1', UPDATE)]
+    assert len(client.requests) == 1
+
+
+def test_unknown_event_type_is_skipped_without_reconnect():
+    client = FakeClient([
+        FakeResponse(_sse(('1', 'price_hint', _item(1)), ('2', UPDATE, _item(2)))),
+    ])
+    stream = EventStream(client, mode='sse')
+    taken = _take(stream, 2)
+    assert [(event.id, event.kind) for event in taken] == [(None, RESET), ('2', UPDATE)]
+    assert len(client.requests) == 1
+
+
+def test_poll_skips_unknown_event_type():
+    client = FakeClient([
+        FakeResponse(payload={'last_id': '5', 'events': []}),
+        FakeResponse(payload={'last_id': '7', 'events': [
+            {'id': '6', 'type': 'price_hint', 'item': _item(1)},
+            {'id': '7', 'type': UPDATE, 'item': _item(2)},
+        ]}),
+    ])
+    stream = EventStream(client, mode='poll')
+    taken = _take(stream, 2)
+    assert [(event.id, event.kind) for event in taken] == [('5', RESET), ('7', UPDATE)]
+    assert stream.last_event_id == '7'
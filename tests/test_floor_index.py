@@ -0,0 +1,106 @@
+from services.floor_index import CrossMarketIndex, FloorPriceIndex
+
+A = ('Plush Pepe', 'Gold')
+B = ('Plush Pepe', 'Silver')
+
+
+class Fees:
+    def __init__(self, rate):
+        self.rate = rate
+
+    def proceeds(self, price):
+        return price * (1 - self.rate)
+
+
+def test_floor_follows_updates():
+    index = FloorPriceIndex()
+    assert index.upsert(1, A, 10.0)
+    assert index.upsert(2, A, 8.0)
+    assert index.floor(A) == (8.0, 2)
+    # Повтор той же цены индекс не меняет
+    assert not index.upsert(2, A, 8.0)
+    assert index.upsert(2, A, 12.0)
+    assert index.floor(A) == (10.0, 1)
+
+
+def test_move_between_models():
+    index = FloorPriceIndex()
+    index.upsert(1, A, 10.0)
+    index.upsert(1, B, 9.0)
+    assert index.floor(A) is None
+    assert index.floor(B) == (9.0, 1)
+    assert index.key_of(1) == B
+    assert len(index) == 1
+
+
+def test_remove():
+    index = FloorPriceIndex()
+    index.upsert(1, A, 10.0)
+    index.upsert(2, A, 8.0)
+    assert index.remove(2) == A
+    assert index.floor(A) == (10.0, 1)
+    assert index.remove(2) is None
+    assert index.remove(1) == A
+    assert index.floor(A) is None
+    assert 1 not in index
+
+
+def test_zero_price_removes_listing():
+    index = FloorPriceIndex()
+    index.upsert(1, A, 10.0)
+    assert index.upsert(1, A, 0)
+    assert 1 not in index
+    assert not index.upsert(2, A, 0)
+
+
+def test_equal_prices_with_mixed_id_types():
+    index = FloorPriceIndex()
+    index.upsert(1, A, 5.0)
+    index.upsert('x', A, 5.0)
+    assert index.remove(1) == A
+    assert index.floor(A) == (5.0, 'x')
+
+
+def test_from_listings_matches_upserts():
+    listings = [(1, A, 10.0), (2, A, 8.0), (3, B, 7.0), (4, B, 0)]
+    built = FloorPriceIndex.from_listings(listings)
+    index = FloorPriceIndex()
+    for listing in listings:
+        index.upsert(*listing)
+    assert len(built) == len(index) == 3
+    for key in (A, B):
+        assert built.floor(key) == index.floor(key)
+
+
+def test_from_listings_last_duplicate_wins():
+    built = FloorPriceIndex.from_listings([(1, A, 5.0), (2, A, 9.0), (1, B, 7.0)])
+    assert len(built) == 2
+    assert built.floor(A) == (9.0, 2)
+    assert built.floor(B) == (7.0, 1)
+    # Запись дубликата не осталась в книге: удаление очищает модель
+    assert built.remove(2) == A
+    assert built.floor(A) is None
+
+
+def test_best_exit_skips_buy_market():
+    index = CrossMarketIndex({'portals': Fees(0.05), 'tonnel': Fees(0.1)})
+    index.upsert('portals', 1, A, 10.0)
+    index.upsert('tonnel', 2, A, 10.5)
+    assert index.best_exit(A)[1] == 'portals'
+    assert index.best_exit(A, buy_market='portals')[1] == 'tonnel'
+    assert index.best_exit(A, buy_market='tonnel')[1] == 'portals'
+
+
+def test_best_exit_follows_changes():
+    index = CrossMarketIndex({'portals': Fees(0.05), 'tonnel': Fees(0.1)})
+    index.upsert('portals', 1, A, 10.0)
+    index.upsert('tonnel', 2, A, 10.5)
+    assert index.best_exit(A)[2] == 10.0
+    assert index.upsert('portals', 1, A, 12.0) == {A}
+    assert index.best_exit(A)[2] == 12.0
+    assert index.remove('portals', 1) == {A}
+    assert index.best_exit(A)[1] == 'tonnel'
+    assert index.best_exit(A, buy_market='tonnel') is None
+    index.load('portals', [(3, A, 20.0), (3, B, 1.0)])
+    assert index.best_exit(A)[1] == 'tonnel'
+    assert index.best_exit(B)[1:] == ('portals', 1.0, 3)
@@ -0,0 +1,172 @@
+import json
+import math
+import os
+import numpy as np
+import pytest
+from config import Config
+from services.history import FORMAT_FILE, FORMAT_VERSION, PORTALS, HistoryReader, HistoryStore
+
+DAY = 86400
+T0 = 1_700_000_000 // DAY * DAY
+KEY = ('Plush Pepe', 'Gold')
+
+
+@pytest.fixture(autouse=True)
+def keep_all(monkeypatch):
+    monkeypatch.setattr(Config, 'HISTORY_RETENTION_DAYS', 0)
+
+
+def _listings(*rows):
+    return [(gift_id, KEY, price, 0) for gift_id, price in rows]
+
+
+def _floors(root):
+    times, floors = HistoryReader(root).floor_series(*KEY, days=None, market=PORTALS)
+    return [(int(ts - T0), None if math.isnan(floor) else floor) for ts, floor in zip(times, floors)]
+
+
+def _partition_name(root):
+    """Имя единственного раздела истории"""
+    name, = [name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name))]
+    return name
+
+
+def test_floor_series_within_partition(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.record_scan(T0 + 10, _listings(('a', 5.0), ('b', 7.0)), [])
+    store.record_scan(T0 + 20, _listings(('a', 5.0), ('b', 7.0)), [])
+    store.record_scan(T0 + 30, _listings(('b', 7.0)), [])
+    store.record_scan(T0 + 40, [], [])
+    store.close()
+    assert _floors(str(tmp_path)) == [(10, 5.0), (30, 7.0), (40, None)]
+
+
+def test_floor_series_across_partitions(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.record_scan(T0 + 10, _listings(('a', 5.0), ('b', 7.0)), [])
+    # Лот a снят к началу следующих суток: снимок раздела без него
+    store.record_scan(T0 + DAY + 10, _listings(('b', 7.0)), [])
+    store.record_scan(T0 + 2 * DAY + 10, _listings(('b', 6.0)), [])
+    store.close()
+    assert [p.scan_key.tolist() for p in HistoryReader(str(tmp_path)).partitions()] == [[1], [1], [1]]
+    assert _floors(str(tmp_path)) == [(10, 5.0), (DAY + 10, 7.0), (2 * DAY + 10, 6.0)]
+
+
+def test_incomplete_scan_is_not_keyframe(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.record_scan(T0 + 10, _listings(('a', 5.0), ('b', 7.0)), [])
+    # Неполное сканирование новых суток не считает лот a снятым
+    store.record_scan(T0 + DAY + 10, _listings(('b', 7.0)), [], complete=False)
+    store.record_scan(T0 + DAY + 20, _listings(('b', 7.0)), [])
+    store.close()
+    partitions = HistoryReader(str(tmp_path)).partitions()
+    assert [p.scan_key.tolist() for p in partitions] == [[1], [0, 1]]
+    assert _floors(str(tmp_path)) == [(10, 5.0), (DAY + 20, 7.0)]
+
+
+def test_restart_skips_scans_without_base_state(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.record_scan(T0 + 10, _listings(('a', 5.0)), [])
+    store.close()
+    store = HistoryStore(str(tmp_path))
+    store.record_scan(T0 + 20, _listings(('c', 1.0)), [], complete=False)
+    store.record_updates(T0 + 25, [('d', KEY, 2.0, T0 + 100)])
+    store.record_scan(T0 + 30, _listings(('a', 6.0)), [])
+    store.close()
+    partition, = HistoryReader(str(tmp_path)).partitions()
+    assert partition.scan_key.tolist() == [1, 1]
+    assert _floors(str(tmp_path)) == [(10, 5.0), (30, 6.0)]
+
+
+def test_legacy_partitions_are_migrated(tmp_path):
+    root = str(tmp_path)
+    store = HistoryStore(root)
+    store.record_scan(T0 + 10, _listings(('a', 5.0), ('b', 7.0)), [])
+    store.record_scan(T0 + 20, _listings(('b', 7.0)), [])
+    store.close()
+    # Раздел версии 1: без scan_key и format.json
+    os.remove(os.path.join(root, FORMAT_FILE))
+    os.remove(os.path.join(root, _partition_name(root), 'scan_key.bin'))
+
+    store = HistoryStore(root)
+    store.record_scan(T0 + 30, _listings(('b', 6.0)), [])
+    store.close()
+    with open(os.path.join(root, FORMAT_FILE), encoding='utf-8') as f:
+        assert json.load(f)['version'] == FORMAT_VERSION
+    partition, = HistoryReader(root).partitions()
+    # Старые сканирования сохранились, дозапись началась со снимка
+    assert partition.scan_key.tolist() == [1, 0, 1]
+    assert _floors(root) == [(10, 5.0), (20, 7.0), (30, 6.0)]
+
+
+def test_newer_format_is_rejected(tmp_path):
+    root = str(tmp_path)
+    with open(os.path.join(root, FORMAT_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'version': FORMAT_VERSION + 1}, f)
+    with pytest.raises(ValueError):
+        HistoryStore(root)
+    with pytest.raises(ValueError):
+        HistoryReader(root)
+
+
+def test_iter_scans_marks_keyframes(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.record_scan(T0 + 10, _listings(('a', 5.0), ('b', 7.0)), [])
+    store.record_scan(T0 + 20, _listings(('a', 5.0), ('b', 8.0)), [])
+    store.close()
+    scans = list(HistoryReader(str(tmp_path)).iter_scans())
+    assert [(ts - T0, keyframe, len(rows['item'])) for ts, keyframe, rows in scans] == [
+        (10, True, 2), (20, False, 1)
+    ]
+    assert np.allclose(scans[1][2]['price'], [8.0])
+
+
+def test_retention_compacts_dictionaries(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'HISTORY_RETENTION_DAYS', 2)
+    root = str(tmp_path)
+    store = HistoryStore(root)
+    for day in range(4):
+        # Каждые сутки - новые лоты и одна новая модель
+        rows = [(f'{day}-{n}', ('Plush Pepe', f'Model {day}'), 5.0 + n, 0) for n in range(3)]
+        store.record_scan(T0 + day * DAY + 10, rows, [])
+    store.close()
+
+    reader = HistoryReader(root)
+    assert len(reader.partitions()) == 2
+    # Остались лоты и модели только последних двух суток
+    assert sorted(gift_id for _, gift_id in reader.items.values.values()) == [
+        '2-0', '2-1', '2-2', '3-0', '3-1', '3-2'
+    ]
+    assert sorted(model for _, model in reader.models.values.values()) == ['Model 2', 'Model 3']
+    times, floors = reader.floor_series('Plush Pepe', 'Model 3', days=None)
+    assert (times[-1] - T0, floors[-1]) == (3 * DAY + 10, 5.0)
+
+    # id удаленных значений не переиспользуются
+    store = HistoryStore(root)
+    used = set(store.items.values)
+    assert store.items.id_of((PORTALS, 'new')) > max(used)
+    store.close()
+
+
+def test_v2_dictionaries_are_migrated(tmp_path):
+    root = str(tmp_path)
+    store = HistoryStore(root)
+    store.record_scan(T0 + 10, _listings(('a', 5.0), ('b', 7.0)), [])
+    store.close()
+    # Словари версии 2: значение на строку, id - номер строки
+    for name in ('models.jsonl', 'items.jsonl'):
+        path = os.path.join(root, name)
+        with open(path, encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(value) + '\n' for _, value in sorted(lines))
+    with open(os.path.join(root, FORMAT_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'version': 2}, f)
+
+    assert _floors(root) == [(10, 5.0)]
+    store = HistoryStore(root)
+    store.record_scan(T0 + 20, _listings(('b', 7.0)), [])
+    store.close()
+    with open(os.path.join(root, 'items.jsonl'), encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == [[0, [PORTALS, 'a']], [1, [PORTALS, 'b']]]
+    assert _floors(root) == [(10, 5.0), (20, 7.0)]
@@ -0,0 +1,34 @@
+import asyncio
+from api.marketplace import MarketplaceClient
+
+
+class FakeAsyncClient:
+    last_scan_complete = True
+
+    def __init__(self):
+        self.loops = []
+        self.closed = 0
+
+    async def get_items(self, count):
+        self.loops.append(asyncio.get_running_loop())
+        return list(range(count))
+
+    async def close(self):
+        self.closed += 1
+
+
+class FakeClient(MarketplaceClient):
+    async_client = FakeAsyncClient
+
+    def get_items(self, count):
+        return self._run(self.client.get_items, count)
+
+
+def test_sync_client_runs_each_call_in_own_loop():
+    client = FakeClient()
+    assert client.get_items(3) == [0, 1, 2]
+    assert client.get_items(1) == [0]
+    # Сессия закрывается в каждом event loop, клиент - общий
+    assert client.client.closed == 2
+    assert len(client.client.loops) == 2
+    assert client.last_scan_complete
@@ -0,0 +1,10 @@
+from services.notifier import AlertNotifier
+from services.records import Opportunity
+
+
+def test_render_escapes_gift_names():
+    opp = Opportunity(1, 'Cat <3 & Dog', '<b>Gold</b>', 0, 4.0, 6.0, 4.1, 1.5,
+                      '0-5', 'tonnel', 'portals')
+    text = AlertNotifier._render([(1, (opp, 0.0))])
+    assert 'Cat &lt;3 &amp; Dog (&lt;b&gt;Gold&lt;/b&gt;)' in text
+    assert '<b>Gold</b>' not in text
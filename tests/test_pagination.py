@@ -0,0 +1,125 @@
+import asyncio
+import pytest
+from config import Config
+from api import pagination
+from api.pagination import iter_pages_async
+
+PAGE = 10
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(pagination, 'backoff', lambda attempt: 0)
+
+
+class Catalogue:
+    """Каталог из size элементов с постраничной выдачей по offset
+
+    failures - сколько раз подряд страница с данным offset отвечает
+    ошибкой (None), прежде чем отдать данные; total - отдавать ли meta.total.
+    """
+
+    def __init__(self, size, failures=None, total=False):
+        self.size = size
+        self.failures = dict(failures or {})
+        self.total = total
+        self.requests = []
+
+    async def fetch_page(self, offset, cursor):
+        self.requests.append(offset)
+        await asyncio.sleep(0)
+        if self.failures.get(offset, 0):
+            self.failures[offset] -= 1
+            return None
+        items = list(range(offset, min(offset + PAGE, self.size)))
+        return items, {'total': self.size} if self.total else {}
+
+
+def _collect(catalogue, **kwargs):
+    failed = []
+
+    async def run():
+        items = []
+        async for page in iter_pages_async(
+            catalogue.fetch_page, page_size=PAGE, concurrency=3, max_pages=50,
+            on_failed_page=lambda: failed.append(1), **kwargs
+        ):
+            items.extend(page)
+        return items
+
+    return sorted(asyncio.run(run())), len(failed)
+
+
+@pytest.mark.parametrize('size', [35, 30, 5, 0])
+def test_short_or_empty_page_ends_catalogue(size):
+    catalogue = Catalogue(size)
+    items, failed = _collect(catalogue)
+    assert items == list(range(size))
+    assert failed == 0
+    # За концом каталога запрашиваются не больше окна страниц
+    assert max(catalogue.requests) < size + PAGE * 4
+
+
+def test_total_limits_requests():
+    catalogue = Catalogue(35, total=True)
+    items, _ = _collect(catalogue)
+    assert items == list(range(35))
+    assert sorted(catalogue.requests) == [0, 10, 20, 30]
+
+
+def test_failed_page_is_retried():
+    catalogue = Catalogue(35, failures={10: Config.API_PAGE_RETRIES})
+    items, failed = _collect(catalogue)
+    assert items == list(range(35))
+    assert failed == 0
+    assert catalogue.requests.count(10) == Config.API_PAGE_RETRIES + 1
+
+
+def test_failed_page_does_not_end_catalogue():
+    catalogue = Catalogue(45, failures={10: Config.API_PAGE_RETRIES + 1})
+    items, failed = _collect(catalogue)
+    # Страница пропущена, но обход дошел до конца каталога
+    assert items == list(range(10)) + list(range(20, 45))
+    assert failed == 1
+
+
+def test_consecutive_failures_abort(monkeypatch):
+    monkeypatch.setattr(Config, 'API_MAX_FAILED_PAGES', 2)
+    failures = {offset: Config.API_PAGE_RETRIES + 1 for offset in range(PAGE, 1000, PAGE)}
+    catalogue = Catalogue(1000, failures=failures)
+    items, failed = _collect(catalogue)
+    assert items == list(range(10))
+    assert 2 <= failed <= 4
+    assert max(catalogue.requests) < 100
+
+
+def test_first_page_failure():
+    catalogue = Catalogue(35, failures={0: Config.API_PAGE_RETRIES + 1})
+    items, failed = _collect(catalogue)
+    assert items == []
+    assert failed == 1
+
+
+def test_stripes_split_catalogue():
+    catalogue = Catalogue(55)
+    stripes = [_collect(catalogue, stripe=stripe, stripes=2)[0] for stripe in range(2)]
+    assert stripes[0] == list(range(0, 10)) + list(range(20, 30)) + list(range(40, 50))
+    assert sorted(stripes[0] + stripes[1]) == list(range(55))
+
+
+def test_cursor_pagination():
+    async def fetch_page(offset, cursor):
+        position = int(cursor or 0)
+        items = list(range(position, min(position + PAGE, 25)))
+        next_cursor = str(position + PAGE) if position + PAGE < 25 else None
+        return items, {'next_cursor': next_cursor}
+
+    async def run(stripe):
+        items = []
+        async for page in iter_pages_async(fetch_page, page_size=PAGE, stripe=stripe, stripes=2):
+            items.extend(page)
+        return items
+
+    assert asyncio.run(run(0)) == list(range(25))
+    # Курсорный каталог целиком обходит нулевая полоса
+    assert asyncio.run(run(1)) == []
@@ -0,0 +1,29 @@
+import asyncio
+import queue
+import threading
+from services.sharding import ShardedScanner
+
+
+def test_waits_run_outside_default_executor():
+    scanner = ShardedScanner(shards=2, shard_by='collection')
+    # Без процессов: ответы шардов и процесса записи подменены
+    scanner.start = lambda: None
+    scanner._commands = [queue.Queue(), queue.Queue()]
+    scanner._writer_inbox = queue.Queue()
+    threads = []
+
+    def collect(scan_id, deadline):
+        threads.append(threading.current_thread().name)
+        return [({}, True), ({}, False)]
+
+    def wait_written(scan_id, deadline):
+        threads.append(threading.current_thread().name)
+        return 0, []
+
+    scanner._collect = collect
+    scanner._wait_written = wait_written
+    assert asyncio.run(scanner.scan()) == (0, [])
+    assert len(threads) == 2
+    assert all(name.startswith('scan-shards') for name in threads)
+    assert not scanner.last_scan_complete
+    assert [commands.get_nowait()[0] for commands in scanner._commands] == ['fetch', 'fetch']
@@ -0,0 +1,73 @@
+import itertools
+import random
+from services.records import Opportunity
+from services.subscriptions import Subscription, SubscriptionIndex
+
+NOW = 1_700_000_000
+RANGES = ('0-5', '5-10', '10-25')
+MODELS = ('Gold', 'Silver', 'Onyx')
+
+
+def _opp(profit=1.0, price_range='0-5', model='Gold', end_time=NOW + 600):
+    return Opportunity(1, 'Plush Pepe', model, end_time, 4.0, 6.0, 4.1, profit,
+                       price_range, 'tonnel', 'portals')
+
+
+def test_only_notified_subscriptions_are_indexed():
+    index = SubscriptionIndex([
+        Subscription(1, min_profit=0.5, notify=True),
+        Subscription(2, min_profit=0.5, notify=False),
+    ])
+    assert len(index) == 1
+    assert index.match(_opp(), NOW) == [1]
+
+
+def test_each_filter_dimension():
+    index = SubscriptionIndex([
+        Subscription(1, min_profit=2.0, notify=True),
+        Subscription(2, min_profit=0.5, price_ranges=['5-10'], notify=True),
+        Subscription(3, min_profit=0.5, models=['Silver'], notify=True),
+        Subscription(4, min_profit=0.5, max_time_to_end=300, notify=True),
+    ])
+    assert index.match(_opp(profit=0.1), NOW) == []
+    assert sorted(index.match(_opp(profit=3.0), NOW)) == [1]
+    assert sorted(index.match(_opp(price_range='5-10'), NOW)) == [2]
+    assert sorted(index.match(_opp(model='Silver'), NOW)) == [3]
+    assert sorted(index.match(_opp(end_time=NOW + 200), NOW)) == [4]
+
+
+def test_listing_without_end_fails_time_filter():
+    index = SubscriptionIndex([
+        Subscription(1, min_profit=0.5, max_time_to_end=300, notify=True),
+        Subscription(2, min_profit=0.5, notify=True),
+    ])
+    assert index.match(_opp(end_time=0), NOW) == [2]
+
+
+def test_empty_index():
+    assert SubscriptionIndex().match(_opp(), NOW) == []
+
+
+def test_matches_brute_force():
+    rng = random.Random(7)
+    subscriptions = [
+        Subscription(
+            chat_id,
+            min_profit=rng.choice((0.1, 0.5, 1.0, 2.0)),
+            price_ranges=rng.choice((None, rng.sample(RANGES, 1), rng.sample(RANGES, 2))),
+            models=rng.choice((None, rng.sample(MODELS, 1), rng.sample(MODELS, 2))),
+            max_time_to_end=rng.choice((None, 60, 600, 3600)),
+            notify=rng.random() < 0.9,
+        )
+        for chat_id in range(200)
+    ]
+    index = SubscriptionIndex(subscriptions)
+    opportunities = [
+        _opp(profit, price_range, model, end_time)
+        for profit, price_range, model, end_time in itertools.product(
+            (0.05, 0.5, 1.5, 3.0), RANGES, MODELS, (0, NOW + 30, NOW + 600, NOW + 7200)
+        )
+    ]
+    for opp in opportunities:
+        expected = sorted(sub.chat_id for sub in subscriptions if sub.notify and sub.matches(opp, NOW))
+        assert sorted(index.match(opp, NOW)) == expected
@@ -0,0 +1,143 @@
+import asyncio
+import itertools
+import time
+import pytest
+from config import Config
+from api.transport import AsyncTransport, CircuitBreaker, CircuitOpenError, host_state
+
+_hosts = itertools.count()
+
+
+def _opened(breaker):
+    """Разомкнутая цепь, у которой уже прошел reset_timeout"""
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker._opened_at -= breaker.reset_timeout
+    return breaker
+
+
+def _url():
+    # У каждого теста свой хост: состояние хостов общее на процесс
+    return f"http://breaker-{next(_hosts)}.test/v1/items"
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_admits_single_probe():
+    breaker = _opened(CircuitBreaker(failure_threshold=1, reset_timeout=30))
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+
+@pytest.mark.parametrize('success, state', [
+    (True, CircuitBreaker.CLOSED),
+    (False, CircuitBreaker.OPEN),
+])
+def test_probe_outcome(success, state):
+    breaker = _opened(CircuitBreaker(failure_threshold=5, reset_timeout=30))
+    assert breaker.allow()
+    if success:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+    assert breaker.state == state
+
+
+def test_aborted_probe_reopens_for_full_timeout():
+    breaker = _opened(CircuitBreaker(failure_threshold=1, reset_timeout=30))
+    assert breaker.allow()
+    breaker.abort_probe()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    breaker._opened_at -= breaker.reset_timeout
+    assert breaker.allow()
+
+
+def test_abort_probe_ignored_outside_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.abort_probe()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_probe_does_not_leave_circuit_half_open():
+    url = _url()
+    breaker = _opened(host_state(url).breaker)
+    transport = AsyncTransport(get_session=None)
+
+    async def hang(host, url, **kwargs):
+        await asyncio.sleep(60)
+
+    transport._attempt = hang
+
+    async def run():
+        probe = asyncio.ensure_future(transport.get(url, hedge=False))
+        await asyncio.sleep(0)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        # Пока цепь снова разомкнута, запросы отклоняются сразу
+        with pytest.raises(CircuitOpenError):
+            await transport.get(url, hedge=False)
+
+    asyncio.run(run())
+    assert breaker.state == CircuitBreaker.OPEN
+    assert time.monotonic() - breaker._opened_at < breaker.reset_timeout
+    breaker._opened_at -= breaker.reset_timeout
+    assert breaker.allow()
+
+
+def test_unexpected_probe_error_reopens_circuit():
+    url = _url()
+    breaker = _opened(host_state(url).breaker)
+    transport = AsyncTransport(get_session=None)
+
+    async def fail(host, url, **kwargs):
+        raise RuntimeError('invalid url')
+
+    transport._attempt = fail
+    with pytest.raises(RuntimeError):
+        asyncio.run(transport.get(url, hedge=False))
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.parametrize('enabled', [True, False])
+def test_hedge_default_follows_config(monkeypatch, enabled):
+    monkeypatch.setattr(Config, 'HTTP_HEDGE', enabled)
+    transport = AsyncTransport(get_session=None)
+    calls = []
+
+    class Response:
+        status = 200
+        headers = {}
+
+    async def attempt(host, url, **kwargs):
+        calls.append('attempt')
+        return Response()
+
+    async def hedged(host, url, **kwargs):
+        calls.append('hedged')
+        return Response()
+
+    transport._attempt = attempt
+    transport._hedged = hedged
+    asyncio.run(transport.get(_url()))
+    assert calls == ['hedged' if enabled else 'attempt']
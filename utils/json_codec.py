@@ -0,0 +1,42 @@
+import json
+
+try:
+    # Необязательная зависимость: разбор в несколько раз быстрее и без промежуточной строки
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def loads(data):
+    """Разбор JSON из bytes или str (orjson, если установлен, иначе stdlib)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode_page(body, items_field: str, record, on_error=None):
+    """Разбор страницы каталога: (записи, мета-поля ответа)
+
+    Элементы превращаются в записи по одному и сразу освобождаются, так
+    что словари ответа живут только на время разбора одной страницы, а
+    в мета-полях (total, next_cursor) не остается ссылок на список.
+    Элемент, который record() не может разобрать (нет поля, неверный
+    тип), пропускается с вызовом on_error(item, error); без on_error
+    ошибка пробрасывается.
+    """
+    payload = loads(body)
+    items = payload.pop(items_field, None) or []
+    records = []
+    # Разбор с конца: pop() отпускает словарь элемента сразу после преобразования
+    items.reverse()
+    while items:
+        item = items.pop()
+        try:
+            records.append(record(item))
+        except (KeyError, TypeError, ValueError) as e:
+            if on_error is None:
+                raise
+            on_error(item, e)
+    return records, payload
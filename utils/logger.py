@@ -1,31 +1,170 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+import time
+from datetime import datetime
 from config import Config
 
-def setup_logger(name, log_level=logging.INFO):
-    """Настройка логгера с указанным именем"""
-    logger = logging.getLogger(name)
-    logger.setLevel(log_level)
-    
-    # Создаем директорию для логов, если ее нет
+_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+
+
+class TextFormatter(logging.Formatter):
+    """Текстовый формат; к сообщению добавляется число пропущенных похожих записей"""
+
+    def formatMessage(self, record):
+        message = super().formatMessage(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            message = f"{message} [{suppressed} similar messages suppressed]"
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-запись на строку (для разбора сборщиками логов)"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Ограничение повторяющихся сообщений одного места вызова
+
+    Из каждой строки кода пропускается не больше LOG_SAMPLE_BURST записей
+    за LOG_SAMPLE_WINDOW секунд; первая запись следующего окна сообщает,
+    сколько было пропущено (атрибут suppressed, его выводят форматтеры
+    модуля; msg и args записи не меняются). Ошибки не отбрасываются никогда.
+    """
+
+    def __init__(self, burst: int, window: float, max_level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.max_level = max_level
+        # (файл, строка) -> [начало окна, записей в окне, пропущено]
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке
+
+    Стандартный prepare() форматирует запись до постановки в очередь;
+    здесь запись передается как есть, а форматирует ее поток слушателя.
+    При переполнении очереди запись отбрасывается, а не блокирует поток.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _build_handlers():
+    """Файловый (с ротацией) и консольный обработчики слушателя"""
     log_dir = os.path.join(os.path.dirname(Config.DB_PATH), 'logs')
     os.makedirs(log_dir, exist_ok=True)
-    
+    log_path = os.path.join(log_dir, 'bot.log')
+
+    if Config.LOG_ROTATION == 'time':
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_path, when='midnight', backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_path, maxBytes=Config.LOG_MAX_BYTES,
+            backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+
     # Форматирование
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    
-    # Файловый обработчик
-    file_handler = logging.FileHandler(
-        os.path.join(log_dir, f'{name}.log')
-    )
-    file_handler.setFormatter(formatter)
-    
-    # Консольный обработчик
+    if Config.LOG_JSON:
+        formatter = JsonFormatter()
+    else:
+        formatter = TextFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
     console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+    return file_handler, console_handler
+
+
+def _get_queue_handler():
+    """Общий QueueHandler; слушатель с файловым выводом запускается один раз"""
+    global _queue_handler, _listener
+    with _lock:
+        if _queue_handler is None:
+            log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+            _queue_handler = _NonBlockingQueueHandler(log_queue)
+            _queue_handler.addFilter(
+                SamplingFilter(Config.LOG_SAMPLE_BURST, Config.LOG_SAMPLE_WINDOW)
+            )
+            _listener = logging.handlers.QueueListener(
+                log_queue, *_build_handlers(), respect_handler_level=True
+            )
+            _listener.start()
+            atexit.register(stop_logging)
+        return _queue_handler
+
+
+def stop_logging():
+    """Запись оставшихся сообщений и остановка потока слушателя"""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def setup_logger(name, log_level=logging.INFO):
+    """Настройка логгера с указанным именем (повторный вызов ничего не добавляет)"""
+    logger = logging.getLogger(name)
+    logger.setLevel(log_level)
+
+    handler = _get_queue_handler()
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+        # Записи не дублируются через обработчики корневого логгера
+        logger.propagate = False
     return logger
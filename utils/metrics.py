@@ -0,0 +1,248 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.logger import setup_logger
+
+logger = setup_logger('metrics')
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание и дочерние серии по меткам
+
+    Метрика без labelnames хранит значение сама. С labelnames значения
+    живут в дочерних сериях, которые создает labels(**values).
+    """
+
+    type_name = 'untyped'
+
+    def __init__(self, name: str, help_text: str = '', labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        return type(self)(self.name, self.help)
+
+    def labels(self, **values):
+        """Серия метрики для конкретных значений меток"""
+        key = tuple(str(values[label]) for label in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def series(self):
+        """[(((метка, значение), ...), серия)] для экспорта"""
+        if not self.labelnames:
+            return [((), self)]
+        with self._lock:
+            return [
+                (tuple(zip(self.labelnames, key)), child)
+                for key, child in self._children.items()
+            ]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, help_text: str = '', labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Gauge(_Metric):
+    """Текущее значение величины (глубина очереди и т.п.)"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, help_text: str = '', labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин"""
+
+    type_name = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name: str, help_text: str = '', labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Последняя корзина - +Inf
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """(накопительные счетчики по корзинам, сумма, количество)"""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative, running = [], 0
+        for value in counts:
+            running += value
+            cumulative.append(running)
+        return cumulative, total, count
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхним границам корзин"""
+        cumulative, _, count = self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        for bound, value in zip(self.buckets, cumulative):
+            if value >= rank:
+                return bound
+        return float('inf')
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса; повторная регистрация возвращает ту же метрику"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, help_text, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str = '', labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labelnames=labelnames)
+
+    def gauge(self, name: str, help_text: str = '', labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labelnames=labelnames)
+
+    def histogram(self, name: str, help_text: str = '', labelnames=(),
+                  buckets=Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labelnames=labelnames, buckets=buckets)
+
+    def all(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus"""
+        lines = []
+        for metric in sorted(self.all(), key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for labels, series in metric.series():
+                if isinstance(series, Histogram):
+                    cumulative, total, count = series.snapshot()
+                    bounds = series.buckets + (float('inf'),)
+                    for bound, value in zip(bounds, cumulative):
+                        le = (('le', _format_value(bound)),)
+                        lines.append(f"{metric.name}_bucket{_format_labels(labels, le)} {value}")
+                    lines.append(f"{metric.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                    lines.append(f"{metric.name}_count{_format_labels(labels)} {count}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(series.value)}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """Краткая сводка для чата: счетчики, значения и p50/p95 гистограмм"""
+        lines = []
+        for metric in sorted(self.all(), key=lambda m: m.name):
+            for labels, series in metric.series():
+                name = metric.name + _format_labels(labels)
+                if isinstance(series, Histogram):
+                    _, total, count = series.snapshot()
+                    if count:
+                        lines.append(
+                            f"{name}: n={count} avg={total / count:.3f} "
+                            f"p50≤{series.quantile(0.5)} p95≤{series.quantile(0.95)}"
+                        )
+                else:
+                    lines.append(f"{name}: {_format_value(series.value)}")
+        return '\n'.join(lines)
+
+
+metrics = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = metrics
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Запросы сборщика метрик не засоряют лог
+        pass
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1', registry: MetricsRegistry = metrics):
+    """HTTP-эндпоинт /metrics в фоновом потоке; возвращает сервер для shutdown()
+
+    Если порт занят или недоступен, бот работает без эндпоинта: возвращается None.
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint disabled, cannot listen on {host}:{port}: {str(e)}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """Потокобезопасное ведро токенов для ограничения частоты операций
+
+    rate - токенов в секунду, capacity - максимальный запас (размер всплеска).
+    consume() позволяет уйти в долг: тогда следующие операции ждут, пока
+    средняя частота не вернется к rate.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def set_rate(self, rate: float, capacity: float = None):
+        """Изменение скорости пополнения (с учетом уже накопленного)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            if capacity is not None:
+                self.capacity = capacity
+                self._tokens = min(self._tokens, capacity)
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Забрать токены, если они есть"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return True
+            return False
+
+    def consume(self, amount: float):
+        """Безусловное списание (в том числе в долг)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+
+    def wait_time(self, amount: float = 1) -> float:
+        """Секунд до появления нужного количества токенов"""
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = amount - self._tokens
+            if missing <= 0:
+                return 0.0
+            return missing / self.rate if self.rate > 0 else float('inf')
+
+    def acquire(self, amount: float = 1):
+        """Блокирующее ожидание токенов"""
+        while not self.try_acquire(amount):
+            time.sleep(max(self.wait_time(amount), 0.001))
+
+    async def acquire_async(self, amount: float = 1):
+        """Ожидание токенов без блокировки event loop"""
+        while not self.try_acquire(amount):
+            await asyncio.sleep(max(self.wait_time(amount), 0.001))